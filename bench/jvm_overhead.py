@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# TCRFactory: the per-call overhead of the java tools in the plain JVM and the warm nailgun server modes.
+# The tools are run with no arguments (they print the usage), so the time is mostly the JVM startup; MiXCR also aligns
+# synthetic paired reads as the step Align does (the heap of -m): the time of the work is the same in both modes.
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lib.inout import Bin, Xmx
+from lib.jvm import JavaLauncher
+from synthetic import write_pair
+
+
+def measure(get_cmd, args, n_calls, launcher, before=None):  # the first call is reported apart: it starts the server
+    times = []
+    cmd = ''
+    for _ in range(n_calls + 1):
+        if before:
+            before()
+        cmd = get_cmd()
+        port = launcher.port(cmd)
+        start = time.perf_counter()
+        try:
+            subprocess.run(cmd + args, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        finally:
+            if port is not None:
+                launcher.called(port)  # the server is idle for the next call
+        times.append(time.perf_counter() - start)
+
+    return times, cmd.split()[0]
+
+
+def align_calls(work_dir, n_reads):  # the arguments of a MiXCR align call and the cleaner of its output
+    r1, r2, alignments = work_dir + '/S1_R1.fastq.gz', work_dir + '/S1_R2.fastq.gz', work_dir + '/S1.vdjca'
+    write_pair(r1, r2, ['ACGTACGT'], n_reads, 150, 12, random.Random(1))
+    args = ' align -OreadsLayout=Collinear -s hsa -r {0}/S1.report.txt {1} {2} {3}'.format(work_dir, r1, r2,
+                                                                                         alignments)
+
+    def clean():
+        for file_name in (alignments, work_dir + '/S1.report.txt'):
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    return args, clean
+
+
+def main():
+    input_parser = argparse.ArgumentParser(description='The per-call overhead of the java tools.')
+    input_parser.add_argument('-b', metavar='/path/to/bin', required=True, help='the bin directory with the tools')
+    input_parser.add_argument('-m', metavar='6G', default='6G', help='Xmx memory size')
+    input_parser.add_argument('-n', metavar='10', default=10, type=int, help='the number of calls per tool')
+    input_parser.add_argument('--jvm-port', metavar='2113', default=2113, type=int, help='nailgun port')
+    input_parser.add_argument('--align-reads', metavar='100000', default=100000, type=int,
+                              help='the number of the synthetic read pairs aligned by MiXCR, 0 - no align calls')
+    args = input_parser.parse_args()
+
+    Bin(args.b)
+    Xmx(args.m)
+    launcher = JavaLauncher('nailgun', args.jvm_port)
+    jars = [Bin().find(name) for name in ('migec*.jar', 'mixcr*.jar', 'vdjtools*.jar')]
+    jars = [jar for jar in jars if jar]
+    if not jars:
+        exit('No java tools in the bin directory: {}'.format(args.b))
+    for jar in jars:
+        launcher.register(jar)
+
+    work_dir = tempfile.mkdtemp(prefix='jvm_overhead.')
+    calls = [(jar, 'usage', '', None) for jar in jars]
+    mixcr = [jar for jar in jars if os.path.basename(jar).startswith('mixcr')]
+    if mixcr and args.align_reads:
+        calls.append((mixcr[0], 'align {} reads'.format(args.align_reads)) +
+                     align_calls(work_dir, args.align_reads))
+
+    print('\t'.join(('tool', 'call', 'mode', 'calls', 'first_s', 'median_s', 'mean_s')))
+    try:
+        for jar, call, call_args, before in calls:
+            plain = measure(lambda: 'java {} -jar {}'.format(Xmx().get(), jar), call_args, args.n, launcher, before)
+            warm = measure(lambda: launcher.command(jar), call_args, args.n, launcher, before)
+            for (times, runner), mode in ((plain, 'subprocess'), (warm, 'nailgun')):
+                if mode == 'nailgun' and runner != 'ng':
+                    mode = 'nailgun (fallback to subprocess)'
+                print('\t'.join((os.path.basename(jar), call, mode, str(args.n), '{:.3f}'.format(times[0]),
+                                 '{:.3f}'.format(statistics.median(times[1:])),
+                                 '{:.3f}'.format(statistics.mean(times[1:])))))
+    finally:
+        launcher.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
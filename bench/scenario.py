@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# TCRFactory: the offline orchestration benchmark.
+# MiSeqPipe/NextSeqPipe run over synthetic data with the stub tools (bench/stubs) for several worker counts;
+# the throughput in samples per hour shows the orchestration overhead and the scheduling scalability.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from synthetic import generate
+
+
+def stub_bin(bin_dir):
+    for tool, jar in (('migec', 'migec-stub.jar'), ('mixcr', 'mixcr-stub.jar'), ('vdjtools', 'vdjtools-stub.jar')):
+        os.makedirs(bin_dir + '/' + tool, exist_ok=True)
+        open(bin_dir + '/' + tool + '/' + jar, 'w').close()
+    open(bin_dir + '/histogram.R', 'w').close()
+
+
+def run_pipe(seq_tool, in_dir, out_dir, bin_dir, n_workers, xmx):  # in a child process: the settings are singletons
+    from lib.inout import Bin, Log, Xmx, Workers
+    from lib.pipeline import MiSeqPipe, NextSeqPipe
+
+    Bin(bin_dir)
+    Xmx(xmx)
+    Workers(n_workers)
+    pipe = MiSeqPipe(in_dir, out_dir) if seq_tool == 'MiSeq' else NextSeqPipe(in_dir, out_dir)
+    pipe.execute(Log(out_dir + '.log'))
+
+
+def main():
+    input_parser = argparse.ArgumentParser(description='TCRFactory orchestration benchmark with the stub tools.')
+    input_parser.add_argument('-t', metavar='MiSeq,NextSeq', default='MiSeq,NextSeq', help='the pipelines')
+    input_parser.add_argument('-s', metavar='16', type=int, default=16, help='the number of samples')
+    input_parser.add_argument('-r', metavar='1000', type=int, default=1000, help='the number of reads per sample')
+    input_parser.add_argument('-w', metavar='1,2,4,8', default='1,2,4,8', help='the worker counts')
+    input_parser.add_argument('-m', metavar='8G', default='8G', help='Xmx memory size')
+    input_parser.add_argument('--latency', metavar='0.5', default='0.5', help='the stub latency per call, s')
+    input_parser.add_argument('--output-kb', metavar='64', default='64', help='the stub output file size, KB')
+    input_parser.add_argument('--multiplexed', action='store_true', help='all samples in one pair of FASTQ files')
+    input_parser.add_argument('--keep', metavar='/path/to/dir', default=None, help='keep the data in the directory')
+    input_parser.add_argument('--child', nargs=5, help=argparse.SUPPRESS)
+    args = input_parser.parse_args()
+
+    if args.child:
+        seq_tool, in_dir, out_dir, bin_dir, n_workers = args.child
+        run_pipe(seq_tool, in_dir, out_dir, bin_dir, n_workers, args.m)
+        return
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix='tcr-bench-')
+    in_dir = work_dir + '/input'
+    bin_dir = work_dir + '/bin'
+    generate(in_dir, args.s, args.r, multiplexed=args.multiplexed)
+    stub_bin(bin_dir)
+
+    child_env = dict(os.environ)
+    child_env['PATH'] = BENCH_DIR + '/stubs' + os.pathsep + child_env.get('PATH', '')
+    child_env['TCR_STUB_LATENCY'] = args.latency
+    child_env['TCR_STUB_OUTPUT_KB'] = args.output_kb
+
+    print('\t'.join(('pipe', 'samples', 'workers', 'wall_s', 'samples_per_hour', 'speedup', 'efficiency')))
+    try:
+        for seq_tool in args.t.split(','):
+            base = None  # the wall time and the workers of the first run
+            for n_workers in [int(n) for n in args.w.split(',')]:
+                out_dir = '{}/output-{}-{}'.format(work_dir, seq_tool, n_workers)
+                shutil.rmtree(out_dir, ignore_errors=True)
+                start = time.perf_counter()
+                subprocess.run([sys.executable, os.path.abspath(__file__), '-m', args.m, '--child',
+                                seq_tool, in_dir, out_dir, bin_dir, str(n_workers)],
+                               env=child_env, check=True, stdout=subprocess.DEVNULL)
+                wall = time.perf_counter() - start
+                base = base or (wall, n_workers)
+                speedup = base[0] / wall
+                print('\t'.join((seq_tool, str(args.s), str(n_workers), '{:.2f}'.format(wall),
+                                 '{:.0f}'.format(args.s * 3600 / wall), '{:.2f}'.format(speedup),
+                                 '{:.2f}'.format(speedup * base[1] / n_workers))))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
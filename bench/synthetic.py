@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# TCRFactory: a generator of synthetic paired gzip FASTQ files and the matching SampleInfo file.
+
+import os
+import gzip
+import random
+import argparse
+
+NUCLEOTIDES = 'ACGT'
+
+
+def random_seq(rnd, length):
+    return ''.join(rnd.choice(NUCLEOTIDES) for _ in range(length))
+
+
+def write_pair(r1_file, r2_file, barcodes, n_reads, read_len, umi_len, rnd):
+    # R1 starts with a sample barcode and an UMI, the samples are mixed in the order of the reads
+    with gzip.open(r1_file, 'wt', compresslevel=1) as r1, gzip.open(r2_file, 'wt', compresslevel=1) as r2:
+        for i in range(n_reads):
+            barcode = barcodes[i % len(barcodes)]
+            seq1 = barcode + random_seq(rnd, umi_len)
+            seq1 += random_seq(rnd, max(0, read_len - len(seq1)))
+            seq2 = random_seq(rnd, read_len)
+            name = '@SYN:1:FC:1:1:{}:{}'.format(i // 1000, i % 1000)
+            r1.write('{} 1:N:0:1\n{}\n+\n{}\n'.format(name, seq1, 'I' * len(seq1)))
+            r2.write('{} 2:N:0:1\n{}\n+\n{}\n'.format(name, seq2, 'I' * len(seq2)))
+
+
+def generate(out_dir, n_samples=8, n_reads=10000, read_len=150, barcode_len=8, umi_len=12, multiplexed=False,
+             chain='TRB', seed=1):
+    rnd = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    barcodes = []
+    while len(barcodes) < n_samples:
+        barcode = random_seq(rnd, barcode_len)
+        if barcode not in barcodes:
+            barcodes.append(barcode)
+
+    rows = []
+    if multiplexed:  # all samples in one shared pair of files
+        write_pair(out_dir + '/run_R1.fastq.gz', out_dir + '/run_R2.fastq.gz', barcodes, n_reads * n_samples,
+                   read_len, umi_len, rnd)
+    for i, barcode in enumerate(barcodes):
+        sample_name = 'S{}'.format(i + 1)
+        if multiplexed:
+            r1, r2 = 'run_R1.fastq.gz', 'run_R2.fastq.gz'
+        else:
+            r1, r2 = sample_name + '_R1.fastq.gz', sample_name + '_R2.fastq.gz'
+            write_pair(out_dir + '/' + r1, out_dir + '/' + r2, [barcode], n_reads, read_len, umi_len, rnd)
+        rows.append((sample_name, chain, barcode + 'N' * umi_len, r1, r2, 'baseline', 'subject{}'.format(i + 1),
+                     'antigen', str(n_reads)))
+
+    sample_info = out_dir + '/SampleInfo.txt'
+    with open(sample_info, 'w') as file:
+        file.write('\t'.join(('Sample_name', 'Chain', 'Barcode', 'R1', 'R2',
+                              'Baseline', 'Subject_id', 'Antigen', 'Reads_exp')) + '\n')
+        for row in rows:
+            file.write('\t'.join(row) + '\n')
+
+    return sample_info
+
+
+def main():
+    input_parser = argparse.ArgumentParser(description='Synthetic input data for TCRFactory.')
+    input_parser.add_argument('-o', metavar='/path/to/input_dir', required=True, help='the output directory')
+    input_parser.add_argument('-s', metavar='8', type=int, default=8, help='the number of samples')
+    input_parser.add_argument('-r', metavar='10000', type=int, default=10000, help='the number of reads per sample')
+    input_parser.add_argument('-l', metavar='150', type=int, default=150, help='the read length')
+    input_parser.add_argument('--barcode', metavar='8', type=int, default=8, help='the sample barcode length')
+    input_parser.add_argument('--umi', metavar='12', type=int, default=12, help='the UMI length')
+    input_parser.add_argument('--multiplexed', action='store_true', help='all samples in one pair of FASTQ files')
+    input_parser.add_argument('--seed', metavar='1', type=int, default=1, help='the random seed')
+    args = input_parser.parse_args()
+
+    print(generate(args.o, args.s, args.r, args.l, args.barcode, args.umi, args.multiplexed, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
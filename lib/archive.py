@@ -0,0 +1,156 @@
+import os
+import re
+import zlib
+import queue
+import struct
+import fnmatch
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.inout import Workers
+
+
+class Archiver:
+    # the tar.gz of the output dir written while the pipeline runs: the results of a step are added as soon as it
+    # is done, the rest of the files at the end; every block is a separate gzip member (the members of a gzip file
+    # are concatenated), so the blocks are compressed at the same time and the compressed files are only stored
+    block_size = 4 << 20
+    stored = ('*.gz', '*.bz2', '*.xz', '*.zip', '*.png', '*.jpg', '*.pdf', '*.vdjca', '*.clns')
+    deferred = ('*.log', '*.log.txt', '*.jsonl', 'qc.txt', 'metrics.csv', 'checkpoints.json', 'progress.json')
+
+    def __init__(self, file_name, out_dir, skip=(), n_workers=None):
+        self._file_name = file_name
+        self._part_name = file_name + '.part'
+        self._out_dir = re.sub(r'/$', '', out_dir)
+        self._skip = tuple(skip)
+        self._archived = {}  # the archive name -> (size, mtime) of the added file
+        self._lock = threading.Lock()
+        n_workers = int(n_workers) if n_workers else Workers().get()
+        self._pool = ThreadPoolExecutor(max_workers=n_workers)
+        self._files = queue.Queue()
+        self._blocks = queue.Queue(maxsize=2 * n_workers)  # the compressed blocks in the archive order
+        self._file = open(self._part_name, 'wb')
+        self._error = None
+        self._closed = False
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._feeder.start()
+        self._writer.start()
+
+    @staticmethod
+    def _member(data, level):  # a gzip member without the file name and the time, so the same data gives the same bytes
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(data) + compressor.flush()
+        header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00' + (b'\x04' if level == 1 else b'\x00') + b'\xff'
+
+        return header + body + struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+
+    def _submit(self, data, level):
+        self._blocks.put(self._pool.submit(self._member, data, level))
+
+    def _add_file(self, file_name, name):
+        stat = os.stat(file_name)
+        info = tarfile.TarInfo(name)
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        info.mode = stat.st_mode & 0o7777
+        level = 0 if any(fnmatch.fnmatch(file_name, mask) for mask in self.stored) else 6
+
+        self._submit(info.tobuf(tarfile.PAX_FORMAT), level)
+        n_bytes = 0
+        with open(file_name, 'rb') as file:
+            while n_bytes < info.size:
+                data = file.read(min(self.block_size, info.size - n_bytes))
+                if not data:  # the file is truncated while it is archived
+                    data = b'\0' * (info.size - n_bytes)
+                n_bytes += len(data)
+                self._submit(data, level)
+        if info.size % tarfile.BLOCKSIZE:
+            self._submit(b'\0' * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE), level)
+
+    def _feed(self):
+        while True:
+            file_name = self._files.get()
+            if file_name is None:
+                break
+            if self._error:
+                continue
+            try:
+                name = './' + os.path.relpath(file_name, self._out_dir)
+                stat = os.stat(file_name)
+                with self._lock:
+                    if name in self._archived:  # a tar member is written once
+                        if self._archived[name] != (stat.st_size, stat.st_mtime_ns):
+                            raise OSError('the file {} is changed after it is archived'.format(file_name))
+                        continue
+                    self._archived[name] = (stat.st_size, stat.st_mtime_ns)
+                self._add_file(file_name, name)
+            except OSError as error:
+                self._error = self._error or error
+        self._submit(b'\0' * 2 * tarfile.BLOCKSIZE, 6)  # the end of the archive
+        self._blocks.put(None)
+
+    def _write(self):
+        while True:
+            future = self._blocks.get()
+            if future is None:
+                break
+            try:
+                self._file.write(future.result())
+            except Exception as error:
+                self._error = self._error or error
+
+    def _skipped(self, file_name):
+        return os.path.islink(file_name) or not os.path.isfile(file_name) or \
+            os.path.abspath(file_name) in (os.path.abspath(self._file_name), os.path.abspath(self._part_name)) or \
+            any(fnmatch.fnmatch(os.path.basename(file_name), mask) for mask in self._skip)
+
+    def _deferred(self, file_name):  # the files which may still change (the logs, the run tables) are added by close
+        return any(fnmatch.fnmatch(os.path.basename(file_name), mask) for mask in self.deferred)
+
+    def add(self, file_name):
+        if not self._closed and not self._skipped(file_name) and not self._deferred(file_name):
+            self._files.put(file_name)
+
+    def finished(self, task, graph):  # called by TaskGraph: the files no later step reads are the results
+        if not task.outputs:
+            return
+        descendants = graph.descendants(task)
+        # the intermediates may be retired (see Retention), the kept ones are added by close
+        intermediates = set(task.intermediates()) if task.intermediates else set()
+        if all(other.inputs for other in descendants if task in other.deps):
+            for file_name in task.outputs():
+                if file_name not in intermediates and not any(file_name in other.inputs() for other in descendants):
+                    self.add(file_name)
+
+    def close(self):  # the files not added yet are added, then the archive is renamed
+        for dir_name, dir_names, file_names in os.walk(self._out_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if not self._skipped(os.path.join(dir_name, file_name)):
+                    self._files.put(os.path.join(dir_name, file_name))
+        self._stop()
+        if self._error:
+            os.remove(self._part_name)
+            raise Exception("Can't create the archive {}: {}".format(self._file_name, self._error))
+        os.replace(self._part_name, self._file_name)
+
+    def abort(self):
+        if not self._closed:
+            self._stop()
+            if os.path.exists(self._part_name):
+                os.remove(self._part_name)
+
+    def _stop(self):
+        self._closed = True
+        self._files.put(None)
+        self._feeder.join()
+        self._writer.join()
+        self._pool.shutdown()
+        self._file.close()
+
+    def closed(self):
+        return self._closed
+
+# end of class Archiver
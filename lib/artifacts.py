@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from lib.inout import Bin
+
+
+class ArtifactCache:
+    # the downloaded tool archives: a read-only mirror directory first, then the checksummed local cache
+    def __new__(cls, mirror_dir=None, cache_dir=None):
+        if not hasattr(cls, 'instance'):
+            cls._mirror = re.sub(r'/$', '', mirror_dir) if mirror_dir else None
+            cls._cache = re.sub(r'/$', '', cache_dir) if cache_dir else Bin().path() + '/.cache'
+            cls._lock = threading.Lock()
+            cls.instance = super(ArtifactCache, cls).__new__(cls)
+
+        return cls.instance
+
+    @staticmethod
+    def _sha256(file_name):
+        sha = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    @staticmethod
+    def _base_name(url):
+        return re.sub(r'[^A-Za-z0-9._-]', '', re.sub(r'\?.*$', '', url).split('/')[-1]) or 'artifact'
+
+    def _cached(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        return '{}/{}-{}'.format(self._cache, key, self._base_name(url))
+
+    def _verified(self, file_name):  # the artifact is used only if its content matches the recorded checksum
+        if not os.path.isfile(file_name) or not os.path.isfile(file_name + '.json'):
+            return False
+        try:
+            with open(file_name + '.json', 'r') as file:
+                meta = json.load(file)
+        except ValueError:
+            return False
+
+        return meta.get('sha256') == self._sha256(file_name)
+
+    def fetch(self, url):  # the path to the local copy of the artifact
+        if self._mirror:
+            mirrored = self._mirror + '/' + self._base_name(url)
+            if os.path.isfile(mirrored):
+                return mirrored
+
+        file_name = self._cached(url)
+        with self._lock:
+            os.makedirs(self._cache, exist_ok=True)
+        if self._verified(file_name):
+            return file_name
+
+        import requests  # only if the artifact has to be downloaded
+
+        tmp_name = '{}.{}.part'.format(file_name, threading.get_ident())
+        with requests.get(url, stream=True, allow_redirects=True) as response:
+            response.raise_for_status()
+            with open(tmp_name, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    file.write(chunk)
+        os.replace(tmp_name, file_name)
+        with open(file_name + '.json', 'w') as file:
+            json.dump({'url': url, 'sha256': self._sha256(file_name)}, file)
+
+        return file_name
+
+# end of class ArtifactCache (Singleton)
+
+
+class ToolState:
+    # the verified tools: a tool is not probed again while its stamp (path, size, mtime, url) is the same
+    file_name = '.tools.json'
+
+    def __init__(self):
+        self._file = Bin().path() + '/' + self.file_name
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.isfile(self._file):
+            try:
+                with open(self._file, 'r') as file:
+                    self._state = json.load(file)
+            except ValueError:
+                self._state = {}
+
+    @staticmethod
+    def key(tool):
+        return type(tool).__name__
+
+    def verified(self, tool):
+        stamp = tool.stamp()
+        with self._lock:
+            return stamp is not None and self._state.get(self.key(tool)) == stamp
+
+    def set(self, tool):
+        stamp = tool.stamp()
+        with self._lock:
+            if stamp is None:
+                self._state.pop(self.key(tool), None)
+            else:
+                self._state[self.key(tool)] = stamp
+
+    def write(self):
+        with self._lock:
+            try:
+                with open(self._file, 'w') as file:  # in place: a new file would change the bin index
+                    json.dump(self._state, file, indent=1, sort_keys=True)
+            except OSError:
+                pass
+
+# end of class ToolState
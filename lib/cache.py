@@ -0,0 +1,186 @@
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+from lib.scratch import Scratch
+
+
+class ResultCache:
+    # the outputs of the sample steps shared by the runs: an entry is keyed by the content of the step inputs and the
+    # step parameters (the tool jar, the chain, overseq, ...), a hit links the cached files into the output dir
+    # instead of running the step; of a run-wide table only the rows of the sample are keyed (Task.input_parts), so
+    # a new sample of the run doesn't change the keys of the others; the least recently used entries are evicted above
+    # the size limit
+    steps = ('AssembleBatch', 'Analyze', 'Align', 'Assemble', 'ExportClones', 'Convert', 'Filter', 'ConvertFilter')
+    manifest_name = 'manifest.json'
+    small_file = 1 << 20  # the out dir paths in the smaller files do not change the key
+
+    def __init__(self, cache_dir, limit, out_dir, checkpoint=None):
+        self._dir = re.sub(r'/$', '', cache_dir)
+        self._limit = self._size(limit)
+        self._out_dir = os.path.abspath(out_dir)
+        self._checkpoint = checkpoint  # the content hashes of the big files are shared with the checkpoints
+        self._lock = threading.Lock()
+        self._keys = {}  # the task -> the key of the missed entry
+        self._counts = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+        os.makedirs(self._dir + '/tmp', exist_ok=True)
+
+    @staticmethod
+    def _size(size):  # 512M, 50G, ... in bytes
+        match = re.match(r'^(\d+)([KMGT]?)B?$', str(size).upper())
+        if not match:
+            raise Exception('Wrong the cache size: {}'.format(size))
+
+        return int(match.group(1)) << (10 * ' KMGT'.index(match.group(2) or ' '))
+
+    def _name(self, file_name):  # the place of the file in the output dir, the base name of an input file
+        path = os.path.abspath(file_name)
+        if path.startswith(self._out_dir + '/'):
+            return os.path.relpath(path, self._out_dir)
+
+        return os.path.basename(path)
+
+    def _hash(self, file_name):
+        if os.path.getsize(file_name) < self.small_file:
+            with open(file_name, 'rb') as file:
+                return hashlib.sha256(file.read().replace(self._out_dir.encode(), b'<out>')).hexdigest()
+        if self._checkpoint:
+            return self._checkpoint.file_hash(file_name)
+
+        sha = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    def key(self, task):
+        parts = task.input_parts() if task.input_parts else {}
+        sha = hashlib.sha256('{}/{}\0'.format(task.stage, task.step).encode())
+        for file_name in sorted(set(task.inputs()), key=self._name):
+            if file_name in parts:
+                content = hashlib.sha256(parts[file_name].replace(self._out_dir, '<out>').encode()).hexdigest()
+            else:
+                content = self._hash(file_name)
+            sha.update(self._name(file_name).encode() + b'\0' + content.encode() + b'\0')
+        sha.update(json.dumps(task.params, sort_keys=True, default=str).encode())
+
+        return sha.hexdigest()
+
+    def _entry(self, key):
+        return '{}/{}/{}'.format(self._dir, key[:2], key)
+
+    def cacheable(self, task):
+        return task.step in self.steps and task.inputs is not None and task.outputs is not None
+
+    @staticmethod
+    def _link(source, target):  # a hard link if the cache is on the same file system
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    def fetch(self, task):  # the step output of a hit, None of a miss
+        if not self.cacheable(task):
+            return None
+        key = self.key(task)
+        manifest_file = '{}/{}'.format(self._entry(key), self.manifest_name)
+        try:
+            with open(manifest_file, 'r') as file:
+                manifest = json.load(file)
+            for name in manifest['files']:
+                source = '{}/files/{}'.format(self._entry(key), name)
+                target = os.path.join(self._out_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                placed = target  # the intermediates go to the scratch as they did in the run of the entry
+                if name in manifest.get('scratch', []):
+                    placed = Scratch().place(target, os.path.getsize(source))
+                self._link(source, placed)
+                Scratch().keep(target, placed)
+            os.utime(manifest_file)  # the entry is used recently
+        except (OSError, ValueError, KeyError):  # no entry or the entry is evicted by another run
+            self.detach(task)
+            with self._lock:
+                self._keys[task] = key
+                self._counts['misses'] += 1
+            return None
+
+        with self._lock:
+            self._counts['hits'] += 1
+        return 'The step is restored from the cache ({}).\n'.format(key[:12]) + manifest.get('output', '')
+
+    def detach(self, task):  # the old outputs linked to the cache are not overwritten in place by the step
+        for file_name in task.outputs():
+            if not os.path.islink(file_name) and os.path.isfile(file_name) and os.stat(file_name).st_nlink > 1:
+                os.remove(file_name)
+
+    def store(self, task, output):
+        with self._lock:
+            key = self._keys.pop(task, None)
+        if not key or os.path.isdir(self._entry(key)):
+            return
+        files = {}
+        scratch = []
+        for file_name in task.outputs():
+            if not os.path.abspath(file_name).startswith(self._out_dir + '/'):
+                return  # a file out of the output dir
+            files[self._name(file_name)] = os.path.realpath(file_name)
+            if os.path.realpath(file_name) != os.path.abspath(file_name):  # a file on the scratch is linked
+                scratch.append(self._name(file_name))
+
+        tmp_dir = '{}/tmp/{}.{}.{}'.format(self._dir, key, os.getpid(), threading.get_ident())
+        try:
+            size = 0
+            for name, source in files.items():
+                target = '{}/files/{}'.format(tmp_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self._link(source, target)
+                size += os.path.getsize(target)
+            with open(tmp_dir + '/' + self.manifest_name, 'w') as file:
+                json.dump({'stage': task.stage, 'step': task.step, 'sample': task.sample, 'created': time.time(),
+                           'size': size, 'files': sorted(files), 'scratch': scratch,
+                           'output': output or ''}, file, indent=1)
+            os.makedirs(os.path.dirname(self._entry(key)), exist_ok=True)
+            os.rename(tmp_dir, self._entry(key))
+        except OSError:  # the same entry is stored by another run or no room
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self._lock:
+            self._counts['stored'] += 1
+        self.evict()
+
+    def evict(self):  # the least recently used entries above the size limit
+        entries = []
+        for manifest_file in glob.glob('{}/??/*/{}'.format(self._dir, self.manifest_name)):
+            try:
+                with open(manifest_file, 'r') as file:
+                    entries.append((os.path.getmtime(manifest_file), json.load(file)['size'],
+                                    os.path.dirname(manifest_file)))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self._limit:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(entry))  # the last entry of the prefix
+            except OSError:
+                pass
+            total -= size
+            with self._lock:
+                self._counts['evicted'] += 1
+
+    def summary(self):
+        return '\ncache: {hits} hits, {misses} misses, {stored} stored, {evicted} evicted ({dir})\n'.format(
+            dir=self._dir, **self._counts)
+
+# end of class ResultCache
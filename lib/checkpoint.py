@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class Checkpoint:
+    file_name = 'checkpoints.json'
+
+    def __init__(self, out_dir, force=None):
+        self._file = os.path.join(out_dir, self.file_name)
+        self._force = set(name.lower() for name in (force or []))
+        self._lock = threading.Lock()
+        self._manifest = {'files': {}, 'steps': {}}
+        if os.path.isfile(self._file):
+            try:
+                with open(self._file, 'r') as file:
+                    self._manifest = json.load(file)
+            except ValueError:
+                pass  # a broken manifest means nothing is done yet
+        self._manifest.setdefault('retired', {})  # the intermediates deleted or compressed (see Retention)
+
+    @staticmethod
+    def key(task):
+        return '/'.join(str(field) for field in (task.stage, task.step, task.sample) if field)
+
+    def file_hash(self, file_name):  # the content hash is recomputed only if the file size or mtime is changed
+        with self._lock:
+            retired = self._manifest['retired'].get(file_name)
+        if retired and not os.path.isfile(file_name):
+            return retired['sha256']  # the hash of the file before it was retired
+
+        stat = os.stat(file_name)
+        with self._lock:
+            known = self._manifest['files'].get(file_name)
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            return known['sha256']
+
+        sha = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+        with self._lock:
+            self._manifest['files'][file_name] = {
+                'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha.hexdigest()
+            }
+
+        return sha.hexdigest()
+
+    def _copies(self):  # the compressed copies of the retired files are not the files of the steps
+        with self._lock:
+            return set(file_name + '.gz' for file_name, entry in self._manifest['retired'].items()
+                       if entry['action'] == 'compress')
+
+    def _inputs(self, task):  # the retired inputs are listed as before they were retired
+        file_names = set(task.inputs()) - self._copies()
+        with self._lock:
+            retired = list(self._manifest['retired'])
+            step = self._manifest['steps'].get(self.key(task)) or {}
+        for file_name in retired:
+            if file_name in step.get('inputs', ()) and not os.path.isfile(file_name):
+                file_names.add(file_name)
+
+        return file_names
+
+    def fingerprint(self, task):
+        sha = hashlib.sha256()
+        for file_name in sorted(self._inputs(task)):
+            sha.update(file_name.encode() + b'\0' + self.file_hash(file_name).encode() + b'\0')
+        sha.update(json.dumps(task.params, sort_keys=True, default=str).encode())
+
+        return sha.hexdigest()
+
+    def forced(self, task):
+        return bool(self._force & {'all', str(task.stage).lower(), str(task.step).lower()})
+
+    def retired(self, file_name):
+        with self._lock:
+            return file_name in self._manifest['retired'] and not os.path.isfile(file_name)
+
+    def valid(self, task, descendants=None):
+        # the step is done if its inputs, parameters and outputs are not changed; a retired output is not changed if
+        # the steps which have read it are done (descendants(task) lists the later steps of the graph)
+        if task.inputs is None or self.forced(task):
+            return False
+
+        with self._lock:
+            step = self._manifest['steps'].get(self.key(task))
+        if not step or step['fingerprint'] != self.fingerprint(task):
+            return False
+        for file_name, sha in step['outputs'].items():
+            if self.retired(file_name):
+                if self.file_hash(file_name) != sha or not self._consumed(file_name, task, descendants):
+                    return False
+            elif not os.path.isfile(file_name) or self.file_hash(file_name) != sha:
+                return False
+
+        return True
+
+    def _consumed(self, file_name, task, descendants):  # the steps reading the retired file are up to date
+        if descendants is None:
+            return False
+        for other in descendants(task):
+            with self._lock:
+                step = self._manifest['steps'].get(self.key(other)) or {}
+            if file_name in step.get('inputs', ()) and not self.valid(other, descendants):
+                return False
+
+        return True
+
+    def record(self, task):
+        if task.inputs is None:
+            return
+
+        step = {
+            'fingerprint': self.fingerprint(task),
+            'inputs': sorted(self._inputs(task)),
+            'outputs': {file_name: self.file_hash(file_name) for file_name in set(task.outputs()) - self._copies()
+                        if os.path.isfile(file_name)},
+        }
+        with self._lock:
+            self._manifest['steps'][self.key(task)] = step
+        self.write()
+
+    def retire(self, file_name, action):  # called by Retention before the file is deleted or compressed
+        sha = self.file_hash(file_name)
+        with self._lock:
+            self._manifest['retired'][file_name] = {'action': action, 'sha256': sha}
+        self.write()
+
+    def write(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self._file) or '.', exist_ok=True)
+            with open(self._file + '.tmp', 'w') as file:
+                json.dump(self._manifest, file, indent=1, sort_keys=True)
+            os.replace(self._file + '.tmp', self._file)
+
+# end of class Checkpoint
@@ -0,0 +1,451 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import signal
+import secrets
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lib.progress import Progress
+
+
+class Job:
+    states = ('queued', 'running', 'done', 'failed', 'cancelled')
+    env_names = ('LANG', 'LC_ALL', 'TZ')  # the variables of the client, the run gets the environment of the daemon
+    daemon_options = ('--daemon', '--daemon-dir', '--status', '--cancel', '--submit')
+
+    def __init__(self, job_id, request, log_file):
+        self.id = job_id
+        self.argv = list(request['argv'])
+        self.cwd = request.get('cwd') or os.getcwd()
+        self.env = dict(os.environ, **{name: value for name, value in (request.get('env') or {}).items()
+                                       if name in self.env_names})
+        self.out_dir = request['out_dir']
+        self.cores = request.get('cores') or 1
+        self.memory = request.get('memory') or 0  # MB
+        self.log_file = request.get('log_file')
+        self.output_file = log_file  # stdout and stderr of the run
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.start = None
+        self.end = None
+        self.exit_code = None
+        self.process = None
+        self.cancelled = None  # the time of SIGTERM
+
+    def events(self):  # the finished steps of the run (see Log)
+        steps = []
+        if self.log_file and os.path.isfile(self.log_file + '.jsonl'):
+            with open(self.log_file + '.jsonl', 'r') as file:
+                for line in file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:  # the line is being written
+                        continue
+                    if event['event'] == 'step':
+                        steps.append({field: event.get(field) for field in ('stage', 'step', 'sample', 'exit_code',
+                                                                            'skipped', 'start', 'end', 'error')})
+
+        return steps
+
+    def status(self):  # the live progress of the run (see Progress), None for a batch
+        try:
+            with open(os.path.join(self.out_dir, Progress.file_name), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def tail(self, n_lines=20):
+        if not os.path.isfile(self.output_file):
+            return []
+        with open(self.output_file, 'r', errors='replace') as file:
+            return file.read().splitlines()[-n_lines:]
+
+    @classmethod
+    def validate(cls, request):  # the error of a wrong request or None
+        if not isinstance(request, dict):
+            return 'the request has to be a JSON object'
+        if not isinstance(request.get('argv'), list) or not request['argv'] or \
+                not all(isinstance(arg, str) for arg in request['argv']):
+            return 'argv has to be a list of strings'
+        if any(arg.split('=', 1)[0] in cls.daemon_options for arg in request['argv']):
+            return 'argv has options of the daemon: {}'.format(' '.join(cls.daemon_options))
+        if not isinstance(request.get('out_dir'), str) or not request['out_dir']:
+            return 'out_dir has to be a path'
+        cwd = request.get('cwd')
+        if cwd is not None and (not isinstance(cwd, str) or not os.path.isdir(cwd)):
+            return 'cwd has to be a directory'
+        if request.get('env') is not None and not isinstance(request['env'], dict):
+            return 'env has to be an object'
+        for name in ('cores', 'memory'):
+            value = request.get(name)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                return '{} has to be a whole number'.format(name)
+        if request.get('log_file') is not None and not isinstance(request['log_file'], str):
+            return 'log_file has to be a path'
+
+        return None
+
+    def to_dict(self, progress=False):
+        job = {field: getattr(self, field) for field in ('id', 'state', 'out_dir', 'cores', 'memory', 'submitted',
+                                                        'start', 'end', 'exit_code', 'log_file', 'output_file')}
+        job['argv'] = self.argv
+        if progress:
+            steps = self.events()
+            job['steps_done'] = sum(1 for step in steps if step['exit_code'] == 0)
+            job['steps_failed'] = sum(1 for step in steps if step['exit_code'] != 0)
+            job['last_step'] = steps[-1] if steps else None
+            job['steps'] = steps
+            job['status'] = self.status()
+            job['output'] = self.tail()
+
+        return job
+
+# end of class Job
+
+
+class Scheduler:
+    # the runs are queued and started in the order of the submissions while their cores (-w) and memory (-m) fit
+    # into the budget of the daemon; every run is a tcr-factory.py process of its own (the settings are singletons)
+    poll = 0.5
+    kill_grace = 30  # seconds between SIGTERM and SIGKILL of a cancelled run
+    token_name = 'token'
+
+    def __init__(self, script, cores, memory, work_dir):
+        self._script = script
+        self._cores = int(cores)
+        self._memory = int(memory)  # MB
+        self._dir = re.sub(r'/$', '', work_dir)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._token = None
+        private_dir(self._dir)
+
+    def new_token(self):  # the secret of the clients of the user, only the owner can read the daemon dir
+        self._token = secrets.token_hex(32)
+        token_file = '{}/{}'.format(self._dir, self.token_name)
+        with open(os.open(token_file + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            file.write(self._token)
+        os.replace(token_file + '.tmp', token_file)
+
+    def authorized(self, token):
+        return bool(self._token) and isinstance(token, str) and hmac.compare_digest(token, self._token)
+
+    def get_budget(self):
+        return {'cores': self._cores, 'memory': self._memory}
+
+    def _used(self):
+        running = [job for job in self._jobs.values() if job.state == 'running']
+        return sum(job.cores for job in running), sum(job.memory for job in running)
+
+    def submit(self, request):
+        with self._lock:
+            if request.get('cores', 1) > self._cores or request.get('memory', 0) > self._memory:
+                raise ValueError('the run needs {} cores and {} MB, the budget is {} cores and {} MB'.format(
+                    request.get('cores', 1), request.get('memory', 0), self._cores, self._memory))
+            for job in self._jobs.values():
+                if job.state in ('queued', 'running') and job.out_dir == request['out_dir']:
+                    raise ValueError('the output dir {} is used by the run {}'.format(job.out_dir, job.id))
+            job_id = '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), len(self._jobs) + 1)
+            job = Job(job_id, request, '{}/{}.out'.format(self._dir, job_id))
+            if not job.log_file:  # the step events of the run give the progress
+                job.log_file = '{}/{}.log'.format(self._dir, job_id)
+                job.argv += ['-l', job.log_file]
+            self._jobs[job_id] = job
+            self._write()
+
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError('no run {}'.format(job_id))
+            return self._jobs[job_id]
+
+    def get_jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        with self._lock:
+            if job.state == 'queued':
+                job.state = 'cancelled'
+                job.end = time.time()
+            elif job.state == 'running' and not job.cancelled:
+                job.cancelled = time.time()
+                try:
+                    os.killpg(job.process.pid, signal.SIGTERM)  # the run stops its tools (see Runner)
+                except OSError:
+                    pass
+            self._write()
+
+        return job
+
+    def _launch(self, job):
+        with open(job.output_file, 'wb') as output:
+            job.process = subprocess.Popen([sys.executable, self._script] + job.argv, cwd=job.cwd, env=job.env,
+                                           stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT,
+                                           start_new_session=True)
+        job.state = 'running'
+        job.start = time.time()
+
+    def _schedule(self):
+        with self._lock:
+            changed = False
+            for job in self._jobs.values():
+                if job.state != 'running':
+                    continue
+                exit_code = job.process.poll()
+                if exit_code is None:
+                    if job.cancelled and time.time() - job.cancelled > self.kill_grace:
+                        try:
+                            os.killpg(job.process.pid, signal.SIGKILL)
+                        except OSError:
+                            pass
+                    continue
+                job.exit_code = exit_code
+                job.end = time.time()
+                job.state = 'cancelled' if job.cancelled else 'done' if exit_code == 0 else 'failed'
+                changed = True
+
+            for job in sorted(self._jobs.values(), key=lambda item: item.submitted):
+                if job.state != 'queued':
+                    continue
+                cores, memory = self._used()
+                if cores + job.cores > self._cores or memory + job.memory > self._memory:
+                    break  # the first in the queue goes first
+                try:
+                    self._launch(job)
+                except OSError as error:
+                    job.state = 'failed'
+                    job.end = time.time()
+                    with open(job.output_file, 'a') as output:
+                        output.write("Can't start the run: {}\n".format(error))
+                changed = True
+            if changed:
+                self._write()
+
+    def _write(self):  # the state of the runs for the front end
+        with open(self._dir + '/jobs.json.tmp', 'w') as file:
+            json.dump([job.to_dict() for job in self._jobs.values()], file, indent=1)
+        os.replace(self._dir + '/jobs.json.tmp', self._dir + '/jobs.json')
+
+    def _loop(self):
+        while not self._stop.wait(self.poll):
+            self._schedule()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):  # the running runs are cancelled
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for job in self.get_jobs():
+            if job.state in ('queued', 'running'):
+                self.cancel(job.id)
+        for job in self.get_jobs():
+            if job.process and job.state == 'running':
+                try:
+                    job.process.wait(self.kill_grace)
+                except subprocess.TimeoutExpired:
+                    os.killpg(job.process.pid, signal.SIGKILL)
+        self._schedule()
+
+# end of class Scheduler
+
+
+def private_dir(dir_name):  # the directory of the daemon, the token and the run logs are readable by the owner only
+    os.makedirs(dir_name, mode=0o700, exist_ok=True)
+    stat = os.stat(dir_name)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise Exception('The daemon dir {} has to be owned by the user and closed to the others (chmod 700).'.format(
+            dir_name))
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET /runs, GET /runs/<id>, GET /runs/<id>/progress, POST /runs, POST /runs/<id>/cancel, GET /budget; every
+    # request has the token of the daemon dir (Authorization: Bearer), a POST has a JSON body
+    scheduler = None
+
+    def _reply(self, code, body):
+        data = json.dumps(body, indent=1).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _path(self):
+        return [part for part in self.path.split('?', 1)[0].split('/') if part]
+
+    def _authorized(self):
+        token = re.sub(r'^Bearer\s+', '', self.headers.get('Authorization') or '')
+        if self.scheduler.authorized(token):
+            return True
+        self._reply(401, {'error': 'no token of the daemon'})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        path = self._path()
+        try:
+            if path == ['budget']:
+                return self._reply(200, self.scheduler.get_budget())
+            if path == ['runs']:
+                return self._reply(200, [job.to_dict() for job in self.scheduler.get_jobs()])
+            if len(path) == 2 and path[0] == 'runs':
+                return self._reply(200, self.scheduler.get(path[1]).to_dict())
+            if len(path) == 3 and path[0] == 'runs' and path[2] == 'progress':
+                return self._reply(200, self.scheduler.get(path[1]).to_dict(progress=True))
+        except KeyError as error:
+            return self._reply(404, {'error': error.args[0]})
+        self._reply(404, {'error': 'no such endpoint: {}'.format(self.path)})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        path = self._path()
+        try:
+            if path == ['runs']:
+                if (self.headers.get('Content-Type') or '').split(';')[0].strip() != 'application/json':
+                    return self._reply(415, {'error': 'the request has to be application/json'})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                except ValueError:
+                    return self._reply(400, {'error': 'the request is not JSON'})
+                error = Job.validate(request)
+                if error:
+                    return self._reply(400, {'error': error})
+                return self._reply(201, self.scheduler.submit(request).to_dict())
+            if len(path) == 3 and path[0] == 'runs' and path[2] == 'cancel':
+                return self._reply(200, self.scheduler.cancel(path[1]).to_dict())
+        except KeyError as error:
+            return self._reply(404, {'error': error.args[0]})
+        except ValueError as error:
+            return self._reply(409, {'error': str(error)})
+        self._reply(404, {'error': 'no such endpoint: {}'.format(self.path)})
+
+    def log_message(self, format, *args):  # the requests are not logged
+        pass
+
+# end of class Handler
+
+
+class Daemon:
+    # the local job queue of the runs (see Scheduler), tcr-factory.py --submit is its client
+    def __init__(self, port, scheduler):
+        self._port = int(port)
+        self._scheduler = scheduler
+
+    def serve(self):
+        handler = type('RunHandler', (Handler,), {'scheduler': self._scheduler})
+        try:
+            server = ThreadingHTTPServer(('localhost', self._port), handler)
+        except OSError as error:
+            raise Exception("Can't start the daemon on the port {}: {}".format(self._port, error))
+
+        def shutdown(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        self._scheduler.new_token()
+        self._scheduler.start()
+        print('the daemon is listening on localhost port {}'.format(self._port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self._scheduler.stop()
+
+# end of class Daemon
+
+
+class Client:
+    poll = 2
+
+    def __init__(self, port, daemon_dir):
+        self._url = 'http://localhost:{}'.format(int(port))
+        self._token_file = '{}/{}'.format(re.sub(r'/$', '', daemon_dir), Scheduler.token_name)
+
+    def _token(self):
+        try:
+            with open(self._token_file, 'r') as file:
+                return file.read().strip()
+        except OSError as error:
+            raise Exception("Can't read the token of the daemon {} ({}), is the daemon started by the user?".format(
+                self._token_file, error.strerror))
+
+    def _call(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self._url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json',
+                                                  'Authorization': 'Bearer ' + self._token()})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            raise Exception(json.loads(error.read()).get('error', str(error)))
+        except urllib.error.URLError as error:
+            raise Exception('no daemon on {} ({}), start it with tcr-factory.py --daemon --submit PORT'.format(
+                self._url, error.reason))
+
+    def submit(self, argv, out_dir, cores, memory, log_file=None):
+        return self._call('POST', '/runs', {'argv': argv, 'cwd': os.getcwd(),
+                                            'env': {name: os.environ[name] for name in Job.env_names
+                                                    if name in os.environ},
+                                            'out_dir': out_dir, 'cores': cores, 'memory': memory,
+                                            'log_file': log_file})
+
+    def status(self, job_id=None):
+        return self._call('GET', '/runs/{}/progress'.format(job_id) if job_id else '/runs')
+
+    def cancel(self, job_id):
+        return self._call('POST', '/runs/{}/cancel'.format(job_id))
+
+    def wait(self, job_id, report=print):  # the state changes are reported until the run is finished
+        last = None
+        while True:
+            job = self.status(job_id)
+            line = '{}: {}, {} steps done'.format(job['id'], job['state'], job['steps_done'])
+            if line != last:
+                report(line)
+                last = line
+            if job['state'] not in ('queued', 'running'):
+                return job
+            time.sleep(self.poll)
+
+    @staticmethod
+    def strip(argv, options):  # the command line of the run without the client options
+        stripped = []
+        skip = False
+        for arg in argv:
+            if skip:
+                skip = False
+                continue
+            name = arg.split('=', 1)[0]
+            if name in options:
+                skip = options[name] and '=' not in arg
+                continue
+            if any(arg.startswith(option) and len(option) == 2 and len(arg) > 2 and options[option]
+                   for option in options):  # -p10000
+                continue
+            stripped.append(arg)
+
+        return stripped
+
+# end of class Client
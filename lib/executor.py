@@ -0,0 +1,216 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from lib.inout import Workers, Xmx
+
+
+class Executor:
+    def __init__(self, n_workers=None):
+        self._n = int(n_workers) if n_workers else Workers().get()
+
+    def workers(self, n_tasks=None):  # the number of tasks that really run at the same time
+        if n_tasks is None:
+            return self._n
+        return max(1, min(self._n, n_tasks))
+
+    def map(self, func, items):  # results are returned in the order of the items
+        items = list(items)
+        if self.workers(len(items)) == 1:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.workers(len(items))) as pool:
+            return list(pool.map(func, items))
+
+# end of class Executor
+
+
+class Task:
+    def __init__(self, func, stage, step, sample=None, deps=(), inputs=None, outputs=None, params=None,
+                 intermediates=None, input_parts=None):
+        self.func = func
+        self.stage = stage
+        self.step = step
+        self.sample = sample
+        self.deps = list(deps)
+        self.inputs = inputs  # the callables listing the files of the step for the checkpoints
+        self.outputs = outputs
+        self.intermediates = intermediates  # the outputs retired after the steps reading them (see Retention)
+        self.input_parts = input_parts  # {input file: the part the step reads} of the run-wide tables (see ResultCache)
+        self.params = params or {}
+        self.index = None  # the order of the task in the graph
+        self.scope = None  # the run of the task (see TaskScope)
+        self.memory = None  # MB of the heap granted to the step (see HeapModel)
+        self.start = None
+        self.end = None
+        self.output = None
+        self.error = None
+        self.exit_code = None  # the exit status of the failed tool, 0 for a done step
+        self.done = False
+        self.skipped = False
+        self.cached = False
+
+    def ready(self):
+        return all(dep.done for dep in self.deps)
+
+    def run(self):
+        return self.func()
+
+# end of class Task
+
+
+class TaskScope:
+    # the steps of one run in a graph shared by several runs: the checkpoints, the log, the listeners, the cache and
+    # the metrics and the live progress of the run; a failed step stops the steps of its run only
+    def __init__(self, graph, checkpoint=None, log=None, listeners=(), cache=None, metrics=None, progress=None):
+        self._graph = graph
+        self.checkpoint = checkpoint
+        self.log = log
+        self.listeners = [listener for listener in listeners if listener]  # finished(task, graph) after every step
+        self.cache = cache  # the outputs of the steps done by the other runs (see ResultCache)
+        self.metrics = metrics
+        self.progress = progress  # started(task) and finished(task) of every run step (see Progress)
+        self.failed = None
+
+    def add(self, func, stage, step, sample=None, deps=(), inputs=None, outputs=None, params=None,
+            intermediates=None, input_parts=None):
+        return self._graph.add(func, stage, step, sample, deps, inputs, outputs, params, self, intermediates,
+                               input_parts)
+
+# end of class TaskScope
+
+
+class TaskGraph:
+    def __init__(self, n_workers=None, checkpoint=None, log=None, cancel=None, listeners=(), memory=None,
+                 cache=None):
+        self._executor = Executor(n_workers)
+        self._cancel = cancel  # an Event set by the first failure of a single run, the running steps stop (see Command)
+        self._memory = memory  # a step starts only if its estimated heap fits into the free memory (see HeapModel)
+        self._tasks = []
+        self._scope = TaskScope(self, checkpoint, log, listeners, cache)  # the steps added to the graph directly
+
+    def scope(self, checkpoint=None, log=None, listeners=(), cache=None, metrics=None, progress=None):
+        return TaskScope(self, checkpoint, log, listeners, cache, metrics, progress)
+
+    def add(self, func, stage, step, sample=None, deps=(), inputs=None, outputs=None, params=None, scope=None,
+            intermediates=None, input_parts=None):
+        task = Task(func, stage, step, sample, [dep for dep in deps if dep], inputs, outputs, params, intermediates,
+                    input_parts)
+        task.index = len(self._tasks)
+        task.scope = scope or self._scope
+        self._tasks.append(task)
+
+        return task
+
+    def _run_task(self, task):
+        task.start = time.time()
+        if task.scope.progress:
+            task.scope.progress.started(task)
+        if task.memory:
+            Xmx().grant(task.memory)
+        try:
+            return self._run_step(task)
+        finally:
+            Xmx().grant(None)
+            task.end = time.time()
+
+    def _admit(self, ready, running, n_workers):  # the ready tasks which fit into the free workers and memory
+        admitted = []
+        used = sum(task.memory or 0 for task in running.values())
+        for task in ready:
+            if len(running) + len(admitted) >= n_workers:
+                break
+            if self._memory:
+                if task.memory is None:
+                    task.memory = self._memory.estimate(task)
+                if (running or admitted) and used + task.memory > self._memory.get_budget():
+                    continue  # a smaller step may fit
+                used += task.memory
+            admitted.append(task)
+
+        return admitted
+
+    def _run_step(self, task):
+        checkpoint, cache = task.scope.checkpoint, task.scope.cache
+        if checkpoint and checkpoint.valid(task, self.descendants):
+            task.skipped = True
+            return 'The step is up to date (checkpoint), skipped.\n'
+
+        output = None
+        if cache and checkpoint and checkpoint.forced(task):
+            cache.detach(task)  # a forced step is recomputed
+        elif cache:
+            output = cache.fetch(task)
+        if output is not None:
+            task.cached = True
+        else:
+            output = task.run()
+            if cache:
+                cache.store(task, output)
+        if checkpoint:
+            checkpoint.record(task)
+
+        return output
+
+    def _cancelled(self):
+        return self._cancel is not None and self._cancel.is_set()
+
+    def get_tasks(self):
+        return list(self._tasks)
+
+    def descendants(self, task):
+        descendants = set()
+        for other in self._tasks:  # the tasks are added after their dependencies
+            if other.index > task.index and (task in other.deps or descendants & set(other.deps)):
+                descendants.add(other)
+
+        return descendants
+
+    def run(self):  # a task starts as soon as all its dependencies are done; returns the first failed task or None
+        pending = list(self._tasks)
+        running = {}
+        failed = None
+        single = len(set(task.scope for task in self._tasks)) == 1  # the other runs go on after a failure
+
+        n_workers = self._executor.workers()
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            while pending or running:
+                if not self._cancelled():
+                    ready = [task for task in pending if not task.scope.failed and task.ready()]
+                    for task in self._admit(ready, running, n_workers):
+                        running[pool.submit(self._run_task, task)] = task
+                        pending.remove(task)
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    try:
+                        task.output = future.result()
+                        task.exit_code = 0
+                        task.done = True
+                        for listener in task.scope.listeners:
+                            listener.finished(task, self)
+                    except Exception as error:
+                        task.error = error
+                        task.exit_code = getattr(error, 'exit_code', None)  # None: the step fails not in a tool
+                        task.scope.failed = task.scope.failed or task
+                        failed = failed or task
+                        if self._cancel and single:
+                            self._cancel.set()
+                    if task.scope.log:
+                        task.scope.log.step(task)
+                    if task.scope.progress:
+                        task.scope.progress.finished(task)
+
+        for task in pending:
+            if not task.scope.failed:
+                task.error = Exception('The run is cancelled before the step: {}'.format(task.step)
+                                       if self._cancelled() else
+                                       'Unresolved dependencies of the step: {}'.format(task.step))
+                task.scope.failed = task
+                failed = failed or task
+
+        return failed
+
+# end of class TaskGraph
@@ -0,0 +1,145 @@
+import os
+import csv
+import threading
+
+
+class HeapModel:
+    # the heap of a JVM step from the size of its input files: base + factor * input, the factor of a step is
+    # learned from the max RSS of the past runs (the history file in the bin dir) and the defaults with the margin
+    # are used until then; the RSS of a JVM grows up to its -Xmx, so the heap used by a run is taken as no more than
+    # its granted heap and the learned factor is the 90th percentile without the margin (the estimates don't feed on
+    # themselves); the steps without a JVM need no heap
+    defaults = {  # step: (base MB, MB of the heap per MB of the input)
+        'checkoutbatch': (512, 0.5),
+        'histogram': (512, 0.2),
+        'assemblebatch': (512, 2.0),
+        'analyze': (1024, 4.0),
+        'align': (1024, 4.0),
+        'assemble': (1024, 3.0),
+        'exportclones': (512, 2.0),
+        'convert': (512, 3.0),
+        'filter': (512, 3.0),
+    }
+    fields = ('step', 'input_mb', 'heap_mb', 'max_rss_mb')
+    min_heap = 256  # MB
+    jvm_overhead = 192  # MB of the RSS out of the heap (the code, the threads, the GC)
+    margin = 1.25  # of the default factors
+    history_size = 50  # the last runs of a step used for the factor
+    percentile = 0.9
+
+    def __init__(self, budget, history_file=None):
+        self._budget = int(budget)  # MB
+        self._file = history_file
+        self._lock = threading.Lock()
+        self._inputs = {}  # the task -> the input size, MB
+        self._history = {}  # the step -> [(input MB, max RSS MB, granted heap MB or None)]
+        self._steps = {}  # the step -> [the estimates, the max RSS] of this run
+        if self._file and os.path.isfile(self._file):
+            try:
+                with open(self._file, 'r', newline='') as file:
+                    for row in csv.DictReader(file):
+                        heap = row.get('heap_mb')
+                        self._history.setdefault(row['step'], []).append((
+                            float(row['input_mb']), float(row['max_rss_mb']),
+                            float(heap) if heap and heap != 'None' else None))
+            except (OSError, ValueError, KeyError):
+                self._history = {}
+
+    def get_budget(self):
+        return self._budget
+
+    @staticmethod
+    def _input_mb(task):
+        if not task.inputs:
+            return 0.0
+        total = 0
+        for file_name in task.inputs():
+            try:
+                total += os.path.getsize(file_name)
+            except OSError:
+                continue
+
+        return total / 2 ** 20
+
+    def _factor(self, step):  # the heap per MB of the input of the recent runs, None without the history
+        base = self.defaults[step][0]
+        observed = sorted(max(0.0, (min(rss - self.jvm_overhead, heap or rss) - base) / input_mb)
+                          for input_mb, rss, heap in self._history.get(step, [])[-self.history_size:]
+                          if input_mb >= 1)
+        if not observed:
+            return None
+
+        return observed[min(len(observed) - 1, int(self.percentile * len(observed)))]
+
+    def estimate(self, task):  # MB of the heap of the step, 0 if the step runs no JVM
+        step = str(task.step).lower()
+        if step not in self.defaults:
+            return 0
+        input_mb = self._input_mb(task)
+        base, factor = self.defaults[step]
+        with self._lock:
+            self._inputs[task] = input_mb
+            learned = self._factor(step)
+        heap = base + learned * input_mb if learned is not None else (base + factor * input_mb) * self.margin
+
+        return int(min(self._budget, max(self.min_heap, heap)))
+
+    def finished(self, task, graph):  # called by TaskGraph: the max RSS of the step goes to the history
+        with self._lock:
+            input_mb = self._inputs.pop(task, None)
+        metrics = task.scope.metrics if task.scope else None  # the metrics of the run of the step
+        if input_mb is None or task.skipped or not metrics:
+            return
+        rss = [record['max_rss_mb'] for record in metrics.get_records()
+               if record['stage'] == task.stage and record['step'] == task.step and
+               record['sample'] == task.sample and record['start'] >= task.start - 1]
+        if not rss:
+            return
+
+        step = str(task.step).lower()
+        with self._lock:
+            self._history.setdefault(step, []).append((input_mb, max(rss), task.memory))
+            estimates = self._steps.setdefault(task.step, [0, 0])
+            estimates[0] = max(estimates[0], task.memory or 0)
+            estimates[1] = max(estimates[1], max(rss))
+            if self._file:
+                try:
+                    new = not os.path.isfile(self._file)
+                    with open(self._file, 'a', newline='') as file:
+                        writer = csv.writer(file)
+                        if new:
+                            writer.writerow(self.fields)
+                        writer.writerow((step, '{:.1f}'.format(input_mb), task.memory, '{:.0f}'.format(max(rss))))
+                except OSError:
+                    pass
+
+    def summary(self):
+        text = '\nheap: adaptive within {} MB'.format(self._budget)
+        for step, (heap, rss) in self._steps.items():
+            text += '\n{:<24}max heap {:>6} MB, max RSS {:>6.0f} MB'.format(step, heap, rss)
+
+        return text + '\n'
+
+# end of class HeapModel
+
+
+class FixedHeap:
+    # the fixed heap of the runs sharing a graph (see BatchPipe): every JVM step is granted an equal share of -m
+    # by the worker count, so the JVMs of all runs never take more than -m at the same time
+    def __init__(self, budget, n_workers):
+        self._budget = int(budget)  # MB
+        self._share = max(1, self._budget // max(1, int(n_workers)))
+
+    def get_budget(self):
+        return self._budget
+
+    def estimate(self, task):  # MB of the heap of the step, 0 if the step runs no JVM
+        return self._share if str(task.step).lower() in HeapModel.defaults else 0
+
+    def finished(self, task, graph):  # called by TaskGraph
+        pass
+
+    def summary(self):
+        return '\nheap: fixed, {} MB per JVM step within {} MB\n'.format(self._share, self._budget)
+
+# end of class FixedHeap
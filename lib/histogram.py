@@ -0,0 +1,169 @@
+import os
+import io
+import json
+
+
+class HistogramRenderer:
+    # MIGEC Histogram tables (overseq.txt, collision1.txt, estimates.txt) drawn without R: SVG always, PNG if
+    # matplotlib is installed, plus the per-sample summary of the thresholds
+    tables = ('overseq', 'collision1')
+    colors = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
+              '#bcbd22', '#17becf')
+
+    @staticmethod
+    def available():  # NumPy is optional: without it the histograms are drawn by histogram.R
+        try:
+            import numpy
+        except ImportError:
+            return False
+
+        return True
+
+    def __init__(self, histogram_dir):
+        import numpy
+
+        self._np = numpy
+        self._dir = histogram_dir.rstrip('/')
+
+    def _read(self, name):  # (the header bins, the sample ids, the counts as a samples x bins array)
+        file_name = '{}/{}.txt'.format(self._dir, name)
+        if not os.path.isfile(file_name):
+            return None
+
+        with open(file_name, 'r') as file:
+            header = file.readline().lstrip('#').rstrip('\n').split('\t')
+            body = file.read()
+        if not body.strip():
+            return header[2:], [], self._np.zeros((0, len(header) - 2))
+
+        names = self._np.loadtxt(io.StringIO(body), delimiter='\t', dtype=str, usecols=(0,), ndmin=1, comments=None)
+        counts = self._np.loadtxt(io.StringIO(body), delimiter='\t', dtype=float, ndmin=2, comments=None,
+                                  usecols=range(2, len(header)))
+
+        return header[2:], list(names), counts
+
+    def _fractions(self, counts):  # the reads fraction per MIG size bin, row-wise
+        totals = counts.sum(axis=1, keepdims=True)
+        return self._np.divide(counts, totals, out=self._np.zeros_like(counts), where=totals > 0)
+
+    def _svg(self, title, bins, names, fractions, file_name, width=720, height=420, margin=60):
+        n_bins = max(1, len(bins) - 1)
+        top = float(fractions.max()) if fractions.size else 1.0
+        top = top or 1.0
+
+        def x(i):
+            return margin + (width - 2 * margin) * i / n_bins
+
+        def y(value):
+            return height - margin - (height - 2 * margin) * value / top
+
+        svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="sans-serif" '
+               'font-size="11">'.format(width, height),
+               '<rect width="100%" height="100%" fill="white"/>',
+               '<text x="{}" y="20" font-size="14" text-anchor="middle">{}</text>'.format(width / 2, title),
+               '<line x1="{0}" y1="{1}" x2="{2}" y2="{1}" stroke="black"/>'.format(margin, height - margin,
+                                                                                  width - margin),
+               '<line x1="{0}" y1="{1}" x2="{0}" y2="{2}" stroke="black"/>'.format(margin, margin, height - margin),
+               '<text x="{}" y="{}" text-anchor="middle">MIG size, reads</text>'.format(width / 2, height - 20),
+               '<text x="15" y="{0}" text-anchor="middle" transform="rotate(-90 15 {0})">fraction of reads</text>'
+               .format(height / 2)]
+        for i, label in enumerate(bins):
+            svg.append('<text x="{:.1f}" y="{}" text-anchor="middle">{}</text>'.format(x(i), height - margin + 15,
+                                                                                      label))
+        for tick in self._np.linspace(0, top, 5):
+            svg.append('<text x="{}" y="{:.1f}" text-anchor="end">{:.2f}</text>'.format(margin - 5, y(tick) + 4, tick))
+        for n, (name, row) in enumerate(zip(names, fractions)):
+            color = self.colors[n % len(self.colors)]
+            points = ' '.join('{:.1f},{:.1f}'.format(x(i), y(value)) for i, value in enumerate(row))
+            svg.append('<polyline fill="none" stroke="{}" stroke-width="1.5" points="{}"/>'.format(color, points))
+            svg.append('<text x="{}" y="{}" fill="{}">{}</text>'.format(width - margin + 5, margin + 12 * n,
+                                                                       color, name))
+        svg.append('</svg>')
+
+        with open(file_name, 'w') as file:
+            file.write('\n'.join(svg) + '\n')
+
+    @staticmethod
+    def _png(title, bins, names, fractions, file_name):
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            from matplotlib import pyplot
+        except ImportError:
+            return False
+
+        figure, axes = pyplot.subplots(figsize=(8, 4.5))
+        for name, row in zip(names, fractions):
+            axes.plot(range(len(bins)), row, label=name)
+        axes.set_xticks(range(len(bins)))
+        axes.set_xticklabels(bins)
+        axes.set_xlabel('MIG size, reads')
+        axes.set_ylabel('fraction of reads')
+        axes.set_title(title)
+        if names:
+            axes.legend(fontsize='small', loc='upper right')
+        figure.tight_layout()
+        figure.savefig(file_name, dpi=100)
+        pyplot.close(figure)
+
+        return True
+
+    def _estimates(self):
+        file_name = self._dir + '/estimates.txt'
+        estimates = {}
+        if os.path.isfile(file_name):
+            with open(file_name, 'r') as file:
+                header = file.readline().lstrip('#').rstrip('\n').split('\t')
+                for line in file:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == len(header):
+                        estimates[fields[0]] = dict(zip(header, fields))
+
+        return estimates
+
+    def render(self):
+        output = ''
+        peaks = {}
+        for name in self.tables:
+            table = self._read(name)
+            if not table:
+                continue
+            bins, names, counts = table
+            fractions = self._fractions(counts)
+            self._svg(name, bins, names, fractions, '{}/{}.svg'.format(self._dir, name))
+            output += '{}/{}.svg\n'.format(self._dir, name)
+            if self._png(name, bins, names, fractions, '{}/{}.png'.format(self._dir, name)):
+                output += '{}/{}.png\n'.format(self._dir, name)
+            if name == 'overseq' and len(names):
+                peak_bins = fractions.argmax(axis=1)
+                peaks = {sample: bins[i] for sample, i in zip(names, peak_bins)}
+
+        output += self.summary(peaks)
+
+        return output
+
+    def summary(self, peaks):  # the suggested overseq threshold per sample: the MIGEC estimate
+        estimates = self._estimates()
+        rows = []
+        for sample in sorted(set(estimates) | set(peaks), key=lambda sample: (sample not in estimates, sample)):
+            estimate = estimates.get(sample, {})
+            rows.append({
+                'sample_id': sample,
+                'total_reads': estimate.get('TOTAL_READS'),
+                'total_migs': estimate.get('TOTAL_MIGS'),
+                'overseq_threshold': estimate.get('OVERSEQ_THRESHOLD'),
+                'collision_threshold': estimate.get('COLLISION_THRESHOLD'),
+                'overseq_peak': peaks.get(sample),
+            })
+
+        with open(self._dir + '/overseq_summary.json', 'w') as file:
+            json.dump(rows, file, indent=1)
+        fields = ('sample_id', 'total_reads', 'total_migs', 'overseq_threshold', 'collision_threshold', 'overseq_peak')
+        with open(self._dir + '/overseq_summary.tsv', 'w') as file:
+            file.write('\t'.join(fields) + '\n')
+            for row in rows:
+                file.write('\t'.join('NA' if row[field] is None else str(row[field]) for field in fields) + '\n')
+
+        return '{0}/overseq_summary.tsv\n{0}/overseq_summary.json\n'.format(self._dir)
+
+# end of class HistogramRenderer
@@ -1,10 +1,17 @@
 import re
 import os
 import inspect
-import glob
+import json
+import fnmatch
+import hashlib
+import time
+import threading
 
 
 class Bin:
+    index_name = '.index.json'
+    index_format = 2  # the index of an older format is rebuilt
+
     def __new__(cls, bin_dir=None):
         if not hasattr(cls, 'instance'):
             if bin_dir:
@@ -15,17 +22,124 @@ class Bin:
                 real_path = os.path.dirname(filename)
                 cls._bin = re.sub(r'/$', '', real_path) + '/bin'
             os.makedirs(cls._bin, exist_ok=True)
+            cls._lock = threading.RLock()
+            cls._index = None
+            cls._found = {}
             cls.instance = super(Bin, cls).__new__(cls)
 
         return cls.instance
 
-    def find(self, file_name):
-        path = self._bin + '/**/' + re.sub(r'^/', '', file_name)
-        glb = glob.glob(path, recursive=True)
-        if len(glb) > 0:
-            return os.path.abspath(glb[0])
+    @staticmethod
+    def _version(rel_path):  # 'mixcr/mixcr-3.0.13/mixcr.jar' -> [3, 0, 13], the dirs of the bin give the version too
+        return [int(number) for number in re.findall(r'\d+', rel_path)]
+
+    @staticmethod
+    def _match(rel_path, file_name):  # as glob 'bin/**/file_name': the mask matches the last path components
+        rel_parts = rel_path.split('/')
+        parts = file_name.split('/')
+
+        return len(rel_parts) >= len(parts) and all(
+            fnmatch.fnmatchcase(rel_part, part) for rel_part, part in zip(rel_parts[-len(parts):], parts))
+
+    def _scan(self):  # the manifest of the files (without the hidden ones like glob) and the directory mtimes
+        index = {'format': self.index_format, 'dirs': {}, 'files': {}}
+        for dir_path, dir_names, file_names in os.walk(self._bin):
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+            index['dirs'][dir_path] = os.stat(dir_path).st_mtime_ns
+            for file_name in file_names:
+                if not file_name.startswith('.'):
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    rel_path = os.path.relpath(os.path.join(dir_path, file_name), self._bin)
+                    index['files'][rel_path] = {'version': self._version(rel_path), 'size': stat.st_size,
+                                                'mtime': stat.st_mtime_ns}
+
+        return index
+
+    def _changed(self, index):
+        for dir_path, mtime in index['dirs'].items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+    def _load(self):  # the index is checked once per run and rebuilt only if a directory of the bin is changed
+        if self._index is not None:
+            return self._index
+
+        index_file = os.path.join(self._bin, self.index_name)
+        index = None
+        if os.path.isfile(index_file):
+            try:
+                with open(index_file, 'r') as file:
+                    index = json.load(file)
+            except ValueError:
+                index = None
+        if not index or index.get('format') != self.index_format or self._changed(index):
+            index = self._scan()
+            self._save(index)
+        self._index = index
+
+        return index
+
+    def _save(self, index):  # rewritten in place: a new file would change the mtime of the bin directory
+        index_file = os.path.join(self._bin, self.index_name)
+        try:
+            existed = os.path.isfile(index_file)
+            with open(index_file, 'w') as file:
+                json.dump(index, file, indent=1, sort_keys=True)
+            if not existed:
+                index['dirs'][self._bin] = os.stat(self._bin).st_mtime_ns
+                with open(index_file, 'w') as file:
+                    json.dump(index, file, indent=1, sort_keys=True)
+        except OSError:
+            pass  # a read-only bin directory works without the saved index
+
+    def refresh(self):  # has to be called after the tools are installed
+        with self._lock:
+            self._index = None
+            self._found = {}
+            self._save(self._scan())
 
-        return None
+    def checksum(self, path):  # the content of the file, hashed again only if its size or mtime is changed
+        with self._lock:
+            stat = os.stat(path)
+            entry = self._load()['files'].get(os.path.relpath(path, self._bin))
+            if entry and entry.get('sha256') and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime_ns):
+                return entry['sha256']
+
+            sha = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    sha.update(chunk)
+            if entry:  # a file replaced in place keeps the directory mtime: the index is updated here
+                entry.update(size=stat.st_size, mtime=stat.st_mtime_ns, sha256=sha.hexdigest())
+                self._save(self._index)
+
+            return sha.hexdigest()
+
+    def find(self, file_name):  # the highest version of the matching files
+        file_name = re.sub(r'^/', '', file_name)
+        with self._lock:
+            if file_name in self._found:
+                path = self._found[file_name]
+                if path is None or os.path.isfile(path):
+                    return path
+
+            matches = [rel_path for rel_path in self._load()['files'] if self._match(rel_path, file_name)]
+            path = None
+            if matches:
+                best = max(matches, key=lambda rel_path: (self._index['files'][rel_path]['version'], rel_path))
+                path = os.path.abspath(os.path.join(self._bin, best))
+                if not os.path.isfile(path):  # the bin is changed during the run
+                    self._index = None
+                    self._found = {}
+                    return self.find(file_name)
+            self._found[file_name] = path
+
+            return path
 
     def path(self):
         return self._bin
@@ -39,30 +153,177 @@ class Xmx:
             raise Exception("Wrong value of memory usage limit: {} (default value is '8G')".format(mem))
         if not hasattr(cls, 'instance'):
             cls._mem = mem
+            cls._local = threading.local()  # the heap granted to the step of the thread (see TaskGraph)
             cls.instance = super(Xmx, cls).__new__(cls)
 
         return cls.instance
 
+    def grant(self, megabytes=None):
+        self._local.megabytes = megabytes
+
     def get(self):
-        xmx = '-Xmx' + self._mem
+        granted = getattr(self._local, 'megabytes', None)
+        xmx = '-Xmx{}M'.format(granted) if granted else '-Xmx' + self._mem
 
         return xmx
 
+    def megabytes(self):
+        size = int(self._mem[:-1])
+        return size * 1024 if self._mem.endswith('G') else size
+
+    def share(self, n_jvm=1):  # the heap limit of one of n_jvm concurrent JVMs within the global (or granted) limit
+        n_jvm = max(1, int(n_jvm))
+        if n_jvm == 1:
+            return self.get()
+
+        return '-Xmx{}M'.format(max(1, (getattr(self._local, 'megabytes', None) or self.megabytes()) // n_jvm))
+
 # end of class Xmx (Singleton)
 
 
+class Workers:
+    def __new__(cls, n_workers=1):
+        if not re.search(r'^\d+$', str(n_workers)) or int(n_workers) < 1:
+            raise Exception("Wrong number of workers: {} (default value is 1)".format(n_workers))
+        if not hasattr(cls, 'instance'):
+            cls._n = int(n_workers)
+            cls.instance = super(Workers, cls).__new__(cls)
+
+        return cls.instance
+
+    def get(self):
+        return self._n
+
+# end of class Workers (Singleton)
+
+
 class Log:
-    def __init__(self, log_file=None):
+    banners = {
+        'QC': '====================QC=======================',
+        'MIGEC': '====================MIGEC====================',
+        'Subsample': '====================Subsample================',
+        'MIXCR': '====================MIXCR====================',
+        'VDJtools': '====================VDJtools==================',
+    }
+
+    def __init__(self, log_file=None, events_file=None):
+        # the step events go to the .jsonl of the log file, or to events_file without a log file
         self._file_name = log_file
-        self._log = ''
+        self._events_name = log_file + '.jsonl' if log_file else events_file
+        self._lock = threading.Lock()
+        self._log = None
+        self._events = None
+        if self._events_name:  # both files are appended and flushed by every record, so a crash keeps the log
+            os.makedirs(os.path.dirname(self._events_name) or '.', exist_ok=True)
+            self._events = open(self._events_name, 'w')
+        if log_file:
+            self._log = open(self._file_name, 'w')
+
+    def get_file(self):
+        return self._file_name
+
+    def get_events_file(self):
+        return self._events_name
+
+    def _emit(self, event):
+        if not self._events:
+            return
+
+        event['time'] = time.time()
+        with self._lock:
+            if self._events.closed:
+                return
+            self._events.write(json.dumps(event) + '\n')
+            self._events.flush()
+            if self._log:
+                self._log.write(self.render_event(event))
+                self._log.flush()
 
     def add(self, string):
-        self._log += string if re.search(r'\n$', string) else string + "\n"
+        self._emit({'event': 'text', 'text': string if re.search(r'\n$', string) else string + "\n"})
 
-    def write(self):
-        if self._file_name:
-            with open(self._file_name, "w") as lg:
-                lg.write(self._log)
+    def step(self, task):  # a finished step of the pipeline (see TaskGraph)
+        output = task.output or ''
+        self._emit({
+            'event': 'step',
+            'stage': task.stage,
+            'step': task.step,
+            'sample': task.sample,
+            'order': task.index,
+            'start': task.start,
+            'end': task.end,
+            'exit_code': task.exit_code,
+            'skipped': task.skipped,
+            'cached': task.cached,
+            'output_size': len(output.encode('utf-8')),
+            'output': output,
+            'error': str(task.error) if task.error else None,
+        })
 
-# end of class Log
+    @classmethod
+    def render_event(cls, event):
+        if event['event'] == 'text':
+            return event['text']
 
+        header = '>>>{}<<<\n'.format(event['step'])
+        if event['sample']:
+            header += '>>>{}<<<\n'.format(event['sample'])
+
+        return header + cls._text(event)
+
+    @staticmethod
+    def _text(event):  # the output of the step and the error of a failed one
+        if not event.get('error'):
+            return event['output']
+
+        return event['output'] + '[error] {}\n'.format(event['error'].rstrip('\n'))
+
+    @classmethod
+    def render(cls, events):  # the step outputs are grouped in the pipeline order: stage, step, sample
+        head = ''
+        tail = ''
+        steps = {}
+        for event in events:
+            if event['event'] == 'text':
+                if steps:
+                    tail += event['text']
+                else:
+                    head += event['text']
+            elif event['output'] or event.get('error'):
+                steps.setdefault(event['stage'], {}).setdefault(event['step'], []).append(event)
+
+        text = head
+        for stage, stage_steps in sorted(steps.items(), key=lambda item: min(
+                event['order'] for step_events in item[1].values() for event in step_events)):
+            text += ('\n' if text else '') + cls.banners.get(stage, '===================={}===================='.format(
+                stage)) + '\n'
+            for step, step_events in sorted(stage_steps.items(), key=lambda item: min(
+                    event['order'] for event in item[1])):
+                text += '>>>{}<<<\n'.format(step)
+                for event in sorted(step_events, key=lambda event: event['order']):
+                    text += ('>>>{}<<<\n'.format(event['sample']) if event['sample'] else '') + cls._text(event)
+
+        return text + tail
+
+    def write(self):  # the final log is rebuilt from the event stream in the stable order
+        if not self._log:
+            return
+
+        with self._lock:
+            if self._log.closed:
+                return
+            self._events.flush()
+            with open(self._events_name, 'r') as file:
+                text = self.render([json.loads(line) for line in file if line.strip()])
+            self._log.seek(0)
+            self._log.truncate()
+            self._log.write(text)
+            self._log.flush()
+
+    def close(self):
+        with self._lock:
+            for file in (self._log, self._events):
+                if file:
+                    file.close()
+
+# end of class Log
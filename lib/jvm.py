@@ -0,0 +1,199 @@
+import os
+import re
+import glob
+import time
+import shutil
+import socket
+import zipfile
+import threading
+import subprocess
+
+from lib.inout import Bin, Xmx
+
+
+class JavaLauncher:
+    # the java tools run in new JVMs or as the calls of the warm nailgun servers on the free ports from --jvm-port;
+    # a server has the heap granted to the step (rounded up to heap_step MB) and runs one call at a time, an idle
+    # server of the jar with enough heap is reused; the heap of all servers stays within -m: the least recently used
+    # idle servers are stopped first, else the call runs in a plain JVM; a killed ng call (a timeout, a cancelled run)
+    # doesn't stop the tool in the server, so the server of a killed call is stopped
+    modes = ('subprocess', 'nailgun')
+    server_class = 'com.facebook.nailgun.NGServer'
+    server_jar = 'nailgun-server*.jar'
+    port_range = 100  # the ports tried from --jvm-port
+    heap_step = 512  # MB
+
+    def __new__(cls, mode='subprocess', port=2113):
+        if mode not in cls.modes:
+            raise Exception("Wrong JVM launcher mode: {} (it has to be one of: {})".format(mode, ', '.join(cls.modes)))
+        if not hasattr(cls, 'instance'):
+            cls._mode = mode
+            cls._port = int(port)
+            cls._jars = []
+            cls._servers = {}  # port -> {'jar', 'heap' (MB), 'process', 'busy', 'used' (the time of the last call)}
+            cls._no_server = False  # no nailgun server jar or ng client: the plain JVMs only
+            cls._lock = threading.Lock()
+            cls.instance = super(JavaLauncher, cls).__new__(cls)
+
+        return cls.instance
+
+    def get_mode(self):
+        return self._mode
+
+    def register(self, jar):  # the java tools of the run
+        with self._lock:
+            if jar and jar not in self._jars:
+                self._jars.append(jar)
+
+    def command(self, jar, xmx=None):  # an ng call reserves its server until called() (see JavaTool)
+        xmx = xmx or Xmx().get()
+        if self._mode == 'nailgun':
+            server = self._server(jar, self._megabytes(xmx))
+            if server:
+                try:
+                    return 'ng --nailgun-port {} {}'.format(server, self._main_class(jar))
+                except Exception:
+                    self.called(server)
+                    raise
+
+        return 'java ' + xmx + ' -jar ' + jar
+
+    @staticmethod
+    def _megabytes(xmx):  # '-Xmx2G' -> 2048
+        size = re.search(r'(\d+)([GM])$', xmx)
+        return int(size.group(1)) * (1024 if size.group(2) == 'G' else 1)
+
+    @staticmethod
+    def _main_class(jar):
+        with zipfile.ZipFile(jar) as archive:
+            manifest = archive.read('META-INF/MANIFEST.MF').decode('utf-8', 'replace')
+        main_class = re.search(r'^Main-Class:\s*(\S+)', manifest, re.MULTILINE)
+        if not main_class:
+            raise Exception("No Main-Class in the jar file: {}".format(jar))
+
+        return main_class.group(1)
+
+    @staticmethod
+    def _alive(port):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def _free_port(self):  # a port nobody listens on, the servers of the other runs are skipped
+        for port in range(self._port, self._port + self.port_range):
+            if port in self._servers:
+                continue
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.bind(('127.0.0.1', port))
+                except OSError:
+                    continue
+            return port
+
+        return None
+
+    @staticmethod
+    def _owns(process, port):  # the listening socket of the port belongs to the process (Linux /proc)
+        inodes = set()
+        for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+            try:
+                with open(table, 'r') as file:
+                    for line in file.readlines()[1:]:
+                        fields = line.split()
+                        if fields[1].endswith(':{:04X}'.format(port)) and fields[3] == '0A':  # LISTEN
+                            inodes.add('socket:[{}]'.format(fields[9]))
+            except (OSError, IndexError):
+                return True  # no /proc, the port is checked to be free before the start
+        for fd in glob.glob('/proc/{}/fd/*'.format(process.pid)):
+            try:
+                if os.readlink(fd) in inodes:
+                    return True
+            except OSError:
+                continue
+
+        return False
+
+    def _idle(self, jar, heap):  # the port of the smallest idle server of the jar with enough heap
+        for port, server in sorted(self._servers.items(), key=lambda item: item[1]['heap']):
+            if server['jar'] != jar or server['busy'] or server['heap'] < heap:
+                continue
+            if server['process'].poll() is None and self._alive(port):
+                return port
+            self._terminate(self._servers.pop(port)['process'])
+
+        return None
+
+    def _fit(self, heap):  # the idle servers are stopped until the new heap fits into -m
+        budget = Xmx().megabytes()
+        idle = sorted((server['used'], port) for port, server in self._servers.items() if not server['busy'])
+        while idle and sum(server['heap'] for server in self._servers.values()) + heap > budget:
+            self._terminate(self._servers.pop(idle.pop(0)[1])['process'])
+
+        return sum(server['heap'] for server in self._servers.values()) + heap <= budget
+
+    def _server(self, jar, megabytes):  # the port of a reserved server for the jar or None to fall back to a plain JVM
+        heap = min(Xmx().megabytes(), -(-megabytes // self.heap_step) * self.heap_step)
+        with self._lock:
+            if self._no_server:
+                return None
+            port = self._idle(jar, heap)
+            if port:
+                self._servers[port]['busy'] = True
+                return port
+
+            server_jar = Bin().find(self.server_jar)
+            if not server_jar or not shutil.which('ng'):
+                self._no_server = True
+                return None
+            port = self._free_port()
+            if not port or not self._fit(heap):
+                return None
+
+            cmd = ['java', '-Xmx{}M'.format(heap), '-cp', os.pathsep.join((server_jar, jar)),
+                   self.server_class, '127.0.0.1:{}'.format(port)]
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for _ in range(100):
+                if process.poll() is not None:  # the port is taken by another server meanwhile
+                    break
+                if self._alive(port) and self._owns(process, port):
+                    self._servers[port] = {'jar': jar, 'heap': heap, 'process': process, 'busy': True,
+                                           'used': time.time()}
+                    return port
+                time.sleep(0.1)
+
+            process.kill()
+            return None
+
+    @staticmethod
+    def port(cmd):  # the server port of an ng call or None
+        match = re.match(r'^ng --nailgun-port (\d+) ', cmd)
+        return int(match.group(1)) if match else None
+
+    def called(self, port, killed=False):  # the ng call is finished: the server is idle or stopped after a kill
+        with self._lock:
+            server = self._servers.get(port)
+            if not server:
+                return
+            if killed:
+                self._terminate(self._servers.pop(port)['process'])
+            else:
+                server.update(busy=False, used=time.time())
+
+    @staticmethod
+    def _terminate(process):
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def stop(self):
+        with self._lock:
+            for server in self._servers.values():
+                self._terminate(server['process'])
+            self._servers.clear()
+
+# end of class JavaLauncher (Singleton)
@@ -1,5 +1,20 @@
-from lib.inout import Bin, Xmx
-from lib.tools import VDJtools, Mixcr, Migec, MigecHistogram
+import os
+import re
+import glob
+
+from lib.inout import Bin, Log, Xmx, Workers
+from lib.executor import Executor, TaskGraph
+from lib.checkpoint import Checkpoint
+from lib.artifacts import ToolState
+from lib.runner import Metrics, Runner
+from lib.scratch import Scratch
+from lib.qc import FastqQC
+from lib.subsample import Subsampler
+from lib.retention import Retention
+from lib.heap import HeapModel, FixedHeap
+from lib.cache import ResultCache
+from lib.progress import Progress
+from lib.tools import SampleTable, VDJtools, Mixcr, Migec, MigecHistogram
 
 
 class Pipe:
@@ -11,26 +26,51 @@ class Pipe:
     def execute(self, log):
         raise Exception("Can't execute the pipeline.")
 
-    def check(self):
+    def get_tools(self):
+        return list(self._tools.values())
+
+    def check(self):  # the tools are checked at the same time, the verified ones are not probed again
         if len(self._tools) > 0:
-            for tool in self._tools.values():
+            state = ToolState()
+            tools = [tool for tool in self._tools.values() if not state.verified(tool)]
+
+            def check(tool):
                 tool.check()
+                state.set(tool)
+
+            try:
+                Executor(len(tools) or 1).map(check, tools)
+            finally:
+                state.write()
         else:
             raise Exception("The empty pipeline.")
 
 # end of class Pipe
 
 
-class MiSeqPipe(Pipe):
+class SeqPipe(Pipe):
     def __init__(self, in_dir, out_dir):
-        super(MiSeqPipe, self).__init__()
-        self._tools['migec'] = Migec(in_dir, out_dir)
-        self._tools['mixcr'] = Mixcr(in_dir, out_dir)
+        super(SeqPipe, self).__init__()
+        self._samples = SampleTable(in_dir)
+        self._tools['migec'] = Migec(in_dir, out_dir, self._samples)
+        self._tools['mixcr'] = Mixcr(in_dir, out_dir, self._samples)
         self._tools['vdjtools'] = VDJtools(out_dir)
-        self._tools['migec_hist'] = MigecHistogram()
+        self._in_dir = in_dir
+        self._out_dir = out_dir
         self._overseq = None
         self._collisions = None
-
+        self._force_stages = []
+        self._vdjtools_batch = False
+        self._qc = True
+        self._subsample = None
+        self._subsample_seed = 1
+        self._retention = {}
+        self._archiver = None
+        self._heap = 'fixed'
+        self._cache = None
+        self._progress_server = None
+        self._run = None  # the state of the run in the graph (see attach)
+        self.set_histogram_renderer('python')
 
     def set_overseq(self, overseq):
         self._overseq = overseq
@@ -38,96 +78,396 @@ class MiSeqPipe(Pipe):
     def set_collisions(self, collisions):
         self._collisions = collisions
 
-    def execute(self, log):
-        try:
-            log.add('====================MIGEC====================\n')
-            migec = self._tools['migec']
-            log.add('>>>CheckoutBatch<<<\n' + migec.checkout_batch())
-            log.add('>>>Histogram<<<\n' + migec.histogram())
-            log.add('>>>HistogramDrawing<<<\n' + migec.draw())
-            log.add('>>>AssembleBatch<<<\n' + migec.assemble_batch(self._overseq, self._collisions))
-        except Exception as error:
-            log.add('\nMIGEC error:\n{}'.format(error))
+    def set_force_stages(self, stages):  # the stages or steps recomputed in spite of the checkpoints
+        self._force_stages = stages or []
+
+    def set_vdjtools_batch(self, batch):  # one VDJtools JVM per operation for all samples
+        self._vdjtools_batch = batch
+
+    def set_subsample(self, target, seed=1):  # the depth of the samples: a number of reads, 'exp' or 'min'
+        if target and target not in ('exp', 'min') and not re.search(r'^\d+$', str(target)):
+            raise Exception('Wrong the subsample target: {}'.format(target))
+        self._subsample = target
+        self._subsample_seed = seed
+
+    def set_retention(self, policy):  # {stage or step: keep, delete or compress} for the intermediates
+        for key, action in (policy or {}).items():
+            if action not in Retention.actions:
+                raise Exception('Wrong the retention of {}: {} (keep, delete or compress)'.format(key, action))
+        self._retention = policy or {}
+
+    def set_archiver(self, archiver):  # the results are archived as soon as their steps are done (see Archiver)
+        self._archiver = archiver
+
+    def set_heap(self, heap):  # fixed: -m shared by the workers, adaptive: the heap of every step from its input
+        if heap not in ('fixed', 'adaptive'):
+            raise Exception('Wrong the heap sizing: {} (fixed or adaptive)'.format(heap))
+        self._heap = heap
+
+    def set_cache(self, cache_dir, size='50G'):  # the sample steps done by the earlier runs are reused
+        self._cache = (cache_dir, size) if cache_dir else None
+
+    def set_progress_server(self, server):  # the live progress of the run is served to the front end
+        self._progress_server = server
+
+    def get_out_dir(self):
+        return self._out_dir
+
+    def set_qc(self, qc):  # the input FASTQ files are checked before the first JVM
+        self._qc = qc
+
+    def set_checkout_shards(self, shards):
+        self._tools['migec'].set_shards(shards)
+
+    def set_vdjtools_backend(self, backend):
+        self._tools['vdjtools'].set_backend(backend)
+
+    def set_histogram_renderer(self, renderer):  # histogram.R is checked only if R draws the histograms
+        self._tools['migec'].set_renderer(renderer)
+        if self._tools['migec'].get_renderer() == 'R':
+            self._tools['migec_hist'] = MigecHistogram()
+        else:
+            self._tools.pop('migec_hist', None)
+
+    @staticmethod
+    def _files(*masks):  # the lister of the step files (a step has to be done before its files are listed)
+        return lambda: sorted(set(name for mask in masks for name in glob.glob(mask) if os.path.isfile(name)))
+
+    def _records(self):
+        return list(self._samples)
+
+    def _sample_tasks(self, graph, record, reads, reads_dir, xmx):  # returns the clonotypes task and the dir
+        raise Exception("Can't build the sample steps of the pipeline.")
+
+    def _build(self, graph, xmx=None):  # shared MIGEC steps first, then an independent chain of steps per sample
+        migec = self._tools['migec']
+        records = self._records()
+        checkout_dir = migec.get_checkout_dir()
+        histogram_dir = migec.get_histogram_dir()
+        assemble_dir = migec.get_assemble_dir()
+        tool = {'tool': migec.get_version()}
+
+        qc = []
+        if self._qc:
+            fastq_qc = FastqQC(self._samples, self._out_dir)
+            qc.append(graph.add(fastq_qc.run, 'QC', 'FastqQC', inputs=migec.get_input_files,
+                                outputs=lambda: [fastq_qc.get_file()],
+                                params={'reads_exp': [record.reads_exp for record in records]}))
+        checkout = graph.add(migec.checkout_batch, 'MIGEC', 'CheckoutBatch', deps=qc,
+                             inputs=lambda: [migec.get_barcodes_file()] + migec.get_input_files(),
+                             outputs=self._files(checkout_dir + '/*'),
+                             params=dict(tool, shards=migec.get_shards()),
+                             intermediates=self._files(checkout_dir + '/*.fastq*'))
+        histogram = graph.add(migec.histogram, 'MIGEC', 'Histogram', deps=[checkout],
+                              inputs=checkout.outputs, outputs=self._files(histogram_dir + '/*'), params=tool)
+        graph.add(migec.draw, 'MIGEC', 'HistogramDrawing', deps=[histogram],
+                  inputs=self._files(histogram_dir + '/*.txt'),
+                  outputs=self._files(*['{}/*.{}'.format(histogram_dir, ext) for ext in ('svg', 'png', 'pdf', 'tsv',
+                                                                                          'json')]),
+                  params={'renderer': migec.get_renderer()})
+
+        assembled = []
+        clonotypes = []
+        last_steps = []
+        clones_dir = None
+        for record in records:
+            name = glob.escape(record.sample_name)
+            assemble = graph.add(
+                lambda name=record.sample_name: migec.assemble_sample(name, self._overseq, self._collisions, xmx),
+                'MIGEC', 'AssembleBatch', record.sample_name, [histogram],
+                inputs=self._files('{}/{}_R[12]*'.format(checkout_dir, name), checkout_dir + '/checkout.filelist.txt',
+                                   histogram_dir + '/*.txt'),
+                outputs=self._files('{}/{}_R[12].*'.format(assemble_dir, name),
+                                    '{}/samples/{}/*'.format(assemble_dir, name)),
+                params=dict(tool, overseq=self._overseq, collisions=self._collisions),
+                intermediates=self._files('{}/{}_R[12].*'.format(assemble_dir, name),
+                                          '{}/samples/{}/assemble.log.txt'.format(assemble_dir, name)),
+                input_parts=lambda name=record.sample_name: migec.sample_tables(name))
+            assembled.append(assemble)
+
+        subsampler = Subsampler(self._out_dir, self._subsample_seed)
+        for record, assemble in zip(records, assembled):
+            reads, reads_dir = assemble, assemble_dir
+            if self._subsample:
+                reads, reads_dir = self._subsample_task(graph, subsampler, record, assembled, assemble_dir)
+            clonotype, clones_dir = self._sample_tasks(graph, record, reads, reads_dir, xmx)
+            clonotypes.append(clonotype)
+            if not self._vdjtools_batch or self._tools['vdjtools'].get_backend() == 'python':
+                last_steps.append(self._vdjtools_tasks(graph, record, clonotype, clones_dir, xmx))
+
+        if self._vdjtools_batch and self._tools['vdjtools'].get_backend() != 'python':
+            last_steps.append(self._vdjtools_batch_tasks(graph, records, clonotypes, clones_dir))
+
+        names = [record.sample_name for record in records]
+        graph.add(lambda: migec.merge_assemble_logs(names) or '', 'MIGEC', 'AssembleLogs', deps=assembled,
+                  inputs=self._files(*['{}/samples/{}/assemble.log.txt'.format(assemble_dir, glob.escape(name))
+                                       for name in names]),
+                  outputs=self._files(assemble_dir + '/assemble.log.txt'))
+        mixcr = self._tools['mixcr']
+        graph.add(lambda: mixcr.merge_reports(records) or '', 'MIXCR', 'Reports', deps=last_steps,
+                  inputs=self._files(*[glob.escape(mixcr.get_report(step, name)) for step in ('align', 'assemble')
+                                       for name in names]),
+                  outputs=self._files(mixcr.get_alignment_dir() + '/alignmentReport.txt',
+                                      mixcr.get_clones_dir() + '/assembleReport.txt'))
+
+    def _subsample_task(self, graph, subsampler, record, assembled, assemble_dir):  # returns the reads task and dir
+        # exp is the expected number of the raw reads: it cuts only the samples assembled to more reads than expected;
+        # min is the depth of the shallowest assembled sample of the run, all the samples are brought to it
+        names = [task.sample for task in assembled]
+        name = glob.escape(record.sample_name)
+        inputs = ['{}/{}_R[12].*'.format(assemble_dir, name)]
+        deps = [task for task in assembled if task.sample == record.sample_name]
+        if self._subsample == 'min':
+            target = lambda: subsampler.min_reads(assemble_dir, names)
+            inputs = ['{}/{}_R1.*'.format(assemble_dir, glob.escape(other)) for other in names] + inputs
+            deps = assembled
+        else:
+            target = record.reads_exp if self._subsample == 'exp' else int(self._subsample)
+            if not target:
+                raise Exception('No expected number of reads (reads_exp) of the sample {}.'.format(record.sample_name))
+
+        subsample = graph.add(lambda: subsampler.subsample(assemble_dir, record.sample_name,
+                                                           target() if callable(target) else target),
+                              'Subsample', 'Subsample', record.sample_name, deps,
+                              inputs=self._files(*inputs),
+                              outputs=self._files('{}/{}_R[12].*'.format(subsampler.get_dir(), name)),
+                              params={'target': self._subsample if callable(target) else int(target),
+                                      'seed': self._subsample_seed},
+                              intermediates=self._files('{}/{}_R[12].*'.format(subsampler.get_dir(), name)))
+
+        return subsample, subsampler.get_dir()
+
+    def _vdjtools_tasks(self, graph, record, clonotypes, clones_dir, xmx):
+        vdjtools = self._tools['vdjtools']
+        name = glob.escape(record.sample_name)
+        vdj_dir = vdjtools.get_vdj_dir()
+        tool = {'tool': vdjtools.get_version()}
+
+        if vdjtools.get_backend() == 'python':  # one in-process step instead of two JVMs
+            return graph.add(lambda: vdjtools.convert_filter(clones_dir, record.sample_name),
+                             'VDJtools', 'ConvertFilter', record.sample_name, [clonotypes],
+                             inputs=self._files('{}/{}[._]clonotypes*.txt'.format(clones_dir, name)),
+                             outputs=self._files('{}/vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name),
+                                                 '{}/nc.vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name)),
+                             params=tool)
+
+        convert = graph.add(lambda: vdjtools.convert(clones_dir, record.sample_name, xmx),
+                            'VDJtools', 'Convert', record.sample_name, [clonotypes],
+                            inputs=self._files('{}/{}[._]clonotypes*.txt'.format(clones_dir, name)),
+                            outputs=self._files('{}/vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name)),
+                            params=tool)
+        vdj_filter = graph.add(lambda: vdjtools.filter(None, record.sample_name, xmx),
+                               'VDJtools', 'Filter', record.sample_name, [convert],
+                               inputs=convert.outputs,
+                               outputs=self._files('{}/nc.vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name)),
+                               params=tool)
+
+        return vdj_filter
+
+    def _vdjtools_batch_tasks(self, graph, records, clonotypes, clones_dir):
+        vdjtools = self._tools['vdjtools']
+        vdj_dir = vdjtools.get_vdj_dir()
+        tool = {'tool': vdjtools.get_version()}
+        names = [glob.escape(record.sample_name) for record in records]
+        metadata = [[record.sample_name, record.subject_id, record.antigen, record.baseline] for record in records]
+
+        convert = graph.add(lambda: vdjtools.convert_batch(records, clones_dir),
+                            'VDJtools', 'Convert', deps=clonotypes,
+                            inputs=self._files(*['{}/{}[._]clonotypes*.txt'.format(clones_dir, name)
+                                                 for name in names]),
+                            outputs=self._files(*['{}/vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name)
+                                                  for name in names]),
+                            params=dict(tool, metadata=metadata))
+        vdj_filter = graph.add(lambda: vdjtools.filter_batch(records),
+                               'VDJtools', 'Filter', deps=[convert],
+                               inputs=convert.outputs,
+                               # metadata.txt of the jar is written by both steps, it is an output of neither
+                               outputs=self._files(*['{}/nc.vdj.{}[._]clonotypes*.txt'.format(vdj_dir, name)
+                                                     for name in names]),
+                               params=dict(tool, metadata=metadata))
+
+        return vdj_filter
+
+    def attach(self, graph, log, heap=None):  # the steps of the run are added to the graph, returns the scope
+        checkpoint = Checkpoint(self._out_dir, self._force_stages)
+        retention = Retention(self._out_dir, self._retention, Scratch().get_dir(), checkpoint)
+        metrics = Metrics(self._out_dir + '/metrics.csv')
+        cache = ResultCache(self._cache[0], self._cache[1], self._out_dir, checkpoint) if self._cache else None
+        progress = Progress(self._out_dir)
+        scope = graph.scope(checkpoint=checkpoint, log=log, listeners=(retention, self._archiver, heap), cache=cache,
+                            metrics=metrics, progress=progress)
+        for tool in self._tools.values():
+            tool.set_metrics(metrics)
+            tool.set_log_dir(self._out_dir + '/logs')
+            tool.set_progress(progress)
+        # the heap of the steps is granted by the graph with a heap model, -m is shared by the samples otherwise
+        self._build(scope, None if heap else self._xmx.share(Executor().workers(len(self._records()))))
+
+        self._run = {'retention': retention, 'metrics': metrics, 'cache': cache, 'scope': scope, 'progress': progress}
+        progress.start(sum(1 for task in graph.get_tasks() if task.scope is scope))
+        if self._progress_server:
+            self._progress_server.add(progress)
+        retention.start()
+        return scope
+
+    def finish(self, log, heap=None):  # the summaries of the run after the graph, returns the failed step or None
+        retention, metrics, cache, scope = (self._run[key] for key in ('retention', 'metrics', 'cache', 'scope'))
+        retention.stop()
+        self._run['progress'].close(scope.failed)
+        if metrics.get_records():
+            log.add(metrics.summary())
+        log.add(retention.summary())
+        if heap:
+            log.add(heap.summary())
+        if cache:
+            log.add(cache.summary())
+        if scope.failed:
+            log.add('\n{} error:\n{}'.format(scope.failed.stage, scope.failed.error))
             log.write()
-            exit('...error')
+            return scope.failed
+
+        Scratch().clean()  # the intermediates are kept on the scratch for a rerun only if the pipeline is failed
+        log.add(Scratch().summary() + '\n...done')
+        log.write()
+
+    def heap(self):  # the heap model of the runs of the graph (see HeapModel)
+        if self._heap == 'adaptive':
+            return HeapModel(self._xmx.megabytes(), self._bin.path() + '/.heap.csv')
 
+    def execute(self, log):
+        heap = self.heap()
+        graph = TaskGraph(cancel=Runner().get_cancel(), memory=heap)
         try:
-            log.add('\n====================MIXCR====================\n')
-            mixcr = self._tools['mixcr']
-            log.add('>>>Analyze<<<\n' + mixcr.analyze(migec.get_assemble_dir()))
+            self.attach(graph, log, heap)
         except Exception as error:
-            log.add('\nMIXCR error:\n{}'.format(error))
+            log.add('\nPipeline error:\n{}'.format(error))
             log.write()
             exit('...error')
 
         try:
-            log.add('\n====================VDJtools==================\n')
-            vdjtools = self._tools['vdjtools']
-            log.add('>>>Convert<<<\n' + vdjtools.convert(mixcr.get_analyze_dir()))
-            log.add('>>>Filter<<<\n' + vdjtools.filter())
-        except Exception as error:
-            log.add('\nVDJtools error:\n{}'.format(error))
-            log.write()
+            graph.run()
+        finally:
+            failed = self.finish(log, heap)
+        if failed:
             exit('...error')
 
-        log.add('\n...done')
-        log.write()
+# end of class SeqPipe
+
+
+class MiSeqPipe(SeqPipe):
+    def _sample_tasks(self, graph, record, reads, reads_dir, xmx):
+        mixcr = self._tools['mixcr']
+        name = glob.escape(record.sample_name)
+        tool = {'tool': mixcr.get_version()}
+
+        analyze = graph.add(lambda: mixcr.analyze_sample(record, reads_dir, xmx),
+                            'MIXCR', 'Analyze', record.sample_name, [reads],
+                            inputs=reads.outputs,
+                            outputs=self._files('{}/{}.*'.format(mixcr.get_analyze_dir(), name)),
+                            params=dict(tool, chain=record.chain),
+                            intermediates=self._files(*['{}/{}.{}'.format(mixcr.get_analyze_dir(), name, ext)
+                                                        for ext in ('vdjca', 'clns', 'clna')]))
+
+        return analyze, mixcr.get_analyze_dir()
 
 # end of class MiSeqPipe
 
 
-class NextSeqPipe(Pipe):
-    def __init__(self, in_dir, out_dir):
-        super(NextSeqPipe, self).__init__()
-        self._tools['migec'] = Migec(in_dir, out_dir)
-        self._tools['mixcr'] = Mixcr(in_dir, out_dir)
-        self._tools['vdjtools'] = VDJtools(out_dir)
-        self._tools['migec_hist'] = MigecHistogram()
-        self._overseq = None
-        self._collisions = None
+class NextSeqPipe(SeqPipe):
+    def _sample_tasks(self, graph, record, reads, reads_dir, xmx):
+        mixcr = self._tools['mixcr']
+        name = glob.escape(record.sample_name)
+        alignment_dir = mixcr.get_alignment_dir()
+        clones_dir = mixcr.get_clones_dir()
+        tool = {'tool': mixcr.get_version()}
 
-    def set_overseq(self, overseq):
-        self._overseq = overseq
+        align = graph.add(lambda: mixcr.align_sample(record, reads_dir, xmx),
+                          'MIXCR', 'Align', record.sample_name, [reads],
+                          inputs=reads.outputs,
+                          outputs=self._files('{}/{}_alignments.vdjca'.format(alignment_dir, name),
+                                              mixcr.get_report('align', name)),
+                          params=tool,
+                          intermediates=self._files('{}/{}_alignments.vdjca'.format(alignment_dir, name),
+                                                    mixcr.get_report('align', name)))
+        assemble = graph.add(lambda: mixcr.assemble_sample(record, alignment_dir, xmx),
+                             'MIXCR', 'Assemble', record.sample_name, [align],
+                             inputs=self._files('{}/{}_alignments.vdjca'.format(alignment_dir, name)),
+                             outputs=self._files('{}/{}_clonotypes.clns'.format(clones_dir, name),
+                                                 mixcr.get_report('assemble', name)),
+                             params=tool,
+                             intermediates=self._files('{}/{}_clonotypes.clns'.format(clones_dir, name),
+                                                       mixcr.get_report('assemble', name)))
+        export = graph.add(lambda: mixcr.export_sample(record, clones_dir, xmx),
+                           'MIXCR', 'ExportClones', record.sample_name, [assemble],
+                           inputs=self._files('{}/{}_clonotypes.clns'.format(clones_dir, name)),
+                           outputs=self._files('{}/{}_clonotypes.txt'.format(clones_dir, name)),
+                           params=dict(tool, chain=record.chain))
 
-    def set_collisions(self, collisions):
-        self._collisions = collisions
+        return export, clones_dir
 
-    def execute(self, log):
-        try:
-            log.add('====================MIGEC====================\n')
-            migec = self._tools['migec']
-            log.add('>>>CheckoutBatch<<<\n' + migec.checkout_batch())
-            log.add('>>>Histogram<<<\n' + migec.histogram())
-            log.add('>>>HistogramDrawing<<<\n' + migec.draw())
-            log.add('>>>AssembleBatch<<<\n' + migec.assemble_batch(self._overseq, self._collisions))
-        except Exception as error:
-            log.add('\nMIGEC error:\n{}'.format(error))
-            log.write()
-            exit('...error')
+# end of class NextSeqPipe
 
-        try:
-            log.add('\n====================MIXCR====================\n')
-            mixcr = self._tools['mixcr']
-            log.add('>>>Align<<<\n' + mixcr.align(migec.get_assemble_dir()))
-            log.add('>>>Assemble<<<\n' + mixcr.assemble(mixcr.get_alignment_dir()))
-            log.add('>>>ExportClones<<<\n' + mixcr.export(mixcr.get_clones_dir()))
-        except Exception as error:
-            log.add('\nMIXCR error:\n{}'.format(error))
-            log.write()
-            exit('...error')
+
+class BatchPipe(Pipe):
+    # several sequencing runs (MiSeq and NextSeq) in one graph: the tools are checked once, the steps of all runs
+    # share the workers and the memory, every run has its own output dir, log, checkpoints and metrics
+    log_name = 'tcr-factory.log'
+
+    def __init__(self, pipes):
+        super(BatchPipe, self).__init__()
+        self._pipes = list(pipes)
+        for pipe in self._pipes:
+            for tool in pipe.get_tools():
+                self._tools.setdefault(type(tool).__name__, tool)
+
+    @staticmethod
+    def read_manifest(file_name):  # (seq tool, input dir, output dir or None) of the runs
+        runs = []
+        with open(file_name, 'r') as file:
+            for n_line, line in enumerate(file, 1):
+                fields = line.strip().split('\t')
+                if not line.strip() or line.startswith('#'):
+                    continue
+                if fields[0] not in ('MiSeq', 'NextSeq') or len(fields) not in (2, 3):
+                    raise Exception('Wrong the batch manifest {} line {}: MiSeq|NextSeq<TAB>in_dir[<TAB>out_dir]'
+                                    .format(file_name, n_line))
+                runs.append((fields[0], re.sub(r'/$', '', fields[1]),
+                             re.sub(r'/$', '', fields[2]) if len(fields) > 2 and fields[2] else None))
+
+        return runs
+
+    def execute(self, log):
+        heap = self._pipes[0].heap() if self._pipes else None
+        if not heap:  # the JVMs of the runs overlap, the shared MIGEC steps don't get the whole -m
+            heap = FixedHeap(self._xmx.megabytes(), Workers().get())
+        graph = TaskGraph(cancel=Runner().get_cancel(), memory=heap)
+        logs = {}
+        failed = []
+        for pipe in self._pipes:
+            os.makedirs(pipe.get_out_dir(), exist_ok=True)
+            logs[pipe] = Log('{}/{}'.format(pipe.get_out_dir(), self.log_name))
+            try:
+                pipe.attach(graph, logs[pipe], heap)
+            except Exception as error:
+                logs[pipe].add('\nPipeline error:\n{}'.format(error))
+                logs[pipe].write()
+                failed.append(pipe)
 
         try:
-            log.add('\n====================VDJtools==================\n')
-            vdjtools = self._tools['vdjtools']
-            log.add('>>>Convert<<<\n' + vdjtools.convert(mixcr.get_clones_dir()))
-            log.add('>>>Filter<<<\n' + vdjtools.filter())
-        except Exception as error:
-            log.add('\nVDJtools error:\n{}'.format(error))
-            log.write()
-            exit('...error')
+            graph.run()
+        finally:
+            for pipe in self._pipes:
+                if pipe not in failed and pipe.finish(logs[pipe]):
+                    failed.append(pipe)
+                logs[pipe].close()
 
-        log.add('\n...done')
+        for pipe in self._pipes:
+            log.add('{}\t{}\t{}'.format(pipe.get_out_dir(), 'error' if pipe in failed else 'done',
+                                         logs[pipe].get_file()))
+        if heap:
+            log.add(heap.summary())
         log.write()
+        if failed:
+            exit('...error in {} of {} runs'.format(len(failed), len(self._pipes)))
 
-# end of class NextSeqPipe
-
+# end of class BatchPipe
@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Progress:
+    # the live state of a run for the front end: the running steps and the samples with the stage, the percent and
+    # the throughput parsed from the progress lines of the tools as they are written, the ETA of the steps and of the
+    # run and the stragglers; the state goes to the status file of the output dir (replaced atomically) and to
+    # ProgressServer
+    file_name = 'progress.json'
+    patterns = {  # MiXCR: 'Alignment: 42.1%  ETA: 00:01:05', MIGEC: '[... +00m05s] Processed 1000000 reads, ...'
+        'percent': re.compile(r'(?P<phase>[A-Za-z][\w -]*?):\s+(?P<percent>\d+(?:\.\d+)?)%'
+                              r'(?:\s+ETA:\s+(?:(?P<h>\d+):)?(?P<m>\d+):(?P<s>\d+))?'),
+        'reads': re.compile(r'Processed\s+(?P<reads>[\d,]+)\s+(?:reads|MIGs|sequences)', re.IGNORECASE),
+        'total': re.compile(r'Total sequencing reads:\s+(?P<reads>\d+)'),
+    }
+    interval = 1  # seconds between the writes of the status file while the tools report
+    straggler_factor = 2  # a step taking longer than the factor of the median time of the step of the other samples
+    straggler_min = 30  # seconds, the shorter steps are not the stragglers
+
+    def __init__(self, out_dir):
+        self._out_dir = re.sub(r'/$', '', out_dir)
+        self._file = '{}/{}'.format(self._out_dir, self.file_name)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._state = 'queued'
+        self._start = None
+        self._total = 0
+        self._done = 0
+        self._failed = 0
+        self._running = {}  # the task -> the live state of the step
+        self._samples = {}  # the sample -> the state of its last step
+        self._walls = {}  # the step -> the wall times of the done runs of the step
+        self._version = 0
+        self._written = 0
+
+    def get_file(self):
+        return self._file
+
+    def version(self):  # changes with every update of the state
+        return self._version
+
+    @classmethod
+    def parse(cls, line):  # the progress fields of a tool line, {} if the line is not a progress one
+        for name, pattern in cls.patterns.items():
+            match = pattern.search(line)
+            if not match:
+                continue
+            if name == 'percent':
+                fields = {'phase': match.group('phase').strip(), 'percent': min(100.0, float(match.group('percent')))}
+                if match.group('s'):
+                    fields['eta_s'] = int(match.group('h') or 0) * 3600 + int(match.group('m')) * 60 + \
+                        int(match.group('s'))
+                return fields
+            return {'reads' if name == 'reads' else 'total': int(match.group('reads').replace(',', ''))}
+
+        return {}
+
+    def start(self, n_steps):
+        with self._lock:
+            self._state = 'running'
+            self._start = time.time()
+            self._total = n_steps
+        self._changed(True)
+
+    def started(self, task):  # called by TaskGraph
+        with self._lock:
+            self._running[task] = {'stage': task.stage, 'step': task.step, 'sample': task.sample,
+                                   'start': task.start or time.time(), 'phase': None, 'percent': None, 'eta_s': None,
+                                   'reads': {}, 'total': None}
+            if task.sample:
+                sample = self._samples.setdefault(task.sample, {'steps_done': 0})
+                sample.update(stage=task.stage, step=task.step, state='running')
+        self._changed(True)
+
+    def update(self, stage, step, sample, line, source=None):  # a line of the tool output (see Command)
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        fields = {}
+        for part in line.split('\r'):  # the progress bar of a terminal
+            fields.update(self.parse(part))
+        if not fields:
+            return
+        with self._lock:
+            entry = None
+            for task, running in self._running.items():
+                if (task.stage, task.step, task.sample) == (stage, step, sample):
+                    entry = running
+                    break
+            if not entry:
+                return
+            if 'reads' in fields:  # the shards of a step report the reads of their own
+                entry['reads'][id(source)] = fields.pop('reads')
+            if 'phase' in fields and fields['phase'] != entry['phase']:
+                entry['eta_s'] = None
+            entry.update(fields)
+        self._changed()
+
+    def finished(self, task):  # called by TaskGraph after the step is done or failed
+        with self._lock:
+            self._running.pop(task, None)
+            if task.done:
+                self._done += 1
+                if not task.skipped and not task.cached and task.start and task.end:
+                    self._walls.setdefault(task.step, []).append(task.end - task.start)
+            else:
+                self._failed += 1
+            if task.sample:
+                sample = self._samples.setdefault(task.sample, {'steps_done': 0})
+                sample.update(stage=task.stage, step=task.step, state='waiting' if task.done else 'failed')
+                sample['steps_done'] += 1 if task.done else 0
+        self._changed(True)
+
+    def close(self, failed=None):  # the run is finished
+        with self._lock:
+            self._state = 'error' if failed else 'done'
+            self._running.clear()
+            for sample in self._samples.values():
+                if sample['state'] != 'failed':
+                    sample['state'] = 'error' if failed else 'done'
+        self._changed(True)
+
+    @staticmethod
+    def _median(values):
+        values = sorted(values)
+        if not values:
+            return None
+
+        return values[len(values) // 2] if len(values) % 2 else (values[len(values) // 2 - 1] +
+                                                                 values[len(values) // 2]) / 2
+
+    def _step(self, task, entry, now):  # the live state of a running step with its ETA
+        elapsed = now - entry['start']
+        reads = sum(entry['reads'].values()) or entry['total']
+        percent = entry['percent']
+        eta = entry['eta_s']
+        median = self._median(self._walls.get(task.step, []))
+        if eta is None and percent:
+            eta = elapsed * (100 - percent) / percent
+        elif eta is None and median is not None:
+            eta = max(0.0, median - elapsed)
+        projected = elapsed + eta if eta is not None else elapsed
+
+        return {'stage': entry['stage'], 'step': entry['step'], 'sample': entry['sample'], 'phase': entry['phase'],
+                'percent': percent, 'reads': reads, 'reads_s': round(reads / elapsed, 1) if reads and elapsed else None,
+                'elapsed_s': round(elapsed, 1), 'eta_s': round(eta, 1) if eta is not None else None,
+                'projected_s': projected, 'straggler': False}
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            running = [self._step(task, entry, now) for task, entry in self._running.items()]
+            # the projected time of a step against the times of the same step of the other samples
+            for step in running:
+                others = self._walls.get(step['step'], []) + [other['projected_s'] for other in running
+                                                              if other is not step and other['step'] == step['step']]
+                median = self._median(others)
+                step['straggler'] = len(others) >= 2 and step['projected_s'] >= self.straggler_min and \
+                    step['projected_s'] > self.straggler_factor * median
+            samples = {name: dict(sample) for name, sample in self._samples.items()}
+            for step in running:
+                del step['projected_s']
+                if step['sample'] in samples:
+                    samples[step['sample']].update({field: step[field] for field in (
+                        'phase', 'percent', 'reads', 'reads_s', 'eta_s', 'straggler')})
+
+            elapsed = now - self._start if self._start else 0
+            fraction = (self._done + sum((step['percent'] or 0) / 100 for step in running)) / self._total \
+                if self._total else 0
+            return {
+                'out_dir': self._out_dir,
+                'state': self._state,
+                'start': self._start,
+                'updated': now,
+                'elapsed_s': round(elapsed, 1),
+                'steps_total': self._total,
+                'steps_done': self._done,
+                'steps_failed': self._failed,
+                'percent': round(100 * fraction, 1),
+                'eta_s': round(elapsed * (1 - fraction) / fraction, 1) if 0 < fraction and self._state == 'running'
+                else None,
+                'running': running,
+                'samples': samples,
+                'stragglers': [step['sample'] or step['step'] for step in running if step['straggler']],
+            }
+
+    def _changed(self, force=False):  # the status file is rewritten at most every interval while the tools report
+        with self._lock:
+            self._version += 1
+            if not force and time.time() - self._written < self.interval:
+                return
+            self._written = time.time()
+        with self._write_lock:  # the later state is written last
+            try:
+                with open(self._file + '.tmp', 'w') as file:
+                    json.dump(self.status(), file, indent=1)
+                os.replace(self._file + '.tmp', self._file)
+            except OSError:  # the output dir is removed (-z)
+                pass
+
+# end of class Progress
+
+
+class ProgressHandler(BaseHTTPRequestHandler):
+    # GET /progress: the state of the runs, GET /events: the state of the runs on every change (server-sent events)
+    server_ref = None
+    poll = 0.5
+    heartbeat = 15  # seconds, a comment line keeps the connection of an idle run
+
+    def _reply(self, code, body):
+        data = json.dumps(body, indent=1).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        last = None
+        sent = time.time()
+        try:
+            while True:
+                stopped = self.server_ref.stopped()
+                versions = self.server_ref.versions()
+                if versions != last:
+                    data = json.dumps(self.server_ref.status())
+                    self.wfile.write('event: progress\ndata: {}\n\n'.format(data).encode('utf-8'))
+                    last = versions
+                    sent = time.time()
+                elif time.time() - sent > self.heartbeat:
+                    self.wfile.write(b': keep-alive\n\n')
+                    sent = time.time()
+                self.wfile.flush()
+                if stopped:
+                    break
+                time.sleep(self.poll)
+        except OSError:  # the client is gone
+            pass
+
+    def do_GET(self):
+        path = [part for part in self.path.split('?', 1)[0].split('/') if part]
+        if path == ['progress']:
+            return self._reply(200, self.server_ref.status())
+        if path == ['events']:
+            return self._events()
+        self._reply(404, {'error': 'no such endpoint: {}'.format(self.path)})
+
+    def log_message(self, format, *args):  # the requests are not logged
+        pass
+
+# end of class ProgressHandler
+
+
+class ProgressServer:
+    # the local endpoint of the live progress of the runs of the graph (see Progress)
+    def __init__(self, port):
+        self._port = int(port)
+        self._progresses = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+        self._thread = None
+
+    def add(self, progress):
+        with self._lock:
+            self._progresses.append(progress)
+
+    def versions(self):
+        with self._lock:
+            return tuple(progress.version() for progress in self._progresses)
+
+    def status(self):
+        with self._lock:
+            progresses = list(self._progresses)
+
+        return [progress.status() for progress in progresses]
+
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def start(self):
+        handler = type('RunProgressHandler', (ProgressHandler,), {'server_ref': self})
+        try:
+            self._server = ThreadingHTTPServer(('localhost', self._port), handler)
+        except OSError as error:
+            raise Exception("Can't start the progress server on the port {}: {}".format(self._port, error))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):  # the event streams get the final state before they are closed
+        if not self._server:
+            return
+        self._stopped.set()
+        time.sleep(2 * ProgressHandler.poll)
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+# end of class ProgressServer
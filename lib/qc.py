@@ -0,0 +1,187 @@
+import os
+import re
+import gzip
+import operator
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from lib.inout import Workers
+from lib.executor import Executor
+
+
+class FastqQC:
+    # the pre-flight check of the input FASTQ pairs: the structure of the records, the R1/R2 read names and the
+    # number of reads against reads_exp of SampleInfo; a broken pair stops the pipeline before the JVM tools
+    chunk_size = 4 << 20  # the records of a chunk are a batch of the worker processes
+    parallel_size = 32 << 20  # the compressed size of R1 of a pair checked by the worker processes
+    fields = ('sample_name', 'R1', 'R2', 'reads', 'reads_exp', 'ratio', 'status', 'error')
+
+    def __init__(self, samples, out_dir, n_workers=None):
+        self._samples = samples
+        self._file = re.sub(r'/$', '', out_dir) + '/qc.txt'
+        self._n_workers = int(n_workers) if n_workers else Workers().get()
+        self._pending = threading.BoundedSemaphore(2 * self._n_workers)
+
+    @staticmethod
+    def _offset(data, n_lines, n_total):  # the end of the first n_lines of the data of n_total lines
+        if not n_lines:
+            return 0
+        if n_lines > n_total // 2:  # the line ends are found from the nearer end of the data
+            pos = len(data)
+            for _ in range(n_total - n_lines + 1):
+                pos = data.rindex(b'\n', 0, pos)
+            return pos + 1
+        pos = -1
+        for _ in range(n_lines):
+            pos = data.index(b'\n', pos + 1)
+        return pos + 1
+
+    def _chunks(self, file_name):  # (the data of the complete 4-line records of every chunk, the number of lines)
+        opener = gzip.open if file_name.endswith('.gz') else open
+        rest = b''
+        with opener(file_name, 'rb') as file:
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                data = rest + chunk
+                n_total = data.count(b'\n')
+                n_lines = n_total // 4 * 4
+                end = self._offset(data, n_lines, n_total)
+                rest = data[end:]
+                if n_lines:
+                    yield data[:end], n_lines
+        if rest.strip():
+            raise Exception('{}: the last record is truncated'.format(file_name))
+
+    @staticmethod
+    def _names(lines, file_name, n_record):  # the read names of the records, the structure is checked
+        headers, seqs, pluses, quals = lines[0::4], lines[1::4], lines[2::4], lines[3::4]
+        if not all(map(operator.methodcaller('startswith', b'@'), headers)) or \
+                not all(map(operator.methodcaller('startswith', b'+'), pluses)) or \
+                list(map(len, seqs)) != list(map(len, quals)):
+            for i, (header, seq, plus, qual) in enumerate(zip(headers, seqs, pluses, quals)):
+                if not header.startswith(b'@') or not plus.startswith(b'+') or len(seq) != len(qual):
+                    raise Exception('{}: wrong FASTQ record {}'.format(file_name, n_record + i + 1))
+
+        names = list(map(operator.itemgetter(0), map(operator.methodcaller('split', None, 1), headers)))
+        if not any(map(operator.methodcaller('endswith', (b'/1', b'/2')), names)):
+            return names
+        return [name[:-2] if name[-2:] in (b'/1', b'/2') else name for name in names]
+
+    @classmethod
+    def _check(cls, data1, data2, r1, r2, n_record):  # the same records of R1 and R2 (in a worker process)
+        names1 = cls._names(data1.split(b'\n')[:-1], r1, n_record)
+        names2 = cls._names(data2.split(b'\n')[:-1], r2, n_record)
+        if names1 != names2:
+            i = next(i for i, (name1, name2) in enumerate(zip(names1, names2)) if name1 != name2)
+            raise Exception('{} and {}: different read names in the record {}'.format(r1, r2, n_record + i + 1))
+
+        return len(names1)
+
+    @staticmethod
+    def _prefetch(chunks, readers):  # the next chunk is read by a thread while the current one is checked
+        future = readers.submit(next, chunks, None)
+        while True:
+            chunk = future.result()
+            if chunk is None:
+                break
+            future = readers.submit(next, chunks, None)
+            yield chunk
+
+    def _batches(self, r1, r2, readers):  # the data of the same records of R1 and R2, the number of lines
+        chunks1, chunks2 = self._prefetch(self._chunks(r1), readers), self._prefetch(self._chunks(r2), readers)
+        chunk1 = chunk2 = (b'', 0)
+        while True:
+            chunk1 = chunk1 if chunk1[1] else next(chunks1, None)
+            chunk2 = chunk2 if chunk2[1] else next(chunks2, None)
+            if chunk1 is None or chunk2 is None:
+                break
+            (data1, n_lines1), (data2, n_lines2) = chunk1, chunk2
+            n_lines = min(n_lines1, n_lines2)
+            end1, end2 = self._offset(data1, n_lines, n_lines1), self._offset(data2, n_lines, n_lines2)
+            yield data1[:end1], data2[:end2], n_lines
+            chunk1, chunk2 = (data1[end1:], n_lines1 - n_lines), (data2[end2:], n_lines2 - n_lines)
+
+        if (chunk1 and chunk1[1]) or (chunk2 and chunk2[1]) or any(chunks1) or any(chunks2):
+            raise Exception('{} and {}: different numbers of reads'.format(r1, r2))
+
+    def check_pair(self, r1, r2, workers=None):
+        # the number of read pairs: the files are read at the same time, the batches of records are checked by the
+        # worker processes if any (the first wrong record is reported as by the serial check)
+        checks = collections.deque()
+        n_reads = 0
+        with ThreadPoolExecutor(max_workers=2) as readers:
+            try:
+                for data1, data2, n_lines in self._batches(r1, r2, readers):
+                    if not workers:
+                        n_reads += self._check(data1, data2, r1, r2, n_reads)
+                        continue
+                    self._pending.acquire()  # the batches of all pairs in memory at the same time
+                    checks.append(workers.submit(self._check, data1, data2, r1, r2, n_reads))
+                    checks[-1].add_done_callback(lambda _: self._pending.release())
+                    n_reads += n_lines // 4
+                    while checks and checks[0].done():
+                        checks.popleft().result()
+            finally:
+                while checks:  # the errors of the earlier records first
+                    checks.popleft().result()
+
+        return n_reads
+
+    def run(self):
+        pairs = collections.OrderedDict()  # a pair of files can be shared by several samples
+        for sample in self._samples:
+            pairs.setdefault((self._samples.get_path(sample.R1), self._samples.get_path(sample.R2)), []).append(sample)
+
+        # the records of a big pair are checked by the worker processes (spawned: the pipeline runs threads)
+        big = [pair for pair in pairs if os.path.getsize(pair[0]) > self.parallel_size]
+        workers = ProcessPoolExecutor(max_workers=self._n_workers, mp_context=multiprocessing.get_context('spawn')) \
+            if big and self._n_workers > 1 else None
+
+        def check(pair):
+            try:
+                return self.check_pair(*pair, workers=workers if pair in big else None), ''
+            except (OSError, EOFError, ValueError) as error:  # a broken gzip stream
+                return None, '{} and {}: {}'.format(pair[0], pair[1], error)
+            except Exception as error:
+                return None, str(error)
+
+        try:
+            results = dict(zip(pairs, Executor().map(check, pairs)))
+        finally:
+            if workers:
+                workers.shutdown()
+
+        errors = []
+        table = '\t'.join(self.fields) + '\n'
+        for pair, samples in pairs.items():
+            n_reads, error = results[pair]
+            reads_exp = sum(int(sample.reads_exp) for sample in samples if sample.reads_exp)
+            if error:
+                status = 'ERROR'
+                errors.append(error)
+            elif reads_exp and n_reads < reads_exp:
+                status = 'LOW'
+            else:
+                status = 'OK'
+            ratio = '{:.3f}'.format(n_reads / reads_exp) if reads_exp and n_reads is not None else 'NA'
+            for sample in samples:
+                table += '\t'.join((sample.sample_name, os.path.basename(pair[0]), os.path.basename(pair[1]),
+                                    'NA' if n_reads is None else str(n_reads), str(reads_exp or 'NA'), ratio,
+                                    status, error)) + '\n'
+
+        os.makedirs(os.path.dirname(self._file), exist_ok=True)
+        with open(self._file, 'w') as file:
+            file.write(table)
+        if errors:
+            raise Exception('Wrong input FASTQ files (see {}):\n{}'.format(self._file, '\n'.join(errors)))
+
+        return table
+
+    def get_file(self):
+        return self._file
+
+# end of class FastqQC
@@ -0,0 +1,145 @@
+import os
+import re
+import gzip
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Retention:
+    # the intermediates declared by their steps (the FASTQ files, .vdjca, .clns, the per-sample reports) are deleted or
+    # compressed as soon as the last step reading them is done, right away if no step reads them: the consumers of a
+    # file are the later steps listing it in their inputs, a file of a step followed by a step without the listed
+    # inputs is kept; the other outputs (the logs, the histograms, the clonotype tables) are never retired. The files
+    # are retired by a worker thread and marked in the checkpoints, so a rerun doesn't redo their steps
+    actions = ('keep', 'delete', 'compress')
+    poll = 5  # seconds between the disk usage samples
+
+    def __init__(self, out_dir, policy=None, scratch_dir=None, checkpoint=None):
+        self._dirs = [re.sub(r'/$', '', name) for name in (out_dir, scratch_dir) if name]
+        self._policy = {key.lower(): action for key, action in (policy or {}).items()}
+        self._checkpoint = checkpoint
+        self._consumers = {}  # the file -> the steps to be done before it is retired
+        self._producers = {}  # the file -> the step which has written it
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # a step is done, the disk usage is sampled
+        self._sampler = None
+        self._worker = None
+        self._peak = 0
+        self._retired = {'delete': [0, 0], 'compress': [0, 0]}  # the files, the bytes
+        self._errors = []
+
+    def action(self, task):  # the step setting is more specific than the stage one
+        for key in (task.step, task.stage, 'all'):
+            if key and str(key).lower() in self._policy:
+                return self._policy[str(key).lower()]
+
+        return 'keep'
+
+    def _usage(self):  # the allocated size of the directories, the links are not followed
+        total = 0
+        for dir_name in self._dirs:
+            for root, _, file_names in os.walk(dir_name):
+                for file_name in file_names:
+                    try:
+                        total += os.lstat(os.path.join(root, file_name)).st_blocks * 512
+                    except OSError:
+                        continue
+        with self._lock:
+            self._peak = max(self._peak, total)
+
+        return total
+
+    def _sample(self):  # the only thread walking the directories, the last sample is taken on stop
+        while not self._stop.is_set():
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            self._usage()
+
+    def start(self):  # the disk usage is sampled while the steps run and after every step
+        self._stop.clear()
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):  # waits for the files being retired
+        if self._worker:
+            self._worker.shutdown(wait=True)
+            self._worker = None
+        self._stop.set()
+        self._wake.set()
+        if self._sampler:
+            self._sampler.join()
+            self._sampler = None
+
+    def _retire(self, file_name, action):
+        target = os.path.realpath(file_name)  # a file on the scratch is linked into the output dir
+        linked = os.path.islink(file_name)
+        if not os.path.isfile(target):
+            return
+        size = os.path.getsize(target)
+        if action == 'compress' and target.endswith('.gz'):
+            return
+        if self._checkpoint:
+            self._checkpoint.retire(file_name, action)
+        if action == 'compress':
+            with open(target, 'rb') as source, gzip.open(target + '.gz', 'wb', compresslevel=6) as packed:
+                shutil.copyfileobj(source, packed, 1 << 20)
+            if linked:
+                os.symlink(target + '.gz', file_name + '.gz')
+        os.remove(target)
+        if linked:
+            os.remove(file_name)
+        with self._lock:
+            self._retired[action][0] += 1
+            self._retired[action][1] += size
+
+    def _retire_all(self, retired):
+        for file_name, action in retired:
+            try:
+                self._retire(file_name, action)
+            except Exception as error:
+                with self._lock:
+                    self._errors.append('{}: {}'.format(file_name, error))
+
+    def finished(self, task, graph):  # called by TaskGraph after every done step, the files are retired by the worker
+        self._wake.set()
+        retired = []
+        with self._lock:
+            for file_name in list(self._consumers):
+                self._consumers[file_name].discard(task)
+                if not self._consumers[file_name]:
+                    del self._consumers[file_name]
+                    retired.append((file_name, self.action(self._producers.pop(file_name))))
+
+        descendants = graph.descendants(task)
+        if task.intermediates and self.action(task) != 'keep' and all(other.inputs for other in descendants
+                                                                      if task in other.deps):
+            for file_name in task.intermediates():
+                consumers = set(other for other in descendants if not other.done and file_name in other.inputs())
+                if not consumers:  # no step reads the file (.vdjca and .clns of analyze)
+                    retired.append((file_name, self.action(task)))
+                    continue
+                with self._lock:
+                    self._consumers[file_name] = consumers
+                    self._producers[file_name] = task
+
+        retired = [(file_name, action) for file_name, action in retired if action != 'keep']
+        if retired and self._worker:
+            self._worker.submit(self._retire_all, retired)
+        elif retired:
+            self._retire_all(retired)
+
+    def summary(self):
+        text = '\npeak disk usage: {:.1f} MB ({})'.format(self._peak / 2 ** 20, ', '.join(self._dirs))
+        for action, (n_files, size) in self._retired.items():
+            if n_files:
+                text += '\n{} intermediates: {} files, {:.1f} MB'.format(
+                    {'delete': 'deleted', 'compress': 'compressed'}[action], n_files, size / 2 ** 20)
+        if self._errors:
+            text += '\nintermediates not retired:\n' + '\n'.join(self._errors)
+
+        return text
+
+# end of class Retention
@@ -0,0 +1,257 @@
+import os
+import re
+import csv
+import time
+import glob
+import signal
+import threading
+import subprocess
+from collections import deque
+
+
+class Metrics:
+    fields = ('stage', 'step', 'sample', 'start', 'wall_s', 'user_s', 'sys_s', 'max_rss_mb',
+              'read_mb', 'written_mb', 'rchar_mb', 'wchar_mb', 'exit_code', 'command')
+
+    def __init__(self, file_name=None):
+        self._file = file_name
+        self._records = []
+        self._lock = threading.Lock()
+        if self._file:
+            os.makedirs(os.path.dirname(self._file) or '.', exist_ok=True)
+            with open(self._file, 'w', newline='') as file:
+                csv.writer(file).writerow(self.fields)
+
+    def get_file(self):
+        return self._file
+
+    def get_records(self):
+        with self._lock:
+            return list(self._records)
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            if self._file:
+                with open(self._file, 'a', newline='') as file:
+                    csv.writer(file).writerow([record.get(field) for field in self.fields])
+
+    @staticmethod
+    def _table(title, records, key):
+        rows = {}
+        for record in records:
+            row = rows.setdefault(record[key] or '-', {'calls': 0, 'wall_s': 0, 'user_s': 0, 'sys_s': 0,
+                                                       'max_rss_mb': 0, 'read_mb': 0, 'written_mb': 0})
+            row['calls'] += 1
+            for field in ('wall_s', 'user_s', 'sys_s', 'read_mb', 'written_mb'):
+                row[field] += record[field]
+            row['max_rss_mb'] = max(row['max_rss_mb'], record['max_rss_mb'])
+
+        line = '{:<24}{:>7}{:>11}{:>11}{:>11}{:>12}{:>11}{:>12}\n'
+        table = line.format(title, 'calls', 'wall,s', 'user,s', 'sys,s', 'maxRSS,MB', 'read,MB', 'write,MB')
+        for name, row in rows.items():
+            table += line.format(name, row['calls'], '{:.1f}'.format(row['wall_s']), '{:.1f}'.format(row['user_s']),
+                                 '{:.1f}'.format(row['sys_s']), '{:.0f}'.format(row['max_rss_mb']),
+                                 '{:.1f}'.format(row['read_mb']), '{:.1f}'.format(row['written_mb']))
+        return table
+
+    def summary(self):  # the resource usage of the external tools per stage and per sample
+        records = self.get_records()
+        if not records:
+            return ''
+
+        text = '\n====================Resources================\n'
+        text += self._table('stage', records, 'stage') + '\n'
+        text += self._table('sample', records, 'sample')
+        if self._file:
+            text += '\nmetrics: {}\n'.format(self._file)
+
+        return text
+
+# end of class Metrics
+
+
+class Runner:
+    # the settings of the tool runs: the wall-clock timeouts (the default one and per step), the directory of the
+    # live logs and the cancellation shared by the running steps
+    def __new__(cls, timeout=None, step_timeouts=None, log_dir=None):
+        if not hasattr(cls, 'instance'):
+            cls._timeout = float(timeout) if timeout else None
+            cls._step_timeouts = {step.lower(): float(value) for step, value in (step_timeouts or {}).items()}
+            cls._log_dir = re.sub(r'/$', '', log_dir) if log_dir else None
+            cls._cancel = threading.Event()
+            cls._reason = None
+            cls.instance = super(Runner, cls).__new__(cls)
+
+        return cls.instance
+
+    def timeout(self, step):
+        return self._step_timeouts.get(str(step).lower(), self._timeout)
+
+    def log_file(self, stage, step, sample, log_dir=None):  # the live stdout and stderr of a step
+        log_dir = re.sub(r'/$', '', log_dir) if log_dir else self._log_dir
+        if not log_dir:
+            return None
+        os.makedirs(log_dir, exist_ok=True)
+
+        return '{}/{}.log'.format(log_dir, '.'.join(str(field) for field in (stage, step, sample) if field))
+
+    def get_cancel(self):
+        return self._cancel
+
+    def cancel(self, reason):  # the whole run is stopped (SIGTERM of the daemon, see Scheduler)
+        type(self)._reason = reason
+        self._cancel.set()
+
+    def get_reason(self):
+        return self._reason or 'another step is failed'
+
+# end of class Runner (Singleton)
+
+
+class Command:
+    poll_min = 0.01
+    poll_max = 0.5
+    kill_grace = 5  # seconds between SIGTERM and SIGKILL
+    error_lines = 20  # the stderr tail of a failed command
+    output_lines = 1000  # the stdout tail of the step, the whole output is in the live log
+
+    def __init__(self, cmd, stage=None, step=None, sample=None, metrics=None, log_dir=None, progress=None):
+        self._cmd = cmd
+        self._stage = stage
+        self._step = step
+        self._sample = sample
+        self._metrics = metrics
+        self._log_dir = log_dir
+        self._progress = progress
+        self._runner = Runner()
+        self._live_lock = threading.Lock()
+        self._killed = None  # the time of SIGTERM
+        self._reason = None
+        self._n_lines = {'stdout': 0, 'stderr': 0}
+        self.exit_code = None
+
+    @staticmethod
+    def _proc_io(pid):  # the logical I/O of the process tree (the shell, the JVM and their children)
+        io = {'rchar': 0, 'wchar': 0}
+        pids = [pid]
+        for proc_id in pids:
+            try:
+                with open('/proc/{}/io'.format(proc_id), 'r') as file:
+                    for line in file:
+                        name, value = line.split(':')
+                        if name in io:
+                            io[name] += int(value)
+                for children in glob.glob('/proc/{}/task/*/children'.format(proc_id)):
+                    with open(children, 'r') as file:
+                        pids += [int(child) for child in file.read().split()]
+            except (OSError, ValueError):
+                continue
+
+        return io
+
+    def _read(self, stream, lines, name, live):  # the lines are put to the live log as soon as they are written
+        for line in iter(stream.readline, b''):
+            lines.append(line)
+            self._n_lines[name] += 1
+            if self._progress:  # the progress lines of MIGEC and MiXCR
+                self._progress.update(self._stage, self._step, self._sample, line, self)
+            if live:
+                with self._live_lock:
+                    live.write(line if name == 'stdout' else b'[stderr] ' + line)
+                    live.flush()
+        stream.close()
+
+    def _kill(self, process, reason):  # the whole process group: the shell, the JVM and their children
+        if self._killed:
+            if time.time() - self._killed > self.kill_grace:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            return
+        self._killed = time.time()
+        self._reason = reason
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def killed(self):  # the command is stopped by a timeout or the cancellation
+        return self._killed is not None
+
+    def run(self):
+        start = time.time()
+        timeout = self._runner.timeout(self._step)
+        cancel = self._runner.get_cancel()
+        live_file = self._runner.log_file(self._stage, self._step, self._sample, self._log_dir)
+        live = open(live_file, 'wb') if live_file else None
+
+        process = subprocess.Popen(self._cmd, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, start_new_session=True)
+        stdout, stderr = deque(maxlen=self.output_lines), deque(maxlen=self.error_lines)
+        readers = [threading.Thread(target=self._read, args=(process.stdout, stdout, 'stdout', live), daemon=True),
+                   threading.Thread(target=self._read, args=(process.stderr, stderr, 'stderr', live), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        io = {'rchar': 0, 'wchar': 0}
+        poll = self.poll_min
+        while True:  # wait4 gives the rusage of the child including its waited children (the JVM)
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if timeout and time.time() - start > timeout:
+                self._kill(process, 'timeout after {:.0f} s'.format(timeout))
+            elif cancel.is_set():
+                self._kill(process, 'cancelled: ' + self._runner.get_reason())
+            sample = self._proc_io(process.pid)
+            io = {name: max(io[name], sample[name]) for name in io}
+            time.sleep(poll)
+            poll = min(poll * 2, self.poll_max)
+
+        process.returncode = self.exit_code = os.waitstatus_to_exitcode(status)
+        if self._killed:  # the orphans of the group are not waited for
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        for reader in readers:
+            reader.join(self.kill_grace if self._killed else None)
+        if live:
+            live.close()
+        wall = time.time() - start
+
+        if self._metrics is not None:
+            self._metrics.add({
+                'stage': self._stage,
+                'step': self._step,
+                'sample': self._sample,
+                'start': round(start, 3),
+                'wall_s': round(wall, 3),
+                'user_s': round(usage.ru_utime, 3),
+                'sys_s': round(usage.ru_stime, 3),
+                'max_rss_mb': round(usage.ru_maxrss / 1024, 1),  # ru_maxrss is in KB on Linux
+                'read_mb': round(usage.ru_inblock * 512 / 2 ** 20, 3),
+                'written_mb': round(usage.ru_oublock * 512 / 2 ** 20, 3),
+                'rchar_mb': round(io['rchar'] / 2 ** 20, 3),
+                'wchar_mb': round(io['wchar'] / 2 ** 20, 3),
+                'exit_code': self.exit_code,
+                'command': self._cmd,
+            })
+
+        output = b''.join(stdout).decode('utf-8', 'replace')
+        if self._n_lines['stdout'] > len(stdout):
+            output = '[the last {} of {} lines{}]\n{}'.format(len(stdout), self._n_lines['stdout'],
+                                                             ', see ' + live_file if live_file else '', output)
+        if self._reason or self.exit_code != 0:
+            tail = b''.join(stderr).decode('utf-8', 'replace')
+            error = Exception('{}{}: {} (exit code {})\n{}{}'.format(
+                self._step, ' ' + self._sample if self._sample else '', self._reason or 'failed', self.exit_code,
+                self._cmd + '\n', tail or output[-2000:]))
+            error.exit_code = self.exit_code  # the exit status of the tool for the step events (see Log)
+            raise error
+
+        return output
+
+# end of class Command
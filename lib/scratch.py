@@ -0,0 +1,106 @@
+import os
+import re
+import shutil
+import hashlib
+import threading
+
+
+class Scratch:
+    # the short-lived intermediates (assembled reads, .vdjca, .clns) on a fast local disk or tmpfs: a placed file
+    # is linked into the output directory, so the next steps and the checkpoints see it at the usual path
+    def __new__(cls, scratch_dir=None, out_dir=None, reserve=None):
+        if not hasattr(cls, 'instance'):
+            cls._dir = None
+            if scratch_dir and out_dir:
+                key = hashlib.sha1(os.path.abspath(out_dir).encode()).hexdigest()[:12]
+                cls._out_dir = os.path.abspath(out_dir)
+                cls._dir = '{}/tcr-factory-{}'.format(os.path.abspath(re.sub(r'/$', '', scratch_dir)), key)
+            cls._reserve = cls._size(reserve) if reserve else 1 << 30
+            cls._lock = threading.Lock()
+            cls._reserved = {}  # the placed path -> the expected size
+            cls._placed = 0
+            cls._spilled = 0
+            cls.instance = super(Scratch, cls).__new__(cls)
+
+        return cls.instance
+
+    @staticmethod
+    def _size(size):  # 512M, 2G, ... in bytes
+        match = re.match(r'^(\d+)([KMGT]?)B?$', str(size).upper())
+        if not match:
+            raise Exception('Wrong the scratch reserve size: {}'.format(size))
+
+        return int(match.group(1)) << (10 * ' KMGT'.index(match.group(2) or ' '))
+
+    def enabled(self):
+        return self._dir is not None
+
+    def get_dir(self):
+        return self._dir
+
+    def path(self, file_name):  # the scratch copy of an output path
+        if not self.enabled():
+            return file_name
+
+        return self._dir + '/' + os.path.relpath(os.path.abspath(file_name), self._out_dir)
+
+    def _free(self):
+        os.makedirs(self._dir, exist_ok=True)
+        return shutil.disk_usage(self._dir).free - sum(self._reserved.values())
+
+    def place(self, file_name, estimate=0):  # where to write: the scratch, or the output dir if the scratch is full
+        if not self.enabled():
+            return file_name
+
+        with self._lock:
+            if self._free() - estimate < self._reserve:
+                self._spilled += 1
+                if os.path.islink(file_name):  # not through a link of the last run
+                    os.remove(file_name)
+                return file_name
+            placed = self.path(file_name)
+            self._reserved[placed] = estimate
+            self._placed += 1
+        os.makedirs(os.path.dirname(placed), exist_ok=True)
+
+        return placed
+
+    def release(self, placed):
+        with self._lock:
+            self._reserved.pop(placed, None)
+
+    def keep(self, file_name, placed):  # the intermediate stays on the scratch, a link is put to the output dir
+        self.release(placed)
+        if placed == file_name or not os.path.exists(placed):
+            return
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        if os.path.islink(file_name) or os.path.isfile(file_name):
+            os.remove(file_name)
+        elif os.path.isdir(file_name):
+            shutil.rmtree(file_name)
+        os.symlink(placed, file_name)
+
+    def promote(self, placed, file_name):  # a final file is moved to the output dir
+        self.release(placed)
+        if placed != file_name and os.path.exists(placed):
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            shutil.move(placed, file_name)
+
+    def clean(self):  # the links to the scratch are removed with the intermediates
+        if not self.enabled():
+            return
+        for dir_name, dir_names, file_names in os.walk(self._out_dir):
+            for name in dir_names + file_names:
+                link = os.path.join(dir_name, name)
+                if os.path.islink(link) and os.readlink(link).startswith(self._dir + '/'):
+                    os.remove(link)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def summary(self):
+        if not self.enabled():
+            return ''
+
+        return '\nscratch: {}, placed: {}, spilled to the output dir: {}'.format(self._dir, self._placed,
+                                                                                 self._spilled)
+
+# end of class Scratch (Singleton)
@@ -0,0 +1,110 @@
+import os
+import re
+import glob
+import gzip
+import array
+import random
+import threading
+import itertools
+
+from lib.scratch import Scratch
+
+
+class Subsampler:
+    # the assembled reads of a sample down to the target depth: reservoir sampling of the read indices, then a pass
+    # copying the records of the sampled reads (the memory does not depend on the read length); the random generator
+    # of a sample depends on the seed and the sample name only, the read order is kept
+    def __init__(self, out_dir, seed=1):
+        self._dir = re.sub(r'/$', '', out_dir) + '/subsample'
+        self._seed = seed
+        self._reads = {}  # {sample: the number of the assembled reads}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _records(file_name):
+        with gzip.open(file_name, 'rb') as file:
+            while True:
+                record = b''.join(file.readline() for _ in range(4))
+                if not record:
+                    break
+                yield record
+
+    @staticmethod
+    def _pairs(in_dir, sample_name):  # (R1, R2 or None) of the assembled reads
+        pairs = []
+        for r1 in sorted(glob.glob('{}/{}_R1.*fastq.gz'.format(in_dir, glob.escape(sample_name)))):
+            r2 = re.sub(r'_R1\.([^/]*)$', r'_R2.\1', r1)
+            pairs.append((r1, r2 if os.path.isfile(r2) else None))
+
+        return pairs
+
+    @staticmethod
+    def _count(file_name):  # the number of the records, the last one may be not complete
+        n_lines, last = 0, b'\n'
+        with gzip.open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                n_lines += chunk.count(b'\n')
+                last = chunk[-1:]
+
+        return (n_lines + (last != b'\n') + 3) // 4
+
+    def reads(self, in_dir, sample_name):  # the number of the assembled reads (pairs) of a sample, counted once
+        with self._lock:
+            if sample_name not in self._reads:
+                self._reads[sample_name] = sum(self._count(r1) for r1, _ in self._pairs(re.sub(r'/$', '', in_dir),
+                                                                                          sample_name))
+            return self._reads[sample_name]
+
+    def min_reads(self, in_dir, sample_names):  # the depth of the shallowest sample, the empty samples are left out
+        return min([n_reads for n_reads in (self.reads(in_dir, sample_name) for sample_name in sample_names)
+                    if n_reads] or [0])
+
+    def _sample(self, in_files, out_files, n_target, rnd):
+        # the first pass keeps the indices of the sampled reads only, the second one copies their records
+        n_reads = self._count(in_files[0])
+        reservoir = array.array('q', range(min(n_target, n_reads)))
+        for n_read in range(len(reservoir), n_reads):
+            i = rnd.randint(0, n_read)
+            if i < n_target:
+                reservoir[i] = n_read
+
+        sampled = bytearray((n_reads + 7) // 8)  # a bit per read
+        for n_read in reservoir:
+            sampled[n_read >> 3] |= 1 << (n_read & 7)
+
+        files = [gzip.GzipFile(out_file, 'wb', compresslevel=1, mtime=0) for out_file in out_files]  # the same bytes
+        try:
+            readers = [self._records(file_name) for file_name in in_files]
+            for n_read, records in enumerate(itertools.islice(zip(*readers), n_reads)):
+                if sampled[n_read >> 3] >> (n_read & 7) & 1:
+                    for file, record in zip(files, records):
+                        file.write(record)
+        finally:
+            for file in files:
+                file.close()
+
+        return n_reads, len(reservoir)
+
+    def subsample(self, in_dir, sample_name, n_target):
+        if not n_target:
+            raise Exception('Subsample: no target depth of the sample {}.'.format(sample_name))
+        rnd = random.Random('{}:{}'.format(self._seed, sample_name))
+        os.makedirs(self._dir, exist_ok=True)
+
+        output = ''
+        for pair in self._pairs(re.sub(r'/$', '', in_dir), sample_name):
+            in_files = [file_name for file_name in pair if file_name]
+            out_files = ['{}/{}'.format(self._dir, os.path.basename(file_name)) for file_name in in_files]
+            placed = [Scratch().place(out_file, os.path.getsize(in_file))
+                      for in_file, out_file in zip(in_files, out_files)]
+            n_reads, n_sampled = self._sample(in_files, placed, int(n_target), rnd)
+            for out_file, placed_file in zip(out_files, placed):
+                Scratch().keep(out_file, placed_file)
+            output += '{}: {} of {} reads\n'.format(', '.join(out_files), n_sampled, n_reads)
+
+        return output
+
+    def get_dir(self):
+        return self._dir
+
+# end of class Subsampler
@@ -1,13 +1,21 @@
 import os
 import re
 import glob
+import gzip
+import collections
 
-import requests
+import shutil
 import zipfile
-import io
 import subprocess
 
 from lib.inout import Bin, Xmx
+from lib.executor import Executor
+from lib.jvm import JavaLauncher
+from lib.artifacts import ArtifactCache
+from lib.runner import Command
+from lib.histogram import HistogramRenderer
+from lib.vdj import ClonotypeConverter
+from lib.scratch import Scratch
 
 
 class SampleInfo:
@@ -90,52 +98,174 @@ class SampleInfo:
 # end of class SampleInfo
 
 
+class SampleTable:
+    # one immutable table of the samples per run: SampleInfo is read and validated once, the records are tuples
+    Sample = collections.namedtuple('Sample', ('sample_name', 'chain', 'barcode', 'R1', 'R2',
+                                               'baseline', 'subject_id', 'antigen', 'reads_exp'))
+    chains = ('TRA', 'TRB', 'TRG', 'TRD', 'TRAD', 'IGH', 'IGK', 'IGL', 'TCR', 'BCR', 'ALL')
+    barcode_format = re.compile(r'^[ACGTNRYSWKMBDHVacgtnryswkmbdhv]+$')
+
+    def __init__(self, dir_name):
+        self._dir = re.sub(r'/$', '', dir_name)
+        info = SampleInfo()
+        if not info.find(self._dir):
+            raise Exception('No SampleInfo file in the directory: {}'.format(self._dir))
+        self._file = info.get_file()
+        self._samples = tuple(self.Sample(*[getattr(record, field) for field in self.Sample._fields])
+                              for record in info.parse())
+        self._index = {sample.sample_name: sample for sample in self._samples}
+        self._validate()
+
+    def _validate(self):  # all the problems are reported at once
+        errors = []
+        names = set()
+        for sample in self._samples:
+            if sample.sample_name in names:
+                errors.append('duplicate sample name: {}'.format(sample.sample_name))
+            names.add(sample.sample_name)
+            if not re.search(r'^[A-Za-z0-9._-]+$', sample.sample_name):
+                errors.append('wrong sample name: {}'.format(sample.sample_name))
+            if not sample.barcode:
+                errors.append('no barcode: {}'.format(sample.sample_name))
+            elif not self.barcode_format.search(sample.barcode):
+                errors.append('wrong barcode: {} ({})'.format(sample.barcode, sample.sample_name))
+            if not sample.chain or any(chain not in self.chains for chain in sample.chain.split(',')):
+                errors.append('wrong chain: {} ({})'.format(sample.chain, sample.sample_name))
+            for read, file_name in (('R1', sample.R1), ('R2', sample.R2)):
+                if not file_name or not os.path.isfile(self.get_path(file_name)):
+                    errors.append('wrong {} file name: {} ({})'.format(read, file_name, sample.sample_name))
+            if sample.reads_exp and not re.search(r'^\d+$', sample.reads_exp):
+                errors.append('wrong expected number of reads: {} ({})'.format(sample.reads_exp, sample.sample_name))
+
+        if errors:
+            raise Exception("Wrong SampleInfo file: {}\n{}".format(self._file, '\n'.join(errors)))
+
+    def get_path(self, file_name):  # the sequence files are taken from the input directory
+        return self._dir + '/' + re.sub(r'.*/', '', file_name)
+
+    def get_file(self):
+        return self._file
+
+    def get(self, sample_name):
+        return self._index.get(sample_name)
+
+    def names(self):
+        return [sample.sample_name for sample in self._samples]
+
+    def __iter__(self):
+        return iter(self._samples)
+
+    def __len__(self):
+        return len(self._samples)
+
+# end of class SampleTable
+
+
 class Tool:
     name = None
     url = None
+    stage = None
+    _metrics = None
+    _log_dir = None
+    _progress = None
+
+    def set_metrics(self, metrics):  # the resource usage of the tool runs is collected in the metrics
+        self._metrics = metrics
+
+    def set_log_dir(self, log_dir):  # the live logs of the tool runs (the Runner one by default)
+        self._log_dir = log_dir
+
+    def set_progress(self, progress):  # the live progress of the tool runs (see Progress)
+        self._progress = progress
+
+    def _command(self, cmd, step, sample=None):
+        return Command(cmd, self.stage, step, sample, self._metrics, self._log_dir, self._progress)
+
+    def _run(self, cmd, step, sample=None):
+        return self._command(cmd, step, sample).run()
 
     def check(self):
         if not self.name:
             raise Exception("Can't check the tool: the tool name is not determined.")
         raise Exception("Can't check the tool {}: the tool checker is not determined.".format(self.name))
 
+    def stamp(self):  # the installed tool state (see ToolState) or None if the tool has to be checked
+        return None
+
+    @staticmethod
+    def _size(*masks):  # the total size of the files, the expected size of an intermediate (see Scratch)
+        return sum(os.path.getsize(name) for mask in masks for name in glob.glob(mask) if os.path.isfile(name))
+
+    def _file_stamp(self, file_name):
+        if not file_name or not os.path.isfile(file_name):
+            return None
+        stat = os.stat(file_name)
+
+        return {'path': file_name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'url': self.url}
+
 # end of class Tool
 
 
 class RTool(Tool):
-    def check(self):
-        rchk = ['Rscript']
-        chk = ['Rscript', '-e', 'library({})'.format(self.name)]
-        inst = ['Rscript', '-e', 'install.packages("{}", repos="{}")'.format(self.name, self.url)]
+    def stamp(self):
+        stamp = self._file_stamp(shutil.which('Rscript'))
+        if stamp:
+            stamp['package'] = self.name
 
-        process = subprocess.Popen(rchk, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        if not (re.search(r'Usage:', stdout.decode('utf-8')) or re.search(r'Usage:', stderr.decode('utf-8'))):
-            raise Exception("Rscript doesn't install")
+        return stamp
 
-        process = subprocess.Popen(chk, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def check(self):  # one Rscript run: the package is installed only if it can't be loaded
+        script = 'if (!requireNamespace("{0}", quietly=TRUE)) {{ cat("Installing: {0} from {1} "); ' \
+                 'install.packages("{0}", repos="{1}", quiet=TRUE) }}; ' \
+                 'cat("\\n", requireNamespace("{0}", quietly=TRUE), "\\n")'.format(self.name, self.url)
+        try:
+            process = subprocess.Popen(['Rscript', '-e', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            raise Exception("Rscript doesn't install")
         stdout, stderr = process.communicate()
-        if re.search(r'[Ee]rror', stdout.decode('utf-8')) or re.search(r'[Ee]rror', stderr.decode('utf-8')):
-            print('Installing: {} from {}'.format(self.name, self.url), end=" ")
-            subprocess.Popen(inst, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout = stdout.decode('utf-8')
 
-            process = subprocess.Popen(chk, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = process.communicate()
-            if re.search(r'[Ee]rror', stdout.decode('utf-8')) or re.search(r'[Ee]rror', stderr.decode('utf-8')):
-                raise Exception("Can't install the tool from: {}".format(self.url))
-            print('...OK')
+        if re.search(r'Installing:', stdout):
+            print(re.search(r'Installing:.*', stdout).group(0), end=" ")
+            if re.search(r'\bTRUE\b', stdout):
+                print('...OK')
+        if not re.search(r'\bTRUE\b', stdout):
+            raise Exception("Can't install the tool from: {}".format(self.url))
 
 # end of class RTool
 
 
 class JavaTool(Tool):
     def __init__(self):
-        self._xmx = Xmx().get()
         self._bin = Bin()
+        self._launcher = JavaLauncher()
         self._assign_tool()
 
     def _assign_tool(self):
         self._jar = self._bin.find(self.name) or None
+        self._launcher.register(self._jar)
+
+    def get_version(self):  # the name and the content of the jar: a jar replaced in place is another version
+        if not self._jar:
+            return None
+        return '{} sha256:{}'.format(os.path.basename(self._jar), self._bin.checksum(self._jar)[:16])
+
+    def _java(self, xmx=None):  # a plain JVM or a call of the warm JVM server (see JavaLauncher)
+        return self._launcher.command(self._jar, xmx or Xmx().get())
+
+    def _run(self, cmd, step, sample=None):  # the server of an ng call is released, a killed one is stopped
+        port = self._launcher.port(cmd)
+        if port is None:
+            return super(JavaTool, self)._run(cmd, step, sample)
+        command = None
+        try:
+            command = self._command(cmd, step, sample)
+            return command.run()
+        finally:
+            self._launcher.called(port, command is not None and command.killed())
+
+    def stamp(self):
+        return self._file_stamp(self._jar)
 
     def check(self):
         if not self.name:
@@ -147,9 +277,9 @@ class JavaTool(Tool):
                 raise Exception("Can't find the tool URL to install: {}".format(self.name))
             print('Installing: {}'.format(self.url), end=" ")
 
-            r = requests.get(self.url)
-            z = zipfile.ZipFile(io.BytesIO(r.content))
-            z.extractall(self._bin.path() + tool_dir)
+            with zipfile.ZipFile(ArtifactCache().fetch(self.url)) as z:
+                z.extractall(self._bin.path() + tool_dir)
+            self._bin.refresh()
             self._assign_tool()
 
             if self._jar:
@@ -164,20 +294,21 @@ class UtilFile(Tool):
     def __init__(self):
         self._bin = Bin()
 
+    def stamp(self):
+        return self._file_stamp(self._bin.find(self.name))
+
     def check(self):
         if not self.name:
             raise Exception("Can't check the tool: the tool name is not determined.")
 
-        if not self._bin.find(self.name):
-            if not self.url:
-                raise Exception("Can't find the tool URL to install: {}".format(self.name))
-            print('Installing: {}'.format(self.url), end=" ")
-
-        file_path = self._bin.path() + '/' + self.name
-        r = requests.get(self.url, allow_redirects=True)
-        with open(file_path, 'wb') as f:
-            f.write(r.content)
+        if self._bin.find(self.name):
+            return
+        if not self.url:
+            raise Exception("Can't find the tool URL to install: {}".format(self.name))
+        print('Installing: {}'.format(self.url), end=" ")
 
+        shutil.copyfile(ArtifactCache().fetch(self.url), self._bin.path() + '/' + self.name)
+        self._bin.refresh()
 
         if self._bin.find(self.name):
             print('...OK')
@@ -204,33 +335,107 @@ class Reshape(RTool):
 class VDJtools(JavaTool):
     name = 'vdjtools*.jar'
     url = 'https://github.com/mikessh/vdjtools/releases/download/1.2.1/vdjtools-1.2.1.zip'
+    stage = 'VDJtools'
+    backends = ('java', 'python')
 
     def __init__(self, outdir='.'):
         super(VDJtools, self).__init__()
         self._outdir = re.sub(r'/$', '', outdir)
         self._vdj_dir = self._outdir + '/vdj'
+        self._backend = 'java'
+
+    def set_backend(self, backend):  # python: Convert and FilterNonFunctional in process (see ClonotypeConverter)
+        if backend not in self.backends:
+            raise Exception('VDJtools: unknown backend {}.'.format(backend))
+        self._backend = backend
+
+    def get_backend(self):
+        return self._backend
+
+    def get_version(self):
+        return 'python' if self._backend == 'python' else super(VDJtools, self).get_version()
+
+    def stamp(self):
+        return {'backend': 'python'} if self._backend == 'python' else super(VDJtools, self).stamp()
+
+    def check(self):  # the jar is not needed by the python backend
+        if self._backend != 'python':
+            super(VDJtools, self).check()
+
+    def convert(self, dir_name, sample_name=None, xmx=None):
+        mask = '{}[._]clonotypes*.txt'.format(glob.escape(sample_name)) if sample_name else '*clonotypes*.txt'
 
-    def convert(self, dir_name):
         output = ''
-        for file_name in glob.glob(re.sub(r'/$', '', dir_name) + '/*clonotypes*.txt'):
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
+        for file_name in sorted(glob.glob(re.sub(r'/$', '', dir_name) + '/' + mask)):
+            cmd = self._java(xmx)
             cmd += ' Convert -S mixcr {} {}/{}'.format(file_name, self._vdj_dir, 'vdj')
-            stream = os.popen(cmd)
-            output += '>{}<\n'.format(file_name) + stream.read()
+            output += '>{}<\n'.format(file_name) + self._run(cmd, 'Convert', sample_name)
         return output
 
-    def filter(self, dir_name=None):
+    def filter(self, dir_name=None, sample_name=None, xmx=None):
         dir_name = dir_name if dir_name else self._vdj_dir
+        mask = 'vdj.{}[._]clonotypes*.txt'.format(glob.escape(sample_name)) if sample_name else 'vdj.*clonotypes*.txt'
 
         output = ''
-        for file_name in glob.glob(re.sub(r'/$', '', dir_name) + '/vdj.*clonotypes*.txt'):
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
+        for file_name in sorted(glob.glob(re.sub(r'/$', '', dir_name) + '/' + mask)):
+            cmd = self._java(xmx)
             cmd += ' FilterNonFunctional {} {}/{}'.format(file_name, self._vdj_dir, 'nc')
-            stream = os.popen(cmd)
-            output += '>{}<\n'.format(file_name) + stream.read()
+            output += '>{}<\n'.format(file_name) + self._run(cmd, 'Filter', sample_name)
+
+        return output
+
+    def convert_filter(self, dir_name, sample_name=None):  # the python backend: vdj.* and nc.vdj.* in one pass
+        mask = '{}[._]clonotypes*.txt'.format(glob.escape(sample_name)) if sample_name else '*clonotypes*.txt'
+        converter = ClonotypeConverter()
+
+        output = ''
+        for file_name in sorted(glob.glob(re.sub(r'/$', '', dir_name) + '/' + mask)):
+            vdj_file = '{}/vdj.{}'.format(self._vdj_dir, os.path.basename(file_name))
+            nc_file = '{}/nc.{}'.format(self._vdj_dir, os.path.basename(vdj_file))
+            n_rows, n_functional = converter.convert(file_name, vdj_file, nc_file)
+            output += '>{}<\n{}: {} clonotypes\n{}: {} functional clonotypes\n'.format(
+                file_name, vdj_file, n_rows, nc_file, n_functional)
 
         return output
 
+    def write_metadata(self, records, dir_name, metadata_file, prefix=''):
+        # VDJtools metadata: the output sample ids are the same as of the file by file runs (prefix.sample_id.txt)
+        metadata = '\t'.join(('#file.name', 'sample.id', 'sample_name', 'subject_id', 'antigen', 'baseline')) + '\n'
+        n_files = 0
+        for record in records:
+            mask = '{}{}[._]clonotypes*.txt'.format(prefix, glob.escape(record.sample_name))
+            for file_name in sorted(glob.glob(re.sub(r'/$', '', dir_name) + '/' + mask)):
+                sample_id = re.sub(r'\.txt$', '', os.path.basename(file_name))
+                metadata += '\t'.join((os.path.abspath(file_name), sample_id, record.sample_name,
+                                       record.subject_id, record.antigen, record.baseline)) + '\n'
+                n_files += 1
+
+        os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
+        with open(metadata_file, 'w') as file:
+            file.write(metadata)
+
+        return n_files
+
+    def convert_batch(self, records, dir_name, xmx=None):  # all samples in one JVM
+        metadata_file = self._vdj_dir + '/mixcr.metadata.txt'
+        if not self.write_metadata(records, dir_name, metadata_file):
+            return ''
+
+        cmd = self._java(xmx)
+        cmd += ' Convert -S mixcr -m {} {}/{}'.format(metadata_file, self._vdj_dir, 'vdj')
+
+        return '>{}<\n'.format(metadata_file) + self._run(cmd, 'Convert')
+
+    def filter_batch(self, records, xmx=None):
+        metadata_file = self._vdj_dir + '/vdj.metadata.txt'
+        if not self.write_metadata(records, self._vdj_dir, metadata_file, 'vdj.'):
+            return ''
+
+        cmd = self._java(xmx)
+        cmd += ' FilterNonFunctional -m {} {}/{}'.format(metadata_file, self._vdj_dir, 'nc')
+
+        return '>{}<\n'.format(metadata_file) + self._run(cmd, 'Filter')
+
     def get_vdj_dir(self):
         return self._vdj_dir
 
@@ -240,94 +445,117 @@ class VDJtools(JavaTool):
 class Mixcr(JavaTool):
     name = 'mixcr*.jar'
     url = 'https://github.com/milaboratory/mixcr/releases/download/v3.0.13/mixcr-3.0.13.zip'
+    stage = 'MIXCR'
 
-    def __init__(self, indir='.', outdir='.'):
+    def __init__(self, indir='.', outdir='.', samples=None):
         super(Mixcr, self).__init__()
         self._indir = re.sub(r'/$', '', indir)
+        self._samples = samples or SampleTable(self._indir)
         self._outdir = re.sub(r'/$', '', outdir)
         self._analyze_dir = self._outdir + '/analyze'
         self._alignment_dir = self._outdir + '/alignment'
         self._clones_dir = self._outdir + '/clones'
 
-    def analyze(self, in_dir):
+    @staticmethod
+    def _merge_report(report_file, part_files):  # one report file in the SampleInfo order
+        with open(report_file, 'w') as report:
+            for part_file in part_files:
+                if os.path.isfile(part_file):
+                    with open(part_file, 'r') as part:
+                        report.write(part.read())
+
+    def get_report(self, step, sample_name):  # the per-sample report (MiXCR appends reports to the file)
+        if step == 'align':
+            return '{}/{}.alignmentReport.txt'.format(self._alignment_dir, sample_name)
+        return '{}/{}.assembleReport.txt'.format(self._clones_dir, sample_name)
+
+    def _new_report(self, step, sample_name):
+        report_file = self.get_report(step, sample_name)
+        if os.path.isfile(report_file):
+            os.remove(report_file)
+
+        return report_file
+
+    def merge_reports(self, records):
+        if os.path.isdir(self._alignment_dir):
+            self._merge_report(self._alignment_dir + '/alignmentReport.txt',
+                               [self.get_report('align', record.sample_name) for record in records])
+        if os.path.isdir(self._clones_dir):
+            self._merge_report(self._clones_dir + '/assembleReport.txt',
+                               [self.get_report('assemble', record.sample_name) for record in records])
+
+    def analyze_sample(self, record, in_dir, xmx=None):
         in_dir = re.sub(r'/$', '', in_dir)
-        info = SampleInfo()
-        if not info.find(self._indir):
-            raise Exception('No SampleInfo file in the directory: {}'.format(self._indir))
-
         os.makedirs(self._analyze_dir, exist_ok=True)
 
-        output = ''
-        for record in info.parse():
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
-            cmd += ' analyze amplicon -s hsa --starting-material rna '
-            cmd += '--5-end no-v-primers --3-end c-primers --adapters no-adapters --receptor-type {}'.format(
-                record.chain
-            )
-            cmd += ' {}/{}_R1.*.fastq.gz'.format(in_dir, record.sample_name)
-            cmd += ' {}/{}_R2.*.fastq.gz'.format(in_dir, record.sample_name)
-            cmd += ' {}/{}'.format(self._analyze_dir, record.sample_name)
-            stream = os.popen(cmd)
-            output += '>>>{}<<<\n'.format(record.sample_name) + stream.read()
+        cmd = self._java(xmx)
+        cmd += ' analyze amplicon -s hsa --starting-material rna '
+        cmd += '--5-end no-v-primers --3-end c-primers --adapters no-adapters --receptor-type {}'.format(
+            record.chain
+        )
+        cmd += ' {}/{}_R1.*.fastq.gz'.format(in_dir, record.sample_name)
+        cmd += ' {}/{}_R2.*.fastq.gz'.format(in_dir, record.sample_name)
+        prefix = '{}/{}'.format(self._analyze_dir, record.sample_name)
+        reads = self._size('{}/{}_R[12].*'.format(in_dir, glob.escape(record.sample_name)))
+        placed = Scratch().place(prefix, 2 * reads)
+        cmd += ' {}'.format(placed)
+        output = self._run(cmd, 'Analyze', record.sample_name)
+
+        # .vdjca and .clns stay on the scratch, the clonotypes and the reports are moved to the output dir
+        Scratch().release(placed)
+        if placed != prefix:
+            for file_name in glob.glob(glob.escape(placed) + '.*'):
+                final_name = prefix + file_name[len(placed):]
+                if file_name.endswith(('.vdjca', '.clns')):
+                    Scratch().keep(final_name, file_name)
+                else:
+                    Scratch().promote(file_name, final_name)
 
         return output
 
-    def align(self, in_dir):
+    def align_sample(self, record, in_dir, xmx=None):
         in_dir = re.sub(r'/$', '', in_dir)
-        info = SampleInfo()
-        if not info.find(self._indir):
-            raise Exception('No SampleInfo file in the directory: {}'.format(self._indir))
-
         os.makedirs(self._alignment_dir, exist_ok=True)
 
-        output = ''
-        for record in info.parse():
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
-            cmd += ' align -OreadsLayout=Collinear -s hsa'  # Collinear - relative orientation of paired reads
-            cmd += ' -r {}/alignmentReport.txt '.format(self._alignment_dir)
-            cmd += ' {}/{}_R1.*.fastq.gz'.format(in_dir, record.sample_name)
-            cmd += ' {}/{}_R2.*.fastq.gz'.format(in_dir, record.sample_name)
-            cmd += ' {}/{}_alignments.vdjca'.format(self._alignment_dir, record.sample_name)
-            stream = os.popen(cmd)
-            output += '>>>{}<<<\n'.format(record.sample_name) + stream.read()
+        cmd = self._java(xmx)
+        cmd += ' align -OreadsLayout=Collinear -s hsa'  # Collinear - relative orientation of paired reads
+        cmd += ' -r {} '.format(self._new_report('align', record.sample_name))
+        cmd += ' {}/{}_R1.*.fastq.gz'.format(in_dir, record.sample_name)
+        cmd += ' {}/{}_R2.*.fastq.gz'.format(in_dir, record.sample_name)
+        alignments = '{}/{}_alignments.vdjca'.format(self._alignment_dir, record.sample_name)
+        reads = self._size('{}/{}_R[12].*'.format(in_dir, glob.escape(record.sample_name)))
+        placed = Scratch().place(alignments, reads)
+        cmd += ' {}'.format(placed)
+        output = self._run(cmd, 'Align', record.sample_name)
+        Scratch().keep(alignments, placed)
 
         return output
 
-    def assemble(self, in_dir):
+    def assemble_sample(self, record, in_dir, xmx=None):
         in_dir = re.sub(r'/$', '', in_dir)
-        info = SampleInfo()
-        if not info.find(self._indir):
-            raise Exception('No SampleInfo file in the directory: {}'.format(self._indir))
-
         os.makedirs(self._clones_dir, exist_ok=True)
 
-        output = ''
-        for record in info.parse():
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
-            cmd += ' assemble -r {}/assembleReport.txt '.format(self._clones_dir)
-            cmd += ' {}/{}_alignments.vdjca'.format(in_dir, record.sample_name)
-            cmd += ' {}/{}_clonotypes.clns'.format(self._clones_dir, record.sample_name)
-            stream = os.popen(cmd)
-            output += '>>>{}<<<\n'.format(record.sample_name) + stream.read()
+        cmd = self._java(xmx)
+        cmd += ' assemble -r {} '.format(self._new_report('assemble', record.sample_name))
+        cmd += ' {}/{}_alignments.vdjca'.format(in_dir, record.sample_name)
+        clones = '{}/{}_clonotypes.clns'.format(self._clones_dir, record.sample_name)
+        alignments = self._size('{}/{}_alignments.vdjca'.format(in_dir, glob.escape(record.sample_name)))
+        placed = Scratch().place(clones, alignments)
+        cmd += ' {}'.format(placed)
+        output = self._run(cmd, 'Assemble', record.sample_name)
+        Scratch().keep(clones, placed)
 
         return output
 
-    def export(self, in_dir):
-        in_dir = re.sub(r'/$', '', in_dir)
-        info = SampleInfo()
-        if not info.find(self._indir):
-            raise Exception('No SampleInfo file in the directory: {}'.format(self._indir))
+    def export_sample(self, record, in_dir=None, xmx=None):
+        in_dir = re.sub(r'/$', '', in_dir) if in_dir else self._clones_dir
 
-        output = ''
-        for record in info.parse():
-            cmd = 'java ' + self._xmx + ' -jar ' + self._jar
-            cmd += ' exportClones -t -o -c {}'.format(record.chain)
-            cmd += ' {}/{}_clonotypes.clns'.format(self._clones_dir, record.sample_name)
-            cmd += ' {}/{}_clonotypes.txt'.format(self._clones_dir, record.sample_name)
-            stream = os.popen(cmd)
-            output += '>>>{}<<<\n'.format(record.sample_name) + stream.read()
+        cmd = self._java(xmx)
+        cmd += ' exportClones -t -o -c {}'.format(record.chain)
+        cmd += ' {}/{}_clonotypes.clns'.format(in_dir, record.sample_name)
+        cmd += ' {}/{}_clonotypes.txt'.format(self._clones_dir, record.sample_name)
 
-        return output
+        return self._run(cmd, 'ExportClones', record.sample_name)
 
     def get_analyze_dir(self):
         return self._analyze_dir
@@ -344,37 +572,31 @@ class Mixcr(JavaTool):
 class Migec(JavaTool):
     name = 'migec*.jar'
     url = 'https://github.com/mikessh/migec/releases/download/1.2.9/migec-1.2.9.zip'
+    stage = 'MIGEC'
+    renderers = ('python', 'R')
+    shard_block = 100000  # the records in a row of the same shard
 
-    def __init__(self, indir='.', outdir='.'):
+    def __init__(self, indir='.', outdir='.', samples=None):
         super(Migec, self).__init__()
         self._util = None
         self._indir = re.sub(r'/$', '', indir)
+        self._samples = samples or SampleTable(self._indir)
         self._outdir = re.sub(r'/$', '', outdir)
         self._checkout_dir = self._outdir + '/checkout'
         self._histogram_dir = self._outdir + '/histogram'
         self._assemble_dir = self._outdir + '/assemble'
+        self._input_files = []
+        self._renderer = 'python'
+        self._shards = 1
         self._barcodes_file = self._inspector()
 
-    def _inspector(self):
-        info = SampleInfo()
-        if not info.find(self._indir):
-            raise Exception('No SampleInfo file in the directory: {}'.format(self._indir))
-
+    def _inspector(self):  # the samples are validated by SampleTable
         barcodes = ''
-        for record in info.parse():
-            r1 = re.sub(r'.*/', '', record.R1)
-            r1 = self._indir + '/' + r1
-            r2 = re.sub(r'.*/', '', record.R2)
-            r2 = self._indir + '/' + r2
-
-            if record.barcode == '':
-                raise Exception("No barcode in SampleInfo file: {}".format(info.get_file()))
-            if not os.path.isfile(r1):
-                raise Exception("Wrong R1 file name in SampleInfo file: {}".format(info.get_file()))
-            if not os.path.isfile(r2):
-                raise Exception("Wrong R2 file name in SampleInfo file: {}".format(info.get_file()))
-
+        for record in self._samples:
+            r1 = self._samples.get_path(record.R1)
+            r2 = self._samples.get_path(record.R2)
             barcodes += '\t'.join((record.sample_name, record.barcode, '', r1, r2)) + '\n'
+            self._input_files += [r1, r2]
 
         barcodes_file = self._outdir + '/barcodes.csv'
         os.makedirs(self._outdir, exist_ok=True)
@@ -387,48 +609,241 @@ class Migec(JavaTool):
 
         return barcodes_file
 
+    def set_shards(self, shards):  # CheckoutBatch runs over the shards of the input FASTQ files at the same time
+        self._shards = max(1, int(shards or 1))
+
+    def get_shards(self):
+        return self._shards
+
     def checkout_batch(self):
         if not self._barcodes_file:
             raise Exception('Migec CheckoutBatch: no barcodes file.')
+        if self._shards > 1:
+            return self._checkout_shards()
 
-        cmd = 'java ' + self._xmx + ' -jar ' + self._jar
+        cmd = self._java()
         cmd += ' CheckoutBatch -cute {} {}'.format(self._barcodes_file, self._checkout_dir)
-        stream = os.popen(cmd)
-        output = stream.read()
+
+        return self._run(cmd, 'CheckoutBatch')
+
+    @staticmethod
+    def _open_fastq(file_name, mode):
+        return gzip.open(file_name, mode, compresslevel=1) if file_name.endswith('.gz') else open(file_name, mode)
+
+    def _split_pair(self, r1, r2, shard_files):
+        # the blocks of the 4-line records go to the shards in turn, the mates stay in the same shard
+        outputs = [(self._open_fastq(s1, 'wb'), self._open_fastq(s2, 'wb')) for s1, s2 in shard_files]
+        try:
+            with self._open_fastq(r1, 'rb') as in1, self._open_fastq(r2, 'rb') as in2:
+                n_records = 0
+                while True:
+                    lines1 = [line for line in (in1.readline() for _ in range(4)) if line]
+                    lines2 = [line for line in (in2.readline() for _ in range(4)) if line]
+                    if not lines1 and not lines2:
+                        break
+                    if len(lines1) != 4 or len(lines2) != 4:
+                        raise Exception('Migec CheckoutBatch: {} and {} are not paired FASTQ files.'.format(r1, r2))
+                    out1, out2 = outputs[n_records // self.shard_block % len(outputs)]
+                    out1.writelines(lines1)
+                    out2.writelines(lines2)
+                    n_records += 1
+        finally:
+            for out1, out2 in outputs:
+                out1.close()
+                out2.close()
+
+    def _merge_checkout_logs(self, shard_dirs, inputs):  # the read counts of the shards are summed up by sample
+        header = None
+        rows = collections.OrderedDict()
+        for shard_dir in shard_dirs:
+            log_file = shard_dir + '/checkout.log.txt'
+            if not os.path.isfile(log_file):
+                continue
+            with open(log_file, 'r') as file:
+                for line in file:
+                    if line.startswith('#'):
+                        header = header or line
+                        continue
+                    fields = [inputs.get(field, field) for field in line.rstrip('\n').split('\t')]
+                    key = tuple(fields[:2])
+                    if key not in rows:
+                        rows[key] = fields
+                        continue
+                    for i, field in enumerate(fields):
+                        if re.match(r'^\d+$', field) and re.match(r'^\d+$', rows[key][i]):
+                            rows[key][i] = str(int(rows[key][i]) + int(field))
+        with open(self._checkout_dir + '/checkout.log.txt', 'w') as file:
+            file.write((header or '') + ''.join('\t'.join(fields) + '\n' for fields in rows.values()))
+
+    def _checkout_shards(self):
+        # the per-sample FASTQ files of the shards are concatenated (gzip members) into the usual checkout layout
+        executor = Executor(self._shards)
+        shards_dir = self._checkout_dir + '/shards'
+        shard_dirs = ['{}/{}'.format(shards_dir, i) for i in range(self._shards)]
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        for shard_dir in shard_dirs:
+            os.makedirs(shard_dir + '/input', exist_ok=True)
+
+        with open(self._barcodes_file, 'r') as file:
+            barcodes = [line.rstrip('\n').split('\t') for line in file if line.strip()]
+        pairs = sorted(set((fields[3], fields[4]) for fields in barcodes))
+        inputs = {}  # the shard file -> the input file
+        for r1, r2 in pairs:
+            for shard_dir in shard_dirs:
+                for file_name in (r1, r2):
+                    inputs['{}/input/{}'.format(shard_dir, os.path.basename(file_name))] = file_name
+        executor.map(lambda pair: self._split_pair(*pair, shard_files=[
+            tuple('{}/input/{}'.format(shard_dir, os.path.basename(file_name)) for file_name in pair)
+            for shard_dir in shard_dirs]), pairs)
+
+        xmx = Xmx().share(executor.workers(len(shard_dirs)))
+
+        def run(shard_dir):
+            shard_barcodes = shard_dir + '/barcodes.csv'
+            with open(shard_barcodes, 'w') as file:
+                for fields in barcodes:
+                    file.write('\t'.join(fields[:3] + ['{}/input/{}'.format(shard_dir, os.path.basename(field))
+                                                       for field in fields[3:5]] + fields[5:]) + '\n')
+            cmd = self._java(xmx)
+            cmd += ' CheckoutBatch -cute {} {}'.format(shard_barcodes, shard_dir)
+
+            return '>>>{}<<<\n'.format(shard_dir) + self._run(cmd, 'CheckoutBatch')
+
+        output = ''.join(executor.map(run, shard_dirs))
+
+        os.makedirs(self._checkout_dir, exist_ok=True)
+        for file_name in sorted(set(os.path.basename(name) for shard_dir in shard_dirs
+                                    for name in glob.glob(shard_dir + '/*.fastq*'))):
+            with open('{}/{}'.format(self._checkout_dir, file_name), 'wb') as merged:
+                for shard_dir in shard_dirs:
+                    if os.path.isfile(shard_dir + '/' + file_name):
+                        with open(shard_dir + '/' + file_name, 'rb') as part:
+                            shutil.copyfileobj(part, merged, 1 << 20)
+
+        file_list = ''
+        with open(shard_dirs[0] + '/checkout.filelist.txt', 'r') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if not line.startswith('#'):
+                    fields[2:] = [os.path.abspath('{}/{}'.format(self._checkout_dir, os.path.basename(field)))
+                                  if field else field for field in fields[2:]]
+                file_list += '\t'.join(fields) + '\n'
+        with open(self._checkout_dir + '/checkout.filelist.txt', 'w') as file:
+            file.write(file_list)
+        self._merge_checkout_logs(shard_dirs, inputs)
+        shutil.rmtree(shards_dir, ignore_errors=True)
 
         return output
 
     def histogram(self):
-        cmd = 'java ' + self._xmx + ' -jar ' + self._jar
+        cmd = self._java()
         cmd += ' Histogram {} {}'.format(self._checkout_dir, self._histogram_dir)
-        stream = os.popen(cmd)
-        output = stream.read()
 
-        return output
+        return self._run(cmd, 'Histogram')
 
-    def assemble_batch(self, overseq=0, collisions=False):
-        cmd = 'java ' + self._xmx + ' -jar ' + self._jar
+    def assemble_sample(self, sample_name, overseq=0, collisions=False, xmx=None):
+        # AssembleBatch over a one-sample copy of the checkout file list, the reads are moved to the assemble dir; the
+        # assemble log of the sample stays in assemble/samples/<sample>, the copy of the file list is removed
+        sample_checkout_dir = '{}/samples/{}'.format(self._checkout_dir, sample_name)
+        sample_assemble_dir = '{}/samples/{}'.format(self._assemble_dir, sample_name)
+        os.makedirs(sample_checkout_dir, exist_ok=True)
+        placed = Scratch().place(sample_assemble_dir,
+                                 self._size('{}/{}_R[12]*'.format(self._checkout_dir, glob.escape(sample_name))))
+
+        file_list = ''
+        with open(self._checkout_dir + '/checkout.filelist.txt', 'r') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if line.startswith('#'):
+                    file_list += line
+                elif fields[0] == sample_name:
+                    fields[2:] = [os.path.join(self._checkout_dir, field) if field else field for field in fields[2:]]
+                    file_list += '\t'.join(fields) + '\n'
+        with open(sample_checkout_dir + '/checkout.filelist.txt', 'w') as file:
+            file.write(file_list)
+
+        cmd = self._java(xmx)
         cmd += ' AssembleBatch'
         if overseq:
             cmd += ' --force-overseq {}'.format(overseq)
             if collisions:
                 cmd += ' --force-collision-filter'
-        cmd += ' -c {} {} {}'.format(self._checkout_dir, self._histogram_dir, self._assemble_dir)
-        stream = os.popen(cmd)
-        output = stream.read()
+        cmd += ' -c {} {} {}'.format(sample_checkout_dir, self._histogram_dir, placed)
+        try:
+            output = self._run(cmd, 'AssembleBatch', sample_name)
+        finally:
+            shutil.rmtree(sample_checkout_dir, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(sample_checkout_dir))  # the last sample
+            except OSError:
+                pass
+
+        for file_name in glob.glob(glob.escape(placed) + '/*.fastq.gz'):
+            final_name = self._assemble_dir + '/' + os.path.basename(file_name)
+            moved_name = Scratch().path(final_name) if placed != sample_assemble_dir else final_name
+            os.replace(file_name, moved_name)
+            Scratch().keep(final_name, moved_name)
+        Scratch().keep(sample_assemble_dir, placed)
 
         return output
 
+    def sample_tables(self, sample_name):  # {file: the header and the rows of the sample} of the tables of the run
+        tables = {}
+        for file_name in [self._checkout_dir + '/checkout.filelist.txt'] + \
+                sorted(glob.glob(glob.escape(self._histogram_dir) + '/*.txt')):
+            if os.path.isfile(file_name):
+                with open(file_name, 'r') as file:
+                    tables[file_name] = ''.join(line for line in file
+                                                if line.startswith('#') or line.split('\t', 1)[0] == sample_name)
+
+        return tables
+
+    def merge_assemble_logs(self, sample_names):  # one assemble log in the SampleInfo order
+        header = None
+        rows = ''
+        for sample_name in sample_names:
+            log_file = '{}/samples/{}/assemble.log.txt'.format(self._assemble_dir, sample_name)
+            if os.path.isfile(log_file):
+                with open(log_file, 'r') as file:
+                    for line in file:
+                        if line.startswith('#'):
+                            header = header or line
+                        else:
+                            rows += line
+        with open(self._assemble_dir + '/assemble.log.txt', 'w') as file:
+            file.write((header or '') + rows)
+
     def get_assemble_dir(self):
         return self._assemble_dir
 
+    def get_checkout_dir(self):
+        return self._checkout_dir
+
+    def get_histogram_dir(self):
+        return self._histogram_dir
+
+    def get_barcodes_file(self):
+        return self._barcodes_file
+
+    def get_input_files(self):
+        return sorted(set(self._input_files))
+
+    def set_renderer(self, renderer):  # python falls back to R if NumPy is not installed
+        if renderer not in self.renderers:
+            raise Exception('Migec: unknown histogram renderer {}.'.format(renderer))
+        self._renderer = 'python' if renderer == 'python' and HistogramRenderer.available() else 'R'
+
+    def get_renderer(self):
+        return self._renderer
+
     def draw(self):
+        if self._renderer == 'python':
+            return HistogramRenderer(self._histogram_dir).render()
+
         hist = Bin().find(MigecHistogram.name)
         cmd = 'cd {}; Rscript {}'.format(self._histogram_dir, hist)
-        stream = os.popen(cmd)
-        output = stream.read()
 
-        return output
+        return self._run(cmd, 'HistogramDrawing')
 
 # end of class Migec
 
@@ -0,0 +1,138 @@
+import os
+import decimal
+import operator
+import itertools
+
+
+class ClonotypeConverter:
+    # VDJtools 'Convert -S mixcr' and 'FilterNonFunctional' in one streaming pass over a MiXCR clonotypes table:
+    # the rows are read in chunks, the columns are translated with NumPy string operations
+    header = ('count', 'freq', 'cdr3nt', 'cdr3aa', 'v', 'd', 'j', 'VEnd', 'DStart', 'DEnd', 'JStart')
+    columns = ('cloneCount', 'nSeqCDR3', 'aaSeqCDR3', 'allVHitsWithScore', 'allDHitsWithScore', 'allJHitsWithScore',
+               'refPoints')
+    aliases = {'Clone count': 'cloneCount', 'N. Seq. CDR3': 'nSeqCDR3', 'AA. Seq. CDR3': 'aaSeqCDR3',
+               'All V hits': 'allVHitsWithScore', 'All D hits': 'allDHitsWithScore', 'All J hits': 'allJHitsWithScore',
+               'Ref. points': 'refPoints'}  # the headers of the older MiXCR versions
+    ref_points = {'CDR3Begin': 9, 'VEnd': 11, 'DBegin': 12, 'DEnd': 15, 'JBegin': 16}
+    chunk_size = 65536
+
+    def __init__(self):
+        import numpy
+
+        self._np = numpy
+
+    @staticmethod
+    def java_double(value):  # Double.toString: the shortest repr, the scientific notation out of [1e-3, 1e7)
+        if value == 0:
+            return '0.0'
+        if 1e-3 <= abs(value) < 1e7:
+            text = repr(float(value))
+            return text if '.' in text else text + '.0'
+
+        sign, digits, exponent = decimal.Decimal(repr(float(value))).normalize().as_tuple()
+        digits = ''.join(str(digit) for digit in digits)
+
+        return '{}{}.{}E{}'.format('-' if sign else '', digits[0], digits[1:] or '0', len(digits) - 1 + exponent)
+
+    @staticmethod
+    def _split(lines, sep, width):  # the first width fields of the lines by columns, the short lines padded with ''
+        counts = set(map(operator.methodcaller('count', sep), lines))
+        if len(counts) == 1 and min(counts) >= width - 1:  # the usual table: one split of the whole chunk
+            n_fields = min(counts) + 1
+            fields = sep.join(lines).split(sep)
+            return [fields[i::n_fields] for i in range(width)]
+
+        rows = [(line.split(sep) + [''] * width)[:width] for line in lines]
+        return [list(column) for column in zip(*rows)] if rows else [[] for _ in range(width)]
+
+    def _chunks(self, in_file):  # the columns of the converter (see columns) of the chunks of rows
+        with open(in_file, 'r') as file:
+            names = [self.aliases.get(name, name) for name in file.readline().rstrip('\n').split('\t')]
+            missing = [name for name in self.columns if name not in names]
+            if missing:
+                raise Exception('Not a MiXCR clonotypes table {}: no {} columns.'.format(in_file, ', '.join(missing)))
+            indices = [names.index(name) for name in self.columns]
+
+            while True:
+                lines = list(filter(str.strip, itertools.islice(file, self.chunk_size)))
+                if not lines:
+                    break
+                fields = self._split(''.join(lines).rstrip('\n').split('\n'), '\t', len(names))
+                yield [fields[index] for index in indices]
+
+    def _genes(self, hits):  # the best hit without the allele and the score: TRBV5-1*00(1203.2),... -> TRBV5-1
+        np = self._np
+        genes = np.char.partition(np.char.partition(np.char.partition(hits, ',')[:, 0], '*')[:, 0], '(')[:, 0]
+
+        return np.where(genes == '', '.', genes)
+
+    def _positions(self, points):  # VEnd, DStart, DEnd, JStart relative to the CDR3 start or -1
+        np = self._np
+        width = max(self.ref_points.values()) + 1
+        table = np.array(self._split(points, ':', width), dtype=str).reshape(width, len(points))  # by the points
+        values = np.where(table == '', '-1', table).astype(int)
+        start = values[self.ref_points['CDR3Begin']]
+
+        def relative(name, shift=0):
+            value = values[self.ref_points[name]]
+            return np.where((value >= 0) & (start >= 0), value - start + shift, -1)
+
+        return relative('VEnd', -1), relative('DBegin'), relative('DEnd', -1), relative('JBegin')
+
+    def _counts(self, columns):  # the counts, the CDR3 sequences and the mask of the functional clonotypes
+        # the counts of MiXCR may be fractional: the frequencies are of the exact counts, the rounded counts are
+        # written (half up as Math.round)
+        np = self._np
+        counts = np.array(columns[0], dtype=float)
+        cdr3nt = np.array(columns[1], dtype=str)
+        cdr3aa = np.array(columns[2], dtype=str)
+        functional = ((np.char.find(cdr3aa, '*') < 0) & (np.char.find(cdr3aa, '_') < 0) &
+                      (np.char.find(cdr3aa, '?') < 0) & (np.char.str_len(cdr3nt) % 3 == 0))
+
+        return counts, cdr3nt, cdr3aa, functional
+
+    def _parse(self, columns):
+        counts, cdr3nt, cdr3aa, functional = self._counts(columns)
+        v, d, j = [self._genes(self._np.array(column, dtype=str)) for column in columns[3:6]]
+        positions = self._positions(columns[6])
+
+        return counts, cdr3nt, cdr3aa, v, d, j, positions, functional
+
+    def _write(self, file, parsed, mask, total):  # the rows are formatted by columns
+        np = self._np
+        counts, cdr3nt, cdr3aa, v, d, j, positions, functional = parsed
+        counts = counts[mask]
+        if not len(counts):
+            return
+        # the frequencies of the same count are the same: Double.toString of every distinct value only
+        values, inverse = np.unique(counts, return_inverse=True)
+        freqs = [self.java_double(value / total) for value in values.tolist()]
+        columns = [np.floor(counts + 0.5).astype(np.int64).astype(str).tolist(),
+                   [freqs[i] for i in inverse.reshape(-1).tolist()]]
+        columns += [column[mask].tolist() for column in (cdr3nt, cdr3aa, v, d, j)]
+        columns += [position[mask].astype(str).tolist() for position in positions]
+        file.write('\n'.join(map('\t'.join, zip(*columns))) + '\n')
+
+    def convert(self, in_file, vdj_file, nc_file=None):
+        # the frequencies are recomputed from the counts: the totals are summed up by the first pass
+        total, functional_total = 0, 0
+        for columns in self._chunks(in_file):
+            counts, _, _, functional = self._counts(columns)
+            total += float(counts.sum())
+            functional_total += float(counts[functional].sum())
+
+        n_rows, n_functional = 0, 0
+        os.makedirs(os.path.dirname(os.path.abspath(vdj_file)), exist_ok=True)
+        with open(vdj_file, 'w') as vdj, open(nc_file or os.devnull, 'w') as nc:
+            vdj.write('\t'.join(self.header) + '\n')
+            nc.write('\t'.join(self.header) + '\n')
+            for columns in self._chunks(in_file):
+                parsed = self._parse(columns)
+                self._write(vdj, parsed, self._np.ones(len(parsed[0]), dtype=bool), total or 1)
+                self._write(nc, parsed, parsed[-1], functional_total or 1)
+                n_rows += len(parsed[0])
+                n_functional += int(parsed[-1].sum())
+
+        return n_rows, n_functional
+
+# end of class ClonotypeConverter
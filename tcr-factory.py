@@ -6,14 +6,24 @@
 
 import os
 import re
+import sys
+import json
 import argparse
+import signal
 import socket
 import subprocess
 import shutil
 
 
-from lib.inout import Bin, Log, Xmx
-from lib.pipeline import MiSeqPipe, NextSeqPipe
+from lib.inout import Bin, Log, Xmx, Workers
+from lib.jvm import JavaLauncher
+from lib.artifacts import ArtifactCache
+from lib.scratch import Scratch
+from lib.runner import Runner
+from lib.archive import Archiver
+from lib.daemon import Client, Daemon, Scheduler
+from lib.progress import ProgressServer
+from lib.pipeline import MiSeqPipe, NextSeqPipe, BatchPipe
 
 
 # The script requires R packages: ggplot2, reshape
@@ -24,11 +34,11 @@ def main():
                               metavar='MiSeq|NextSeq',
                               choices=['MiSeq', 'NextSeq'],
                               help='the sequencing tool',
-                              required=True)
+                              required=False)
     input_parser.add_argument('-i',
                               metavar='/path/to/input_dir',
                               help='the path to the input directory (the directory has to have a SampleInfo file)',
-                              required=True)
+                              required=False)
     input_parser.add_argument('-o',
                               metavar='/path/to/output_dir',
                               default=None,
@@ -39,6 +49,11 @@ def main():
                               default='6G',
                               help='Xmx memory size',
                               required=False)
+    input_parser.add_argument('-w',
+                              metavar='1',
+                              default=1,
+                              help='the number of samples processed at the same time (the Xmx memory is shared)',
+                              required=False)
     input_parser.add_argument('-f',
                               metavar='threshold_value',
                               default=0,
@@ -52,7 +67,8 @@ def main():
     input_parser.add_argument('-l',
                               metavar='/path/to/file_name.log',
                               default=None,
-                              help='the log file',
+                              help='the log file, the step events are written to its .jsonl '
+                                   '(to output_dir/logs/tcr-factory.log.jsonl without -l)',
                               required=False)
     input_parser.add_argument('-z',
                               metavar='/path/to/file_name.tar.gz',
@@ -64,6 +80,63 @@ def main():
                               default=0,
                               help='a socket port number to prevent running multiple instances',
                               required=False)
+    input_parser.add_argument('--submit',
+                              metavar='10002',
+                              default=0,
+                              help='the port of the local daemon: the run is submitted to its queue (see --daemon)',
+                              required=False)
+    input_parser.add_argument('--batch',
+                              metavar='/path/to/manifest.tsv',
+                              default=None,
+                              help='process the runs of the manifest (MiSeq|NextSeq<TAB>in_dir[<TAB>out_dir] per line) '
+                                   'in one graph: the tools are checked once, the steps of all runs share the workers; '
+                                   'the output dir of a run is -o/<in_dir name> or in_dir/output by default',
+                              required=False)
+    input_parser.add_argument('--daemon',
+                              action='store_true',
+                              help='start the local daemon on the port --submit: the submitted runs are queued and run '
+                                   'at the same time within --cores and --memory',
+                              required=False)
+    input_parser.add_argument('--cores',
+                              metavar=str(os.cpu_count()),
+                              default=os.cpu_count(),
+                              help='the cores of the daemon shared by the runs (a run takes -w cores)',
+                              required=False)
+    input_parser.add_argument('--memory',
+                              metavar='64G',
+                              default=None,
+                              help='the memory of the daemon shared by the runs (a run takes -m), all the RAM by '
+                                   'default',
+                              required=False)
+    input_parser.add_argument('--daemon-dir',
+                              metavar='/path/to/daemon_dir',
+                              default=None,
+                              help='the state and the output of the daemon runs and the token of its clients, '
+                                   'readable by the user only (/tmp/tcr-factory-PORT by default)',
+                              required=False)
+    input_parser.add_argument('--detach',
+                              action='store_true',
+                              help="submit the run to the daemon and don't wait for it",
+                              required=False)
+    input_parser.add_argument('--status',
+                              metavar='run_id',
+                              nargs='?',
+                              const='',
+                              default=None,
+                              help='the state of the daemon runs or the progress of the run',
+                              required=False)
+    input_parser.add_argument('--cancel',
+                              metavar='run_id',
+                              default=None,
+                              help='cancel the daemon run',
+                              required=False)
+    input_parser.add_argument('--progress-port',
+                              metavar='10001',
+                              default=0,
+                              help='serve the live progress of the run on the local port: GET /progress (the stage, '
+                                   'percent, reads/s and ETA of every sample, the stragglers) and GET /events (the '
+                                   'same as server-sent events); the state is written to out_dir/progress.json too',
+                              required=False)
     input_parser.add_argument('-c',
                               action='store_true',
                               help='force collision filter',
@@ -76,20 +149,231 @@ def main():
                               action='store_true',
                               help='initialized (use if all required tools are installed)',
                               required=False)
+    input_parser.add_argument('--vdjtools-batch',
+                              action='store_true',
+                              help='run VDJtools once for all samples (with a metadata file) instead of per sample',
+                              required=False)
+    input_parser.add_argument('--jvm',
+                              metavar='subprocess|nailgun',
+                              choices=JavaLauncher.modes,
+                              default='subprocess',
+                              help='run the java tools in new JVMs or in warm nailgun servers (needs ng and '
+                                   'nailgun-server*.jar in the bin directory, falls back to new JVMs)',
+                              required=False)
+    input_parser.add_argument('--jvm-port',
+                              metavar='2113',
+                              default=2113,
+                              help='the first port of the nailgun servers',
+                              required=False)
+    input_parser.add_argument('--mirror',
+                              metavar='/path/to/mirror_dir',
+                              default=None,
+                              help='a local directory with the tool archives (mixcr-3.0.13.zip, histogram.R, ...) '
+                                   'used instead of the downloads',
+                              required=False)
+    input_parser.add_argument('--timeout',
+                              metavar='seconds',
+                              default=None,
+                              help='the wall-clock limit of every tool run, the hung tool is killed and the pipeline '
+                                   'stops',
+                              required=False)
+    input_parser.add_argument('--step-timeout',
+                              metavar='step=seconds',
+                              action='append',
+                              default=[],
+                              help='the wall-clock limit of the step runs (Align=7200, ...), can be repeated',
+                              required=False)
+    input_parser.add_argument('--retention',
+                              metavar='stage|step=keep|delete|compress',
+                              action='append',
+                              default=[],
+                              help='delete or compress the intermediates (the demultiplexed, assembled and '
+                                   'subsampled reads, .vdjca, .clns, the per-sample reports) of the stage or the step '
+                                   '(MIGEC=delete, Align=compress, all=delete, ...) as soon as the last step reading '
+                                   'them is done, can be repeated',
+                              required=False)
+    input_parser.add_argument('--skip-qc',
+                              action='store_true',
+                              help="don't check the input FASTQ files (the records, the pairs, the number of reads) "
+                                   'before the pipeline',
+                              required=False)
+    input_parser.add_argument('--subsample',
+                              metavar='N|min|exp',
+                              default=None,
+                              help='downsample the assembled reads of every sample before MiXCR to N reads, to the '
+                                   'assembled reads of the shallowest sample (min) or to reads_exp of SampleInfo (exp, '
+                                   'the raw reads: only the samples assembled to more reads are cut)',
+                              required=False)
+    input_parser.add_argument('--subsample-seed',
+                              metavar='1',
+                              default=1,
+                              help='the random seed of the subsampling',
+                              required=False)
+    input_parser.add_argument('--checkout-shards',
+                              metavar='1',
+                              default=1,
+                              help='split the input FASTQ files into the shards and demultiplex them at the same '
+                                   'time (the shards share the Xmx memory)',
+                              required=False)
+    input_parser.add_argument('--scratch',
+                              metavar='/path/to/scratch_dir',
+                              default=None,
+                              help='a fast local disk or tmpfs for the intermediates (assembled reads, .vdjca, .clns), '
+                                   'they are removed after the run',
+                              required=False)
+    input_parser.add_argument('--scratch-reserve',
+                              metavar='1G',
+                              default='1G',
+                              help='the free space kept on the scratch, the intermediates are written to the output '
+                                   'dir if there is no room',
+                              required=False)
+    input_parser.add_argument('--cache',
+                              metavar='/path/to/cache_dir',
+                              default=None,
+                              help='a directory shared by the runs: the sample steps (MIGEC assemble, MiXCR, VDJtools) '
+                                   'with the same inputs and parameters are linked from it instead of recomputed',
+                              required=False)
+    input_parser.add_argument('--cache-size',
+                              metavar='50G',
+                              default='50G',
+                              help='the size limit of the cache, the least recently used entries are removed',
+                              required=False)
+    input_parser.add_argument('--heap',
+                              metavar='fixed|adaptive',
+                              choices=('fixed', 'adaptive'),
+                              default='fixed',
+                              help='fixed: the JVMs share -m equally, adaptive: the heap of every JVM step is '
+                                   'estimated from its input size and the past runs, a step starts only if its heap '
+                                   'fits into -m',
+                              required=False)
+    input_parser.add_argument('--vdjtools',
+                              metavar='java|python',
+                              choices=('java', 'python'),
+                              default='java',
+                              help='convert and filter the clonotypes with VDJtools or in python (needs numpy, one '
+                                   'pass, no JVM; not checked against the VDJtools tables yet and no metadata.txt)',
+                              required=False)
+    input_parser.add_argument('--histogram',
+                              metavar='python|R',
+                              choices=('python', 'R'),
+                              default='python',
+                              help='draw the MIGEC histograms in python (needs numpy, matplotlib for PNG) or with '
+                                   'histogram.R (needs Rscript, ggplot2 and reshape)',
+                              required=False)
+    input_parser.add_argument('--force-stage',
+                              metavar='MIGEC|MIXCR|VDJtools|step|all',
+                              action='append',
+                              default=[],
+                              help='recompute the stage or the step in spite of the checkpoints (can be repeated)',
+                              required=False)
 
     args = input_parser.parse_args()
-    in_dir = re.sub(r'/$', '', args.i)
+    in_dir = re.sub(r'/$', '', args.i) if args.i else args.i
     out_dir = re.sub(r'/$', '', args.o) if args.o else args.o
     bin_dir = re.sub(r'/$', '', args.b) if args.b else args.b
     xmx_size = args.m
+    n_workers = args.w
     log_file = args.l
     overseq = args.f
     collisions = args.c
     compressed = args.z
     remove_seq = args.r
     port = int(args.p)
+    submit_port = int(args.submit)
+    progress_port = int(args.progress_port)
     ini = int(args.n)
     seq_tool = args.t
+    force_stages = args.force_stage
+    vdjtools_batch = args.vdjtools_batch
+    jvm_mode = args.jvm
+    jvm_port = int(args.jvm_port)
+    mirror_dir = args.mirror
+    renderer = args.histogram
+    vdjtools_backend = args.vdjtools
+    checkout_shards = int(args.checkout_shards)
+    scratch_dir = args.scratch
+    qc = not args.skip_qc
+    timeout = args.timeout
+    try:
+        step_timeouts = dict(value.split('=', 1) for value in args.step_timeout)
+    except ValueError:
+        exit('wrong --step-timeout, use step=seconds: {}\n'.format(' '.join(args.step_timeout)))
+    try:
+        retention = dict(value.split('=', 1) for value in args.retention)
+    except ValueError:
+        exit('wrong --retention, use stage=keep|delete|compress: {}\n'.format(' '.join(args.retention)))
+    subsample = args.subsample
+    subsample_seed = int(args.subsample_seed)
+    scratch_reserve = args.scratch_reserve
+    heap = args.heap
+    cache_dir = args.cache
+    cache_size = args.cache_size
+
+    daemon_dir = args.daemon_dir or '/tmp/tcr-factory-{}'.format(submit_port)
+    if args.daemon or args.status is not None or args.cancel:
+        if not submit_port:
+            exit('the daemon port is required: --submit PORT\n')
+        if args.daemon:
+            memory = args.memory or '{}M'.format(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 20)
+            try:
+                scheduler = Scheduler(os.path.abspath(__file__), int(args.cores), Xmx(memory).megabytes(),
+                                      daemon_dir)
+                Daemon(submit_port, scheduler).serve()
+            except Exception as error:
+                exit('{}\n'.format(error))
+            return
+        try:
+            client = Client(submit_port, daemon_dir)
+            result = client.cancel(args.cancel) if args.cancel else client.status(args.status)
+        except Exception as error:
+            exit('{}\n'.format(error))
+        print(json.dumps(result, indent=1))
+        return
+
+    batch = args.batch
+    if not batch and (not seq_tool or not in_dir):
+        input_parser.error('the following arguments are required: -t, -i (or --batch)')
+    if batch and (scratch_dir or compressed):
+        input_parser.error('--scratch and -z are not supported with --batch')
+
+    runs = []
+    if batch:
+        try:
+            for run_tool, run_in_dir, run_out_dir in BatchPipe.read_manifest(batch):
+                if not run_out_dir:
+                    run_out_dir = out_dir + '/' + os.path.basename(run_in_dir) if out_dir else run_in_dir + '/output'
+                runs.append((run_tool, run_in_dir, run_out_dir))
+        except Exception as error:
+            exit('{}\n'.format(error))
+        out_dirs = [os.path.abspath(run[2]) for run in runs]
+        if len(set(out_dirs)) < len(out_dirs):
+            exit('the runs of the batch have to have different output dirs: {}\n'.format(' '.join(out_dirs)))
+        out_dir = None
+    elif not out_dir:
+        out_dir = '/output' if in_dir == '/' else in_dir + '/output'
+    elif out_dir in ('.', '..'):
+        out_dir = out_dir + '/output'
+    elif out_dir == '/':
+        out_dir = '/output'
+
+    if submit_port:  # the run is done by the daemon, the script waits for it
+        client = Client(submit_port, daemon_dir)
+        try:
+            job = client.submit(Client.strip(sys.argv[1:], {'--submit': True, '--detach': False, '--daemon-dir': True}),
+                                os.path.abspath(out_dir or batch), int(Workers(n_workers).get()),
+                                Xmx(xmx_size).megabytes(),
+                                os.path.abspath(log_file) if log_file else None)
+            print('the run {} is submitted to the daemon on port {}'.format(job['id'], submit_port))
+            if args.detach:
+                return
+            job = client.wait(job['id'])
+        except Exception as error:
+            exit('{}\n'.format(error))
+        if job['state'] != 'done':
+            print('\n'.join(job['output']))
+            exit('...{}'.format('cancelled' if job['state'] == 'cancelled' else 'error'))
+        print('...done')
+        return
 
     my_sock = None
     if port:  # open a socket connection to prevent running multiple instances of the script
@@ -104,31 +388,76 @@ def main():
         except socket.error:
             exit("can't start: an instance of the script is running or the port is taken\n")
 
-    if not out_dir:
-        out_dir = '/output' if in_dir == '/' else in_dir + '/output'
-    elif out_dir in ('.', '..'):
-        out_dir = out_dir + '/output'
-    elif out_dir == '/':
-        out_dir = '/output'
-
     Bin(bin_dir)
+    ArtifactCache(mirror_dir)
     Xmx(xmx_size)
-    log = Log(log_file)
-
-    pipe = None
-    if seq_tool == 'MiSeq':
-        pipe = MiSeqPipe(in_dir, out_dir)
-        pipe.set_overseq(overseq)
-        pipe.set_collisions(collisions)
-    elif seq_tool == 'NextSeq':
-        pipe = NextSeqPipe(in_dir, out_dir)
-        pipe.set_overseq(overseq)
-        pipe.set_collisions(collisions)
+    Workers(n_workers)
+    Scratch(scratch_dir, out_dir, scratch_reserve)
+    Runner(timeout, step_timeouts, out_dir + '/logs' if out_dir else None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: Runner().cancel('the run is cancelled'))
+    launcher = JavaLauncher(jvm_mode, jvm_port)
+    log = Log(log_file, None if log_file or batch else out_dir + '/logs/tcr-factory.log.jsonl')
+    progress_server = ProgressServer(progress_port) if progress_port else None
+
+    def new_pipe(run_tool, run_in_dir, run_out_dir):
+        run_pipe = None
+        if run_tool == 'MiSeq':
+            run_pipe = MiSeqPipe(run_in_dir, run_out_dir)
+        elif run_tool == 'NextSeq':
+            run_pipe = NextSeqPipe(run_in_dir, run_out_dir)
+        if run_pipe:
+            run_pipe.set_overseq(overseq)
+            run_pipe.set_collisions(collisions)
+            run_pipe.set_force_stages(force_stages)
+            run_pipe.set_vdjtools_batch(vdjtools_batch)
+            run_pipe.set_histogram_renderer(renderer)
+            run_pipe.set_vdjtools_backend(vdjtools_backend)
+            run_pipe.set_checkout_shards(checkout_shards)
+            run_pipe.set_qc(qc)
+            run_pipe.set_retention(retention)
+            run_pipe.set_subsample(subsample, subsample_seed)
+            run_pipe.set_heap(heap)
+            run_pipe.set_cache(cache_dir, cache_size)
+            run_pipe.set_progress_server(progress_server)
+
+        return run_pipe
 
+    if batch:
+        pipes = []
+        for run in runs:  # the SampleInfo files of all runs are checked before the first step
+            try:
+                pipes.append(new_pipe(*run))
+            except Exception as error:
+                exit('{}: {}\n'.format(run[1], error))
+        pipe = BatchPipe(pipes)
+    else:
+        pipe = new_pipe(seq_tool, in_dir, out_dir)
+
+    archiver = None
     if pipe:
         if not ini:
             pipe.check()
-        pipe.execute(log)
+        if progress_server:
+            try:
+                progress_server.start()
+            except Exception as error:
+                exit('{}\n'.format(error))
+        if compressed:  # the archive is written while the pipeline runs, the FASTQ files are skipped with -r
+            if os.path.exists(compressed):
+                os.remove(compressed)
+            archiver = Archiver(compressed, out_dir, ('*.gz',) if remove_seq else ())
+            pipe.set_archiver(archiver)
+        try:
+            pipe.execute(log)
+        except SystemExit:
+            if archiver:
+                archiver.abort()
+            log.close()
+            raise
+        finally:
+            launcher.stop()
+            if progress_server:
+                progress_server.stop()
     else:
         print('Wrong the pipeline. Aborted.')
 
@@ -136,22 +465,21 @@ def main():
         my_sock.close()  # now we are able to run another instance
 
     if remove_seq:
-        cmd_array = ['find', out_dir, '-name', '*.gz', '-delete']
-        subprocess.run(cmd_array)
-
-    if compressed:
-        if os.path.exists(compressed):
-            os.remove(compressed)
-        cmd_array = ['tar', '-zcf', compressed, '-C', out_dir, '.']
-        subprocess.run(cmd_array)
+        for run_out_dir in [run[2] for run in runs] or [out_dir]:
+            cmd_array = ['find', run_out_dir, '-name', '*.gz', '-delete']
+            subprocess.run(cmd_array)
 
+    if archiver:
         try:
+            archiver.close()
             shutil.rmtree(out_dir)
         except Exception as error:
-            log.add('\nFile cleanup error:\n{}'.format(error))
+            log.add('\nArchive error:\n{}'.format(error))
             log.write()
+            log.close()
             exit('...error')
 
+    log.close()
     print('...done')
 
 # end of main()
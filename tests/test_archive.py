@@ -0,0 +1,126 @@
+import os
+import gzip
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from lib.archive import Archiver
+
+
+class Task:  # the fields of a task of the graph read by Archiver.finished
+    def __init__(self, outputs, inputs=None, deps=(), intermediates=None):
+        self.outputs = lambda: outputs
+        self.inputs = lambda: inputs or []
+        self.deps = list(deps)
+        self.intermediates = (lambda: intermediates) if intermediates else None
+
+# end of class Task
+
+
+class Graph:
+    def __init__(self, tasks):
+        self._tasks = tasks
+
+    def descendants(self, task):
+        return [other for other in self._tasks if task in other.deps]
+
+# end of class Graph
+
+
+class ArchiverTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._out_dir = self._dir + '/out'
+        self._files = {
+            'qc.txt': b'sample\tstatus\nS1\tOK\n',
+            'mixcr/S1.clonotypes.TRB.txt': os.urandom(3000) * 5,
+            'mixcr/S1.clns': os.urandom(5000),
+            'assemble/S1_R1.fastq.gz': gzip.compress(b'@read\nACGT\n+\nIIII\n' * 100),
+            'tmp/skipped.tmp': b'skip me',
+            'empty.txt': b'',
+        }
+        for name, data in self._files.items():
+            os.makedirs(os.path.dirname('{}/{}'.format(self._out_dir, name)), exist_ok=True)
+            with open('{}/{}'.format(self._out_dir, name), 'wb') as file:
+                file.write(data)
+        self._archive = self._dir + '/out.tar.gz'
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _contents(self):
+        with tarfile.open(self._archive, 'r:gz') as tar:
+            return {member.name[2:]: tar.extractfile(member).read() for member in tar.getmembers() if member.isfile()}
+
+    def _names(self):
+        with tarfile.open(self._archive, 'r:gz') as tar:
+            return tar.getnames()
+
+    def test_archive(self):
+        archiver = Archiver(self._archive, self._out_dir, skip=('*.tmp',), n_workers=3)
+        archiver.block_size = 1024  # the files of several blocks
+        archiver.add(self._out_dir + '/mixcr/S1.clonotypes.TRB.txt')
+        archiver.close()
+        self.assertTrue(archiver.closed())
+        self.assertFalse(os.path.exists(self._archive + '.part'))
+        self.assertEqual(self._contents(), {name: data for name, data in self._files.items()
+                                            if not name.endswith('.tmp')})
+
+    def test_changed(self):  # a file which may still change is added by close, every file is one member
+        archiver = Archiver(self._archive, self._out_dir, n_workers=2)
+        archiver.add(self._out_dir + '/qc.txt')
+        archiver.add(self._out_dir + '/empty.txt')
+        archiver.add(self._out_dir + '/empty.txt')
+        with open(self._out_dir + '/qc.txt', 'ab') as file:
+            file.write(b'S2\tOK\n')
+        archiver.close()
+        self.assertEqual(self._contents()['qc.txt'], self._files['qc.txt'] + b'S2\tOK\n')
+        self.assertEqual(len(self._names()), len(set(self._names())))
+
+    def test_changed_result(self):  # a result changed after it is archived is an error, not a second member
+        archiver = Archiver(self._archive, self._out_dir, n_workers=2)
+        archiver.add(self._out_dir + '/mixcr/S1.clonotypes.TRB.txt')
+        while './mixcr/S1.clonotypes.TRB.txt' not in archiver._archived:  # archived before it is changed
+            time.sleep(0.01)
+        with open(self._out_dir + '/mixcr/S1.clonotypes.TRB.txt', 'ab') as file:
+            file.write(b'changed')
+        with self.assertRaisesRegex(Exception, 'S1.clonotypes.TRB.txt is changed after it is archived'):
+            archiver.close()
+        self.assertFalse(os.path.exists(self._archive))
+        self.assertFalse(os.path.exists(self._archive + '.part'))
+
+    def test_same_bytes(self):
+        archives = []
+        for n_workers in (1, 4):
+            archiver = Archiver(self._archive, self._out_dir, n_workers=n_workers)
+            archiver.close()
+            with open(self._archive, 'rb') as file:
+                archives.append(file.read())
+        self.assertEqual(archives[0], archives[1])
+
+    def test_finished(self):  # the results of a step are added as soon as it is done, not the intermediates
+        clns = self._out_dir + '/mixcr/S1.clns'
+        clonotypes = self._out_dir + '/mixcr/S1.clonotypes.TRB.txt'
+        analyze = Task([clns, clonotypes], intermediates=[clns])
+        export = Task([], inputs=[clns], deps=[analyze])
+        archiver = Archiver(self._archive, self._out_dir, n_workers=2)
+        added = []
+        archiver.add = added.append
+        archiver.finished(analyze, Graph([analyze, export]))
+        self.assertEqual(added, [clonotypes])
+        archiver.abort()
+
+    def test_abort(self):
+        archiver = Archiver(self._archive, self._out_dir, n_workers=2)
+        archiver.add(self._out_dir + '/qc.txt')
+        archiver.abort()
+        self.assertFalse(os.path.exists(self._archive + '.part'))
+        self.assertFalse(os.path.exists(self._archive))
+
+# end of class ArchiverTest
+
+
+if __name__ == '__main__':
+    unittest.main()
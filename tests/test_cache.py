@@ -0,0 +1,133 @@
+import os
+import time
+import glob
+import shutil
+import tempfile
+import unittest
+
+from lib.scratch import Scratch
+from lib.executor import Task
+from lib.cache import ResultCache
+
+
+def setUpModule():
+    Scratch()  # no scratch dir
+
+
+def write(file_name, text):
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'w') as file:
+        file.write(text)
+
+
+def read(file_name):
+    with open(file_name, 'r') as file:
+        return file.read()
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._cache_dir = self._dir + '/cache'
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _run(self, name, reads='ACGT\n', sample='S1', step='Align', table=None):  # a run with the step of a sample
+        out_dir = '{}/{}'.format(self._dir, name)
+        write('{}/assemble/{}_R1.fastq'.format(out_dir, sample), reads)
+        output = '{}/alignment/{}_alignments.vdjca'.format(out_dir, sample)
+        inputs = ['{}/assemble/{}_R1.fastq'.format(out_dir, sample)]
+        parts = None
+        if table:  # the run-wide table, the rows of the sample are the input of the step
+            write(out_dir + '/checkout/checkout.filelist.txt', table)
+            inputs.append(out_dir + '/checkout/checkout.filelist.txt')
+            parts = lambda: {inputs[1]: ''.join(line for line in table.splitlines(True) if line.startswith(sample))}
+        task = Task(None, 'MIXCR', step, sample, inputs=lambda: list(inputs),
+                    outputs=lambda: [name for name in [output] if os.path.isfile(name)], params={'chain': 'TRB'},
+                    input_parts=parts)
+        task.func = lambda: write(output, 'alignments of ' + read(inputs[0])) or 'aligned\n'
+
+        return task, output, out_dir
+
+    def _step(self, cache, task):  # the step as TaskGraph runs it
+        output = cache.fetch(task)
+        if output is None:
+            output = task.run()
+            cache.store(task, output)
+
+        return output
+
+    def test_hit(self):  # the same inputs of another run: the cached file is linked
+        task, output, out_dir = self._run('run1')
+        cache = ResultCache(self._cache_dir, '1G', out_dir)
+        self.assertEqual(self._step(cache, task), 'aligned\n')
+        self.assertIn('0 hits, 1 misses, 1 stored', cache.summary())
+
+        task, other_output, out_dir = self._run('run2')
+        task.func = lambda: self.fail('the step is run')
+        cache = ResultCache(self._cache_dir, '1G', out_dir)
+        self.assertRegex(self._step(cache, task), r'restored from the cache .*\naligned\n$')
+        self.assertEqual(read(other_output), read(output))
+        self.assertEqual(os.stat(other_output).st_ino, os.stat(output).st_ino)
+        self.assertEqual(os.stat(other_output).st_nlink, 3)  # the two runs and the cache
+        self.assertIn('1 hits, 0 misses', cache.summary())
+
+    def test_miss(self):  # other reads, step or parameters
+        task, _, out_dir = self._run('run1')
+        self._step(ResultCache(self._cache_dir, '1G', out_dir), task)
+        for name, args in (('reads', {'reads': 'ACGA\n'}), ('step', {'step': 'Assemble'}),
+                           ('sample', {'sample': 'S2'})):
+            with self.subTest(name=name):
+                task, _, out_dir = self._run(name, **args)
+                self.assertIsNone(ResultCache(self._cache_dir, '1G', out_dir).fetch(task))
+        task, _, out_dir = self._run('params')
+        task.params['chain'] = 'TRA'
+        self.assertIsNone(ResultCache(self._cache_dir, '1G', out_dir).fetch(task))
+
+    def test_not_cacheable(self):
+        task, _, out_dir = self._run('run1', step='Reports')
+        cache = ResultCache(self._cache_dir, '1G', out_dir)
+        self._step(cache, task)
+        self.assertIsNone(cache.fetch(task))
+        self.assertEqual(glob.glob(self._cache_dir + '/??'), [])
+
+    def test_parts(self):  # a new sample of the run-wide table doesn't change the key of the others
+        task, _, out_dir = self._run('run1', table='S1\tACGT\n')
+        self._step(ResultCache(self._cache_dir, '1G', out_dir), task)
+        task, _, out_dir = self._run('run2', table='S1\tACGT\nS2\tTTGA\n')
+        self.assertIsNotNone(ResultCache(self._cache_dir, '1G', out_dir).fetch(task))
+        task, _, out_dir = self._run('run3', table='S1\tACGG\n')
+        self.assertIsNone(ResultCache(self._cache_dir, '1G', out_dir).fetch(task))
+
+    def test_evict(self):  # the least recently used entries above the limit
+        entries = []
+        for n_run, reads in enumerate(('A' * 100, 'C' * 100, 'G' * 100)):
+            task, _, out_dir = self._run('run{}'.format(n_run), reads)
+            cache = ResultCache(self._cache_dir, '300', out_dir)
+            self._step(cache, task)
+            entries += [name for name in glob.glob(self._cache_dir + '/??/*') if name not in entries]
+            used = time.time() - 100 + n_run
+            os.utime(entries[-1] + '/' + ResultCache.manifest_name, (used, used))
+        self.assertEqual([os.path.isdir(entry) for entry in entries], [False, True, True])
+        self.assertIn('1 evicted', cache.summary())
+
+        task, _, out_dir = self._run('used', 'C' * 100)  # a hit makes the entry recent
+        cache = ResultCache(self._cache_dir, '300', out_dir)
+        self.assertIsNotNone(cache.fetch(task))
+        task, _, out_dir = self._run('new', 'T' * 100)
+        self._step(ResultCache(self._cache_dir, '300', out_dir), task)
+        self.assertEqual([os.path.isdir(entry) for entry in entries], [False, True, False])
+
+    def test_size(self):
+        self.assertEqual(ResultCache._size('512M'), 512 << 20)
+        self.assertEqual(ResultCache._size('50g'), 50 << 30)
+        self.assertEqual(ResultCache._size('1000'), 1000)
+        with self.assertRaisesRegex(Exception, 'Wrong the cache size'):
+            ResultCache._size('1.5G')
+
+# end of class ResultCacheTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.executor import Task
+from lib.checkpoint import Checkpoint
+
+
+def write(file_name, text):
+    with open(file_name, 'w') as file:
+        file.write(text)
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._in = self._dir + '/S1_R1.fastq'
+        self._out = self._dir + '/S1_alignments.vdjca'
+        write(self._in, 'ACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _task(self, params=None, step='Align', inputs=None, outputs=None):
+        inputs = [self._in] if inputs is None else inputs
+        outputs = [self._out] if outputs is None else outputs
+        return Task(lambda: None, 'MIXCR', step, 'S1', inputs=lambda: list(inputs), outputs=lambda: list(outputs),
+                    params=params or {'chain': 'TRB'})
+
+    def _done(self, checkpoint, task):  # the step is run and recorded
+        for file_name in task.outputs():
+            write(file_name, 'alignments of ' + ' '.join(task.inputs()))
+        checkpoint.record(task)
+
+    def test_valid(self):
+        checkpoint = Checkpoint(self._dir)
+        task = self._task()
+        self.assertFalse(checkpoint.valid(task))
+        self._done(checkpoint, task)
+        self.assertTrue(checkpoint.valid(task))
+        self.assertTrue(Checkpoint(self._dir).valid(self._task()))  # the next run
+
+    def test_input(self):  # the content of an input, not its mtime
+        checkpoint = Checkpoint(self._dir)
+        self._done(checkpoint, self._task())
+        os.utime(self._in, (0, 0))
+        self.assertTrue(Checkpoint(self._dir).valid(self._task()))
+        write(self._in, 'ACGA\n')
+        self.assertFalse(Checkpoint(self._dir).valid(self._task()))
+
+    def test_new_input(self):
+        checkpoint = Checkpoint(self._dir)
+        self._done(checkpoint, self._task())
+        write(self._dir + '/S1_R2.fastq', 'TGCA\n')
+        self.assertFalse(checkpoint.valid(self._task(inputs=[self._in, self._dir + '/S1_R2.fastq'])))
+
+    def test_params(self):
+        checkpoint = Checkpoint(self._dir)
+        self._done(checkpoint, self._task())
+        self.assertFalse(checkpoint.valid(self._task({'chain': 'TRA'})))
+        self.assertTrue(checkpoint.valid(self._task({'chain': 'TRB'})))
+
+    def test_output(self):  # a changed or removed output
+        checkpoint = Checkpoint(self._dir)
+        self._done(checkpoint, self._task())
+        write(self._out, 'broken')
+        self.assertFalse(checkpoint.valid(self._task()))
+        os.remove(self._out)
+        self.assertFalse(checkpoint.valid(self._task()))
+
+    def test_forced(self):
+        self._done(Checkpoint(self._dir), self._task())
+        self.assertFalse(Checkpoint(self._dir, ['mixcr']).valid(self._task()))
+        self.assertFalse(Checkpoint(self._dir, ['Align']).valid(self._task()))
+        self.assertTrue(Checkpoint(self._dir, ['Assemble']).valid(self._task()))
+
+    def test_no_inputs(self):  # a step without the listed inputs is always run
+        checkpoint = Checkpoint(self._dir)
+        task = Task(lambda: None, 'MIXCR', 'Reports')
+        checkpoint.record(task)
+        self.assertFalse(checkpoint.valid(task))
+
+    def test_broken(self):
+        write(self._dir + '/' + Checkpoint.file_name, '{"steps"')
+        self.assertFalse(Checkpoint(self._dir).valid(self._task()))
+
+    def test_retired(self):  # a retired output is valid while the step reading it is valid (see Retention)
+        clones = self._dir + '/S1_clonotypes.clns'
+        align = self._task()
+        assemble = self._task(step='Assemble', inputs=[self._out], outputs=[clones])
+        checkpoint = Checkpoint(self._dir)
+        self._done(checkpoint, align)
+        self._done(checkpoint, assemble)
+        checkpoint.retire(self._out, 'delete')
+        os.remove(self._out)
+
+        def descendants(task):
+            return [assemble] if task is align else []
+
+        checkpoint = Checkpoint(self._dir)
+        self.assertTrue(checkpoint.valid(align, descendants))
+        self.assertTrue(checkpoint.valid(self._task(step='Assemble', inputs=[], outputs=[clones])))  # not listed
+        self.assertFalse(checkpoint.valid(align))  # the readers are unknown
+        self.assertFalse(Checkpoint(self._dir, ['Assemble']).valid(align, descendants))
+        write(clones, 'changed')
+        self.assertFalse(checkpoint.valid(align, descendants))
+
+# end of class CheckpointTest
+
+
+if __name__ == '__main__':
+    unittest.main()
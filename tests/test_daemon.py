@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.daemon import Client, Job, Scheduler
+
+
+class Process:  # the run of a job, finished by the test
+    pid = 0
+
+    def __init__(self):
+        self.exit_code = None
+
+    def poll(self):
+        return self.exit_code
+
+# end of class Process
+
+
+class QueueScheduler(Scheduler):  # the runs are not started
+    def _launch(self, job):
+        job.process = Process()
+        job.state = 'running'
+
+# end of class QueueScheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._scheduler = QueueScheduler('tcr-factory.py', 4, 1000, self._dir + '/daemon')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _submit(self, name, cores, memory):
+        return self._scheduler.submit({'argv': ['-t', 'MiSeq', '-i', name], 'out_dir': self._dir + '/' + name,
+                                       'cores': cores, 'memory': memory})
+
+    def test_budget(self):  # the cores and the memory of the running jobs fit into the budget
+        first = self._submit('first', 2, 400)
+        second = self._submit('second', 2, 400)
+        third = self._submit('third', 1, 100)
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state, third.state], ['running', 'running', 'queued'])
+        self.assertEqual(self._scheduler._used(), (4, 800))
+
+        first.process.exit_code = 0
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state, third.state], ['done', 'running', 'running'])
+        self.assertEqual(self._scheduler._used(), (3, 500))
+
+    def test_fifo(self):  # a small job doesn't overtake the first job of the queue
+        first = self._submit('first', 3, 100)
+        second = self._submit('second', 2, 100)
+        third = self._submit('third', 1, 100)
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state, third.state], ['running', 'queued', 'queued'])
+
+        first.process.exit_code = 1
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state, third.state], ['failed', 'running', 'running'])
+
+    def test_memory(self):
+        first = self._submit('first', 1, 600)
+        second = self._submit('second', 1, 600)
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state], ['running', 'queued'])
+
+    def test_over_budget(self):
+        with self.assertRaisesRegex(ValueError, 'the budget is 4 cores and 1000 MB'):
+            self._submit('cores', 5, 100)
+        with self.assertRaisesRegex(ValueError, 'the budget is 4 cores and 1000 MB'):
+            self._submit('memory', 1, 1001)
+        self.assertEqual(self._scheduler.get_jobs(), [])
+
+    def test_out_dir(self):  # one run per output dir
+        self._submit('first', 1, 100)
+        with self.assertRaisesRegex(ValueError, 'is used by the run'):
+            self._submit('first', 1, 100)
+
+    def test_cancel(self):  # a queued job is cancelled at once
+        first = self._submit('first', 4, 100)
+        second = self._submit('second', 1, 100)
+        self._scheduler._schedule()
+        self._scheduler.cancel(second.id)
+        first.process.exit_code = 0
+        self._scheduler._schedule()
+        self.assertEqual([first.state, second.state], ['done', 'cancelled'])
+
+    def test_log_file(self):  # the step events of the run give the progress
+        job = self._submit('first', 1, 100)
+        self.assertEqual(job.argv[-2:], ['-l', '{}/daemon/{}.log'.format(self._dir, job.id)])
+
+    def test_token(self):
+        self.assertFalse(self._scheduler.authorized('secret'))
+        self._scheduler.new_token()
+        with open(self._dir + '/daemon/' + Scheduler.token_name, 'r') as file:
+            token = file.read()
+        self.assertTrue(self._scheduler.authorized(token))
+        self.assertFalse(self._scheduler.authorized(token[:-1]))
+        self.assertEqual(os.stat(self._dir + '/daemon').st_mode & 0o077, 0)
+
+# end of class SchedulerTest
+
+
+class ClientTest(unittest.TestCase):
+    options = {'--submit': True, '--detach': False, '--daemon-dir': True}
+
+    def test_strip(self):
+        argv = ['-t', 'MiSeq', '--submit', '10002', '-i', 'in', '--detach', '--daemon-dir', '/tmp/d', '-p', '10000']
+        self.assertEqual(Client.strip(argv, self.options), ['-t', 'MiSeq', '-i', 'in', '-p', '10000'])
+
+    def test_strip_equals(self):
+        argv = ['--submit=10002', '-t', 'MiSeq', '--daemon-dir=/tmp/d', '-i', 'in']
+        self.assertEqual(Client.strip(argv, self.options), ['-t', 'MiSeq', '-i', 'in'])
+
+    def test_strip_short(self):  # the value is a part of a short option
+        self.assertEqual(Client.strip(['-p10000', '-t', 'MiSeq'], {'-p': True}), ['-t', 'MiSeq'])
+        self.assertEqual(Client.strip(['-p', '10000', '-t', 'MiSeq'], {'-p': True}), ['-t', 'MiSeq'])
+
+    def test_validate(self):  # the lock port -p is an option of the run
+        request = {'argv': ['-t', 'MiSeq', '-p', '10000'], 'out_dir': '/tmp/out'}
+        self.assertIsNone(Job.validate(request))
+        for arg in ('--submit', '--submit=10002', '--daemon', '--daemon-dir=/tmp/d', '--status', '--cancel'):
+            with self.subTest(arg=arg):
+                self.assertIn('options of the daemon', Job.validate(dict(request, argv=['-t', 'MiSeq', arg])))
+        self.assertIn('list of strings', Job.validate(dict(request, argv=[])))
+
+# end of class ClientTest
+
+
+if __name__ == '__main__':
+    unittest.main()
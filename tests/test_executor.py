@@ -0,0 +1,117 @@
+import time
+import threading
+import unittest
+
+from lib.inout import Xmx
+from lib.executor import TaskGraph
+
+
+def setUpModule():
+    Xmx('1G')
+
+
+class Memory:  # the heap model of the steps (see HeapModel)
+    def __init__(self, budget, sizes):
+        self._budget = budget
+        self._sizes = sizes
+
+    def estimate(self, task):
+        return self._sizes[task.step]
+
+    def get_budget(self):
+        return self._budget
+
+# end of class Memory
+
+
+class TaskGraphTest(unittest.TestCase):
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._order = []
+        self._running = 0
+        self._peak = 0
+
+    def _step(self, name, seconds=0.0, error=None):
+        def run():
+            with self._lock:
+                self._running += 1
+                self._peak = max(self._peak, self._running)
+            time.sleep(seconds)
+            with self._lock:
+                self._running -= 1
+                self._order.append(name)
+            if error:
+                raise error
+            return name
+
+        return run
+
+    def test_order(self):  # a step starts after its dependencies, the others run at the same time
+        graph = TaskGraph(4)
+        checkout = graph.add(self._step('Checkout', 0.05), 'MIGEC', 'Checkout')
+        samples = [graph.add(self._step(name, 0.05), 'MIXCR', name, deps=[checkout]) for name in ('S1', 'S2', 'S3')]
+        report = graph.add(self._step('Report'), 'MIXCR', 'Report', deps=samples)
+        self.assertIsNone(graph.run())
+
+        self.assertEqual(self._order[0], 'Checkout')
+        self.assertEqual(sorted(self._order[1:4]), ['S1', 'S2', 'S3'])
+        self.assertEqual(self._order[4], 'Report')
+        self.assertEqual(self._peak, 3)
+        self.assertTrue(all(task.done and task.exit_code == 0 for task in graph.get_tasks()))
+        self.assertEqual(report.output, 'Report')
+        self.assertEqual(graph.descendants(checkout), set(samples + [report]))
+
+    def test_admit(self):  # the steps fit into the memory, a smaller step goes first
+        graph = TaskGraph(4, memory=Memory(1000, {'Big': 600, 'Other': 600, 'Small': 300}))
+        tasks = [graph.add(self._step(name), 'MIXCR', name) for name in ('Big', 'Other', 'Small')]
+        self.assertEqual(graph._admit(tasks, {}, 4), [tasks[0], tasks[2]])
+        self.assertEqual(graph._admit(tasks[1:], {None: tasks[0]}, 4), [tasks[2]])
+        self.assertEqual(graph._admit(tasks, {}, 1), [tasks[0]])
+        self.assertEqual([task.memory for task in tasks], [600, 600, 300])
+
+    def test_admit_big(self):  # a step bigger than the budget runs alone
+        graph = TaskGraph(4, memory=Memory(1000, {'Huge': 1500, 'Small': 100}))
+        tasks = [graph.add(self._step(name), 'MIXCR', name) for name in ('Huge', 'Small')]
+        self.assertEqual(graph._admit(tasks, {}, 4), tasks[:1])
+        self.assertEqual(graph._admit(tasks[1:], {None: tasks[0]}, 4), [])
+
+    def test_memory(self):  # the granted steps don't run at the same time
+        graph = TaskGraph(4, memory=Memory(1000, {'S1': 600, 'S2': 600, 'S3': 600}))
+        for name in ('S1', 'S2', 'S3'):
+            graph.add(self._step(name, 0.02), 'MIXCR', name)
+        self.assertIsNone(graph.run())
+        self.assertEqual(self._peak, 1)
+
+    def test_failure(self):  # the steps after a failure are not started, the first failure is returned
+        cancel = threading.Event()
+        graph = TaskGraph(2, cancel=cancel)
+        failed = graph.add(self._step('Align', error=Exception('exit code 1')), 'MIXCR', 'Align')
+        slow = graph.add(self._step('Slow', 0.1), 'MIXCR', 'Slow')
+        after = graph.add(self._step('Assemble'), 'MIXCR', 'Assemble', deps=[failed])
+        other = graph.add(self._step('Report'), 'MIXCR', 'Report', deps=[slow])
+        self.assertIs(graph.run(), failed)
+
+        self.assertTrue(cancel.is_set())
+        self.assertEqual(str(failed.error), 'exit code 1')
+        self.assertTrue(slow.done)  # a running step is stopped by its command (see Command)
+        self.assertNotIn('Assemble', self._order)
+        self.assertNotIn('Report', self._order)
+        self.assertFalse(after.done or other.done)
+
+    def test_scopes(self):  # a failed run doesn't stop the steps of the other runs
+        graph = TaskGraph(2)
+        first, second = graph.scope(), graph.scope()
+        failed = first.add(self._step('Align', error=Exception('exit code 1')), 'MIXCR', 'Align')
+        first.add(self._step('Assemble'), 'MIXCR', 'Assemble', deps=[failed])
+        align = second.add(self._step('Align2'), 'MIXCR', 'Align')
+        assemble = second.add(self._step('Assemble2'), 'MIXCR', 'Assemble', deps=[align])
+        self.assertIs(graph.run(), failed)
+        self.assertTrue(assemble.done)
+        self.assertIs(first.failed, failed)
+        self.assertIsNone(second.failed)
+
+# end of class TaskGraphTest
+
+
+if __name__ == '__main__':
+    unittest.main()
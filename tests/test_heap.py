@@ -0,0 +1,120 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from lib.executor import Task
+from lib.heap import HeapModel, FixedHeap
+
+
+class Metrics:  # the max RSS of the tool runs (see Metrics)
+    def __init__(self):
+        self._records = []
+
+    def add(self, task, max_rss_mb):
+        self._records.append({'stage': task.stage, 'step': task.step, 'sample': task.sample, 'start': task.start,
+                              'max_rss_mb': max_rss_mb})
+
+    def get_records(self):
+        return list(self._records)
+
+# end of class Metrics
+
+
+class Scope:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+# end of class Scope
+
+
+class HeapModelTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._history = self._dir + '/.heap.csv'
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _task(self, step='Align', input_mb=100):
+        file_name = '{}/{}.{}'.format(self._dir, step, input_mb)
+        with open(file_name, 'wb') as file:
+            file.truncate(input_mb << 20)
+        return Task(None, 'MIXCR', step, 'S1', inputs=lambda: [file_name])
+
+    def _write(self, rows):  # step, input MB, granted heap MB, max RSS MB
+        with open(self._history, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(HeapModel.fields)
+            writer.writerows(rows)
+
+    def test_defaults(self):  # base + factor * input with the margin until the step has a history
+        model = HeapModel(64 * 1024)
+        self.assertEqual(model.estimate(self._task('Align', 100)), int((1024 + 4.0 * 100) * HeapModel.margin))
+        self.assertEqual(model.estimate(self._task('Histogram', 1)), int((512 + 0.2) * HeapModel.margin))
+        self.assertEqual(model.estimate(self._task('Reports', 100)), 0)  # no JVM
+
+    def test_limits(self):  # no more than the budget, no less than the base heap of the step
+        self.assertEqual(HeapModel(2000).estimate(self._task('Align', 1000)), 2000)
+        self._write([('exportclones', 10, 600, 300)] * 5)
+        self.assertEqual(HeapModel(2000, self._history).estimate(self._task('ExportClones', 10)), 512)
+
+    def test_percentile(self):  # the 90th percentile of the learned factors, no margin
+        rss = [1024 + HeapModel.jvm_overhead + factor * 100 for factor in range(1, 11)]
+        self._write([('align', 100, 'None', value) for value in rss])
+        model = HeapModel(64 * 1024, self._history)
+        self.assertEqual(model.estimate(self._task('Align', 100)), 1024 + 10 * 100)
+
+    def test_granted(self):  # the RSS of a JVM grows up to its -Xmx: the factor is capped by the granted heap
+        self._write([('align', 100, 1524, 4000)] * 10)
+        model = HeapModel(64 * 1024, self._history)
+        self.assertEqual(model.estimate(self._task('Align', 200)), 1024 + 5 * 200)
+
+        self._write([('align', 100, 1524, 1224 + HeapModel.jvm_overhead)] * 10)  # less than granted
+        model = HeapModel(64 * 1024, self._history)
+        self.assertEqual(model.estimate(self._task('Align', 200)), 1024 + 2 * 200)
+
+    def test_history_size(self):  # the last runs of the step
+        self._write([('align', 100, 'None', 1024 + HeapModel.jvm_overhead + 1000)] * 10 +
+                    [('align', 100, 'None', 1024 + HeapModel.jvm_overhead + 100)] * HeapModel.history_size)
+        self.assertEqual(HeapModel(64 * 1024, self._history).estimate(self._task('Align', 100)), 1024 + 100)
+
+    def test_finished(self):  # the max RSS and the granted heap of the step go to the history file
+        metrics = Metrics()
+        task = self._task('Align', 100)
+        task.scope = Scope(metrics)
+        model = HeapModel(64 * 1024, self._history)
+        task.memory = model.estimate(task)
+        task.start = 1000.0
+        metrics.add(task, 2500.0)
+        model.finished(task, None)
+
+        with open(self._history, 'r', newline='') as file:
+            self.assertEqual(list(csv.reader(file)), [list(HeapModel.fields),
+                                                      ['align', '100.0', str(task.memory), '2500']])
+        self.assertEqual(HeapModel(64 * 1024, self._history).estimate(self._task('Align', 100)),
+                         1024 + int(min(2500 - HeapModel.jvm_overhead, task.memory) - 1024))
+        self.assertIn('max RSS', model.summary())
+
+    def test_skipped(self):  # a step skipped by its checkpoint has no RSS
+        metrics = Metrics()
+        task = self._task('Align', 100)
+        task.scope = Scope(metrics)
+        model = HeapModel(64 * 1024, self._history)
+        model.estimate(task)
+        task.skipped = True
+        model.finished(task, None)
+        self.assertFalse(os.path.exists(self._history))
+
+    def test_fixed(self):  # an equal share of the budget by the workers
+        heap = FixedHeap(8000, 4)
+        self.assertEqual(heap.estimate(self._task('Assemble', 1)), 2000)
+        self.assertEqual(heap.estimate(self._task('Reports', 1)), 0)
+        self.assertEqual(heap.get_budget(), 8000)
+
+# end of class HeapModelTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import socket
+import unittest
+
+from lib.inout import Xmx
+from lib.jvm import JavaLauncher
+
+
+def setUpModule():
+    Xmx('1G')
+
+
+class Process:  # a running nailgun server (see subprocess.Popen)
+    def __init__(self):
+        self.stopped = False
+
+    def poll(self):
+        return 0 if self.stopped else None
+
+    def terminate(self):
+        self.stopped = True
+
+    def wait(self, timeout=None):
+        return 0
+
+    def kill(self):
+        self.stopped = True
+
+# end of class Process
+
+
+class JavaLauncherTest(unittest.TestCase):
+    def setUp(self):
+        self._launcher = JavaLauncher()
+        self._launcher._servers.clear()
+        self._sockets = []
+
+    def tearDown(self):
+        self._launcher._servers.clear()
+        for listener in self._sockets:
+            listener.close()
+
+    def _add(self, jar, heap, busy=False, used=0.0):  # a server listening on a free port
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self._sockets.append(listener)
+        port = listener.getsockname()[1]
+        self._launcher._servers[port] = {'jar': jar, 'heap': heap, 'process': Process(), 'busy': busy, 'used': used}
+
+        return port
+
+    def test_megabytes(self):
+        self.assertEqual(JavaLauncher._megabytes('-Xmx2G'), 2048)
+        self.assertEqual(JavaLauncher._megabytes('-Xmx700M'), 700)
+
+    def test_idle(self):  # the smallest idle server of the jar with enough heap
+        small = self._add('mixcr.jar', 512)
+        big = self._add('mixcr.jar', 1024)
+        self._add('migec.jar', 1024)
+        self.assertEqual(self._launcher._idle('mixcr.jar', 512), small)
+        self.assertEqual(self._launcher._idle('mixcr.jar', 1024), big)
+        self._launcher._servers[big]['busy'] = True
+        self.assertIsNone(self._launcher._idle('mixcr.jar', 1024))
+
+    def test_dead(self):  # a stopped server is dropped
+        port = self._add('mixcr.jar', 512)
+        self._launcher._servers[port]['process'].stopped = True
+        self.assertIsNone(self._launcher._idle('mixcr.jar', 512))
+        self.assertEqual(self._launcher._servers, {})
+
+    def test_fit(self):  # the heap of all servers within -m: the least recently used idle servers are stopped
+        old = self._add('migec.jar', 256, used=1.0)
+        recent = self._add('mixcr.jar', 256, used=2.0)
+        busy = self._add('mixcr.jar', 512, busy=True)
+        self.assertTrue(self._launcher._fit(256))
+        self.assertEqual(sorted(self._launcher._servers), sorted([recent, busy]))
+        self.assertFalse(self._launcher._fit(1024))
+        self.assertEqual(list(self._launcher._servers), [busy])
+        self.assertTrue(self._launcher._servers[busy]['process'].poll() is None)
+        self.assertNotIn(old, self._launcher._servers)
+
+    def test_called(self):  # a finished call frees its server, the server of a killed call is stopped
+        port = self._add('mixcr.jar', 512, busy=True)
+        self._launcher.called(port)
+        self.assertFalse(self._launcher._servers[port]['busy'])
+        process = self._launcher._servers[port]['process']
+        self._launcher.called(port, killed=True)
+        self.assertNotIn(port, self._launcher._servers)
+        self.assertTrue(process.stopped)
+
+# end of class JavaLauncherTest
+
+
+if __name__ == '__main__':
+    unittest.main()
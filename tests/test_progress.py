@@ -0,0 +1,92 @@
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+from lib.executor import Task
+from lib.progress import Progress
+
+
+class ProgressTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _task(self, step, sample, start=None):
+        task = Task(None, 'MIXCR', step, sample)
+        task.start = start or time.time()
+        return task
+
+    def _finish(self, progress, task, seconds):
+        task.end = task.start + seconds
+        task.done = True
+        progress.finished(task)
+
+    def test_parse(self):
+        self.assertEqual(Progress.parse('Alignment: 42.1%  ETA: 00:01:05'),
+                         {'phase': 'Alignment', 'percent': 42.1, 'eta_s': 65})
+        self.assertEqual(Progress.parse('Building clones: 7%'), {'phase': 'Building clones', 'percent': 7.0})
+        self.assertEqual(Progress.parse('[Mon Oct 12 +00m05s] Processed 1,000,000 reads, 50 MIGs'),
+                         {'reads': 1000000})
+        self.assertEqual(Progress.parse('Total sequencing reads: 1234'), {'total': 1234})
+        self.assertEqual(Progress.parse('Analysis finished'), {})
+
+    def test_steps(self):  # the running steps, the samples and the status file
+        progress = Progress(self._dir)
+        progress.start(4)
+        align = self._task('Align', 'S1')
+        progress.started(align)
+        progress.update('MIXCR', 'Align', 'S1', b'Alignment: 50%\rAlignment: 60%  ETA: 00:00:10\n')
+        status = progress.status()
+        self.assertEqual(status['state'], 'running')
+        self.assertEqual(status['running'][0]['phase'], 'Alignment')
+        self.assertEqual(status['running'][0]['percent'], 60.0)
+        self.assertEqual(status['running'][0]['eta_s'], 10)
+        self.assertEqual(status['samples']['S1']['state'], 'running')
+        self.assertEqual(status['percent'], 15.0)  # 0.6 of 1 of 4 steps
+
+        self._finish(progress, align, 10)
+        progress.update('MIXCR', 'Align', 'S1', 'Alignment: 70%')  # the step is done
+        status = progress.status()
+        self.assertEqual((status['steps_done'], status['running']), (1, []))
+        self.assertEqual(status['samples']['S1'], {'steps_done': 1, 'stage': 'MIXCR', 'step': 'Align',
+                                                   'state': 'waiting'})
+
+        failed = self._task('Assemble', 'S1')
+        progress.started(failed)
+        progress.finished(failed)
+        progress.close(failed)
+        with open(progress.get_file(), 'r') as file:
+            status = json.load(file)
+        self.assertEqual((status['state'], status['steps_failed']), ('error', 1))
+        self.assertEqual(status['samples']['S1']['state'], 'failed')
+
+    def test_shards(self):  # the reads of the shards of a step are summed
+        progress = Progress(self._dir)
+        progress.start(1)
+        progress.started(self._task('CheckoutBatch', None))
+        first, second = object(), object()
+        progress.update('MIXCR', 'CheckoutBatch', None, 'Processed 100 reads', first)
+        progress.update('MIXCR', 'CheckoutBatch', None, 'Processed 300 reads', second)
+        progress.update('MIXCR', 'CheckoutBatch', None, 'Processed 200 reads', first)
+        self.assertEqual(progress.status()['running'][0]['reads'], 500)
+
+    def test_straggler(self):  # a step much longer than the same step of the other samples
+        progress = Progress(self._dir)
+        progress.start(4)
+        for sample in ('S1', 'S2'):
+            self._finish(progress, self._task('Align', sample, time.time() - 100), 20)
+        progress.started(self._task('Align', 'S3', time.time() - 60))
+        progress.started(self._task('Align', 'S4', time.time() - 5))
+        status = progress.status()
+        self.assertEqual(status['stragglers'], ['S3'])
+        self.assertAlmostEqual(status['samples']['S4']['eta_s'], 15, delta=1)  # the median time of the step
+
+# end of class ProgressTest
+
+
+if __name__ == '__main__':
+    unittest.main()
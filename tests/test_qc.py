@@ -0,0 +1,123 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from lib.qc import FastqQC
+from lib.inout import Workers
+from lib.tools import SampleTable
+
+HEADER = 'Sample_name\tChain\tBarcode\tR1\tR2\tBaseline\tSubject_id\tAntigen\tReads_exp\n'
+
+
+def setUpModule():
+    Workers(2)
+
+
+def fastq(file_name, n_reads, mate, start=0, names=None):
+    with gzip.open(file_name, 'wb') as file:
+        for i in range(start, start + n_reads):
+            name = names[i] if names else 'read{}'.format(i)
+            file.write('@{}/{} extra\nACGTACGT\n+\nIIIIIIII\n'.format(name, mate).encode())
+
+
+class FastqQCTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._in_dir = self._dir + '/in'
+        os.makedirs(self._in_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _samples(self, *samples):  # (the sample name, R1, R2, reads_exp)
+        with open(self._in_dir + '/SampleInfo.txt', 'w') as file:
+            file.write(HEADER)
+            for name, r1, r2, reads_exp in samples:
+                file.write('\t'.join((name, 'TRB', 'ACGT', r1, r2, 'baseline', 'subject', 'antigen',
+                                      str(reads_exp))) + '\n')
+
+        return SampleTable(self._in_dir)
+
+    def _pair(self, name, n1, n2=None, names2=None):
+        r1, r2 = '{}_R1.fastq.gz'.format(name), '{}_R2.fastq.gz'.format(name)
+        fastq(self._in_dir + '/' + r1, n1, 1)
+        fastq(self._in_dir + '/' + r2, n1 if n2 is None else n2, 2, names=names2)
+
+        return r1, r2
+
+    def _table(self, qc):
+        with open(qc.get_file(), 'r') as file:
+            return [line.rstrip('\n').split('\t') for line in file][1:]
+
+    def test_pairs(self):
+        r1, r2 = self._pair('run', 300)
+        r3, r4 = self._pair('low', 10)
+        qc = FastqQC(self._samples(('S1', r1, r2, 100), ('S2', r1, r2, 100), ('S3', r3, r4, 20)), self._dir)
+        qc.run()
+        self.assertEqual([(row[0], row[3], row[4], row[5], row[6]) for row in self._table(qc)],
+                         [('S1', '300', '200', '1.500', 'OK'), ('S2', '300', '200', '1.500', 'OK'),
+                          ('S3', '10', '20', '0.500', 'LOW')])
+
+    def test_chunks(self):  # the records split by the chunks
+        r1, r2 = self._pair('run', 1000)
+        qc = FastqQC(self._samples(('S1', r1, r2, 1000)), self._dir)
+        qc.chunk_size = 100
+        self.assertEqual(qc.check_pair(self._in_dir + '/' + r1, self._in_dir + '/' + r2), 1000)
+
+    def test_workers(self):  # the batches of a big pair are checked by the worker processes
+        names = ['read{}'.format(i) for i in range(3000)]
+        names[2500] = 'other'
+        for n2, names2, result in ((3000, None, ('3000', 'OK', '')),
+                                   (3000, names, ('NA', 'ERROR', 'different read names in the record 2501')),
+                                   (2999, None, ('NA', 'ERROR', 'different numbers of reads'))):
+            with self.subTest(result=result):
+                r1, r2 = self._pair('run', 3000, n2, names2)
+                qc = FastqQC(self._samples(('S1', r1, r2, 3000)), self._dir, n_workers=2)
+                qc.chunk_size = 4096
+                qc.parallel_size = 0
+                try:
+                    qc.run()
+                except Exception as error:
+                    self.assertIn('Wrong input FASTQ files', str(error))
+                row = self._table(qc)[0]
+                self.assertEqual((row[3], row[6], row[7][-len(result[2]):] if result[2] else row[7]), result)
+
+    def test_errors(self):
+        names = ['read{}'.format(i) for i in range(50)]
+        names[42] = 'other'
+        for n2, names2, error in ((50, names, 'different read names in the record 43'),
+                                  (49, None, 'different numbers of reads')):
+            with self.subTest(error=error):
+                r1, r2 = self._pair('run', 50, n2, names2)
+                qc = FastqQC(self._samples(('S1', r1, r2, 50)), self._dir)
+                with self.assertRaisesRegex(Exception, 'Wrong input FASTQ files'):
+                    qc.run()
+                row = self._table(qc)[0]
+                self.assertEqual(row[6], 'ERROR')
+                self.assertIn(error, row[7])
+
+    def test_truncated(self):
+        r1, r2 = self._pair('run', 20)
+        with gzip.open(self._in_dir + '/' + r2, 'ab') as file:
+            file.write(b'@read20/2\nACGT\n')
+        qc = FastqQC(self._samples(('S1', r1, r2, 20)), self._dir)
+        with self.assertRaisesRegex(Exception, 'the last record is truncated'):
+            qc.check_pair(self._in_dir + '/' + r1, self._in_dir + '/' + r2)
+
+    def test_wrong_record(self):
+        r1, r2 = self._pair('run', 20)
+        with gzip.open(self._in_dir + '/' + r1, 'ab') as file:
+            file.write(b'read20/1\nACGT\n+\nIIII\n')
+        with gzip.open(self._in_dir + '/' + r2, 'ab') as file:
+            file.write(b'@read20/2\nACGT\n+\nIIII\n')
+        qc = FastqQC(self._samples(('S1', r1, r2, 20)), self._dir)
+        with self.assertRaisesRegex(Exception, 'wrong FASTQ record 21'):
+            qc.check_pair(self._in_dir + '/' + r1, self._in_dir + '/' + r2)
+
+# end of class FastqQCTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from lib.subsample import Subsampler
+
+
+def fastq(file_name, n_reads, mate):
+    with gzip.open(file_name, 'wb') as file:
+        for i in range(n_reads):
+            file.write('@read{} {}\nACGT{}\n+\nIIII{}\n'.format(i, mate, 'A' * (i % 7), 'I' * (i % 7)).encode())
+
+
+def names(file_name):
+    with gzip.open(file_name, 'rb') as file:
+        return [line.split()[0].decode() for i, line in enumerate(file) if i % 4 == 0]
+
+
+class SubsamplerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._in_dir = self._dir + '/assemble'
+        os.makedirs(self._in_dir)
+        fastq(self._in_dir + '/S1_R1.t4.cf.fastq.gz', 1000, 1)
+        fastq(self._in_dir + '/S1_R2.t4.cf.fastq.gz', 1000, 2)
+        fastq(self._in_dir + '/S2_R1.t4.cf.fastq.gz', 50, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _read(self, subsampler, file_name):
+        with open('{}/{}'.format(subsampler.get_dir(), file_name), 'rb') as file:
+            return file.read()
+
+    def test_pair(self):
+        subsampler = Subsampler(self._dir)
+        output = subsampler.subsample(self._in_dir, 'S1', 100)
+        self.assertIn('100 of 1000 reads', output)
+        r1 = names('{}/S1_R1.t4.cf.fastq.gz'.format(subsampler.get_dir()))
+        r2 = names('{}/S1_R2.t4.cf.fastq.gz'.format(subsampler.get_dir()))
+        self.assertEqual(len(r1), 100)
+        self.assertEqual(r1, r2)  # the mates of the same reads
+        self.assertEqual(r1, sorted(r1, key=lambda name: int(name[5:])))  # the read order is kept
+        self.assertEqual(len(set(r1)), 100)
+
+    def test_records(self):  # the records are copied as they are
+        subsampler = Subsampler(self._dir)
+        subsampler.subsample(self._in_dir, 'S1', 10)
+        with gzip.open('{}/S1_R1.t4.cf.fastq.gz'.format(subsampler.get_dir()), 'rb') as file:
+            lines = file.read().split(b'\n')
+        for header, seq, plus, qual in zip(lines[0::4], lines[1::4], lines[2::4], lines[3::4]):
+            i = int(header.split()[0][5:])
+            self.assertEqual((seq, plus, qual), (b'ACGT' + b'A' * (i % 7), b'+', b'IIII' + b'I' * (i % 7)))
+
+    def test_same_bytes(self):  # the same seed and sample give the same files, another seed another sample
+        first = Subsampler(self._dir + '/1', seed=7)
+        first.subsample(self._in_dir, 'S1', 100)
+        second = Subsampler(self._dir + '/2', seed=7)
+        second.subsample(self._in_dir, 'S1', 100)
+        other = Subsampler(self._dir + '/3', seed=8)
+        other.subsample(self._in_dir, 'S1', 100)
+        for file_name in ('S1_R1.t4.cf.fastq.gz', 'S1_R2.t4.cf.fastq.gz'):
+            self.assertEqual(self._read(first, file_name), self._read(second, file_name))
+            self.assertNotEqual(self._read(first, file_name), self._read(other, file_name))
+
+    def test_shallow(self):  # a sample below the target depth is kept, the single reads too
+        subsampler = Subsampler(self._dir)
+        output = subsampler.subsample(self._in_dir, 'S2', 100)
+        self.assertIn('50 of 50 reads', output)
+        self.assertEqual(names('{}/S2_R1.t4.cf.fastq.gz'.format(subsampler.get_dir())),
+                         ['@read{}'.format(i) for i in range(50)])
+
+    def test_count(self):  # the last record without the line end is counted
+        file_name = self._dir + '/no_end.fastq.gz'
+        with gzip.open(file_name, 'wb') as file:
+            file.write(b'@read0\nACGT\n+\nIIII\n@read1\nACGT\n+\nIIII')
+        self.assertEqual(Subsampler._count(file_name), 2)
+        self.assertEqual(Subsampler._count(self._in_dir + '/S1_R1.t4.cf.fastq.gz'), 1000)
+
+    def test_min_reads(self):  # the assembled reads of the shallowest sample, the empty ones are left out
+        fastq(self._in_dir + '/S3_R1.t4.cf.fastq.gz', 0, 1)
+        subsampler = Subsampler(self._dir)
+        self.assertEqual(subsampler.reads(self._in_dir, 'S1'), 1000)
+        self.assertEqual(subsampler.min_reads(self._in_dir, ['S1', 'S2', 'S3']), 50)
+        self.assertEqual(subsampler.min_reads(self._in_dir, ['S3']), 0)
+
+    def test_no_target(self):
+        with self.assertRaisesRegex(Exception, 'no target depth'):
+            Subsampler(self._dir).subsample(self._in_dir, 'S1', None)
+
+# end of class SubsamplerTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from lib.vdj import ClonotypeConverter
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def read(file_name):
+    with open(file_name, 'r') as file:
+        return file.read()
+
+
+class ClonotypeConverterTest(unittest.TestCase):
+    # the expected vdj.* and nc.vdj.* tables of tests/data for the 'analyze' (MiXCR 3 column names) and
+    # 'exportClones' (the headers of the older MiXCR) tables are written by hand in the VDJtools format, they are not
+    # checked against the jar yet: tests/vdjtools_golden.py replaces them with the tables of the jar
+    tables = ('analyze.clonotypes.TRB.txt', 'exportClones.clonotypes.TRB.txt')
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _convert(self, table, converter=None):
+        vdj_file = '{}/vdj.{}'.format(self._dir, table)
+        nc_file = '{}/nc.vdj.{}'.format(self._dir, table)
+        counts = (converter or ClonotypeConverter()).convert(os.path.join(DATA_DIR, table), vdj_file, nc_file)
+
+        return counts, vdj_file, nc_file
+
+    def test_tables(self):
+        for table, counts in zip(self.tables, ((5, 3), (3, 2))):
+            with self.subTest(table=table):
+                n_rows, vdj_file, nc_file = self._convert(table)
+                self.assertEqual(n_rows, counts)
+                self.assertEqual(read(vdj_file), read(os.path.join(DATA_DIR, 'vdj.' + table)))
+                self.assertEqual(read(nc_file), read(os.path.join(DATA_DIR, 'nc.vdj.' + table)))
+
+    def test_chunks(self):  # the rows split into several chunks, the short rows among them
+        for table in self.tables:
+            with self.subTest(table=table):
+                converter = ClonotypeConverter()
+                converter.chunk_size = 2
+                _, vdj_file, nc_file = self._convert(table, converter)
+                self.assertEqual(read(vdj_file), read(os.path.join(DATA_DIR, 'vdj.' + table)))
+                self.assertEqual(read(nc_file), read(os.path.join(DATA_DIR, 'nc.vdj.' + table)))
+
+    def test_fractional_counts(self):  # rounded half up, the frequencies are of the exact counts
+        lines = read(os.path.join(DATA_DIR, 'vdj.analyze.clonotypes.TRB.txt')).splitlines()[1:]
+        self.assertEqual([line.split('\t')[:2] for line in lines[1::2]],
+                         [['13', ClonotypeConverter.java_double(12.5 / 119)],
+                          ['3', ClonotypeConverter.java_double(2.5 / 119)]])
+
+    def test_java_double(self):
+        for value, text in ((0, '0.0'), (2, '2.0'), (0.25, '0.25'), (1e-3, '0.001'), (9.99e-4, '9.99E-4'),
+                            (1e-5, '1.0E-5'), (1.25e-7, '1.25E-7'), (9999999.0, '9999999.0'), (1e7, '1.0E7'),
+                            (12345678.0, '1.2345678E7')):
+            with self.subTest(value=value):
+                self.assertEqual(ClonotypeConverter.java_double(value), text)
+
+    def test_wrong_table(self):
+        file_name = '{}/wrong.txt'.format(self._dir)
+        with open(file_name, 'w') as file:
+            file.write('cloneId\tcloneCount\n0\t1\n')
+        with self.assertRaisesRegex(Exception, 'Not a MiXCR clonotypes table'):
+            ClonotypeConverter().convert(file_name, '{}/vdj.txt'.format(self._dir))
+
+    @unittest.skipUnless(os.environ.get('VDJTOOLS_JAR') and shutil.which('java'),
+                         'VDJTOOLS_JAR is not set or no java')
+    def test_vdjtools(self):  # the same tables as of 'Convert -S mixcr' and 'FilterNonFunctional' of the jar
+        jar = os.environ['VDJTOOLS_JAR']
+        for table in self.tables:
+            with self.subTest(table=table):
+                java_dir = '{}/java'.format(self._dir)
+                in_file = os.path.join(DATA_DIR, table)
+                subprocess.check_call(['java', '-jar', jar, 'Convert', '-S', 'mixcr', in_file, java_dir + '/vdj'])
+                subprocess.check_call(['java', '-jar', jar, 'FilterNonFunctional',
+                                       '{}/vdj.{}'.format(java_dir, table), java_dir + '/nc'])
+                _, vdj_file, nc_file = self._convert(table)
+                self.assertEqual(read(vdj_file), read('{}/vdj.{}'.format(java_dir, table)))
+                self.assertEqual(read(nc_file), read('{}/nc.vdj.{}'.format(java_dir, table)))
+
+# end of class ClonotypeConverterTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# TCRFactory: the expected vdj.* and nc.vdj.* tables of tests/data made by the real VDJtools jar ('Convert -S mixcr'
+# and 'FilterNonFunctional'), and the differences of the python backend (see ClonotypeConverter) from them.
+# The tables written by hand are replaced, so the commit of the new tables is the check of the python backend.
+
+import os
+import sys
+import shutil
+import difflib
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.vdj import ClonotypeConverter
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+TABLES = ('analyze.clonotypes.TRB.txt', 'exportClones.clonotypes.TRB.txt')
+
+
+def jar_tables(jar, table, out_dir):  # the vdj.* and nc.vdj.* files of the jar
+    in_file = os.path.join(DATA_DIR, table)
+    subprocess.check_call(['java', '-jar', jar, 'Convert', '-S', 'mixcr', in_file, out_dir + '/vdj'])
+    subprocess.check_call(['java', '-jar', jar, 'FilterNonFunctional', '{}/vdj.{}'.format(out_dir, table),
+                           out_dir + '/nc'])
+
+    return '{}/vdj.{}'.format(out_dir, table), '{}/nc.vdj.{}'.format(out_dir, table)
+
+
+def main():
+    input_parser = argparse.ArgumentParser(description='The expected VDJtools tables of the tests made by the jar.')
+    input_parser.add_argument('-j', metavar='/path/to/vdjtools.jar', default=os.environ.get('VDJTOOLS_JAR'),
+                              required='VDJTOOLS_JAR' not in os.environ, help='the VDJtools jar (or VDJTOOLS_JAR)')
+    input_parser.add_argument('-n', action='store_true', help='only show the differences, keep tests/data')
+    args = input_parser.parse_args()
+
+    n_diffs = 0
+    work_dir = tempfile.mkdtemp()
+    try:
+        for table in TABLES:
+            jar_dir, python_dir = work_dir + '/jar', work_dir + '/python'
+            expected = jar_tables(args.j, table, jar_dir)
+            ClonotypeConverter().convert(os.path.join(DATA_DIR, table), '{}/vdj.{}'.format(python_dir, table),
+                                         '{}/nc.vdj.{}'.format(python_dir, table))
+            for expected_file in expected:
+                name = os.path.basename(expected_file)
+                with open(expected_file, 'r') as file:
+                    jar_lines = file.readlines()
+                with open('{}/{}'.format(python_dir, name), 'r') as file:
+                    python_lines = file.readlines()
+                diff = list(difflib.unified_diff(jar_lines, python_lines, 'jar/' + name, 'python/' + name))
+                n_diffs += bool(diff)
+                sys.stdout.writelines(diff)
+                if not args.n:
+                    shutil.copyfile(expected_file, os.path.join(DATA_DIR, name))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('{} of {} tables differ from the jar'.format(n_diffs, 2 * len(TABLES)))
+    return 1 if n_diffs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())